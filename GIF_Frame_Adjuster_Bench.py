@@ -0,0 +1,413 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from GIF_Frame_Adjuster_Core import (
+    write_gif, plan_kept_frames, decimate_gif, DecimationUnsupported, GIFFormatError, resolve_ffmpeg_tools, ToolResolutionError
+)
+
+try:
+    import resource # 只有 POSIX 平台提供，用於子行程 CPU 時間
+except ImportError:
+    resource = None
+
+
+# --- 合成測試素材 ---
+
+BENCH_CORPUS_VERSION = 1 # 產生方式改變時遞增，避免沿用舊素材
+BENCH_CORPUS_DIR = os.path.join('.', 'driver', 'bench_corpus')
+BENCH_STAGES = ("probe", "process", "native", "verify")
+STARTUP_STAGE = "startup" # GUI 冷啟動，與素材無關，只在 --stages 明確指定時執行
+STARTUP_BUDGET_SECONDS = 2.0 # 從啟動行程到視窗第一次繪製的預算 (含直譯器啟動與模組匯入)
+STARTUP_TIMEOUT_SECONDS = 60
+
+# 名稱, 寬, 高, 幀數, 調色盤色數, 延遲模式, 是否使用透明子矩形
+BENCH_CORPUS = (
+    ("small_static", 160, 120, 60, 16, "constant", False),
+    ("ui_recording", 480, 270, 90, 64, "variable", True),
+    ("full_motion", 320, 240, 80, 256, "constant", False),
+    ("large_sparse", 960, 540, 30, 256, "variable", True),
+)
+
+
+def _corpus_palette(color_count, rng):
+    return bytes(rng.randrange(256) for _ in range(3 * color_count))
+
+
+def _corpus_delays(frame_count, mode, rng):
+    if mode == "constant":
+        return [4] * frame_count
+    # 介面錄影常見的不規則延遲：大多很短，偶爾停頓
+    return [rng.choice((2, 3, 4, 5, 8)) if rng.random() < 0.85 else rng.choice((30, 50, 100)) for _ in range(frame_count)]
+
+
+def _box_position(number, width, height, box):
+    span_x = max(1, width - box)
+    span_y = max(1, height - box)
+    x = (number * 7) % (2 * span_x)
+    y = (number * 3) % (2 * span_y)
+    return (x if x < span_x else 2 * span_x - x), (y if y < span_y else 2 * span_y - y)
+
+
+def generate_corpus_gif(path, width, height, frame_count, color_count, delay_mode, transparency, seed):
+    """
+    依固定種子產生合成 GIF：靜態背景上有一個移動的方塊。
+    透明模式下第一幀之後只寫出方塊前後位置的子矩形，未變化的像素為透明；
+    否則每幀都是完整畫面，且背景逐幀捲動 (全畫面變化)。
+    """
+    rng = random.Random(seed)
+    palette = _corpus_palette(color_count, rng)
+    delays = _corpus_delays(frame_count, delay_mode, rng)
+    usable = color_count - 1 if transparency else color_count # 保留最後一個索引作為透明
+    box = max(4, min(width, height) // 6)
+    background = bytes(((x // 8) + (y // 8) * 3) % max(1, usable - 1) for y in range(height) for x in range(width))
+    box_color = usable - 1
+
+    def full_frame(number, shift):
+        pixels = bytearray(width * height)
+        for y in range(height):
+            row_start = ((y + shift) % height) * width
+            pixels[y * width:(y + 1) * width] = background[row_start:row_start + width]
+        bx, by = _box_position(number, width, height, box)
+        for y in range(by, by + box):
+            pixels[y * width + bx:y * width + bx + box] = bytes((box_color,)) * box
+        return bytes(pixels)
+
+    frames = []
+    previous = None
+    for number in range(frame_count):
+        if not transparency or number == 0:
+            frames.append({"rect": (0, 0, width, height), "indices": full_frame(number, 0 if transparency else number),
+                           "delay": delays[number], "disposal": 1, "transparent_index": None})
+            previous = _box_position(number, width, height, box)
+            continue
+        current = _box_position(number, width, height, box)
+        left, top = min(previous[0], current[0]), min(previous[1], current[1])
+        right, bottom = max(previous[0], current[0]) + box, max(previous[1], current[1]) + box
+        transparent_index = color_count - 1
+        indices = bytearray()
+        for y in range(top, bottom):
+            for x in range(left, right):
+                in_new = current[0] <= x < current[0] + box and current[1] <= y < current[1] + box
+                in_old = previous[0] <= x < previous[0] + box and previous[1] <= y < previous[1] + box
+                if in_new:
+                    indices.append(transparent_index if in_old else box_color)
+                else:
+                    indices.append(background[y * width + x] if in_old else transparent_index)
+        frames.append({"rect": (left, top, right - left, bottom - top), "indices": bytes(indices),
+                       "delay": delays[number], "disposal": 1, "transparent_index": transparent_index})
+        previous = current
+    write_gif(path, width, height, palette, frames)
+
+
+def ensure_corpus(corpus_dir, case_names=None):
+    """
+    產生 (或重用已存在的) 合成素材，返回 {名稱: 路徑}。檔名含版本與參數，參數不同時不會誤用舊檔。
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = {}
+    for name, width, height, frame_count, color_count, delay_mode, transparency in BENCH_CORPUS:
+        if case_names and name not in case_names:
+            continue
+        file_name = f"v{BENCH_CORPUS_VERSION}_{name}_{width}x{height}_{frame_count}f_{color_count}c.gif"
+        path = os.path.join(corpus_dir, file_name)
+        if not os.path.exists(path):
+            print(f"產生素材 {file_name}...")
+            temp_path = path + '.tmp'
+            generate_corpus_gif(temp_path, width, height, frame_count, color_count, delay_mode, transparency, seed=name)
+            os.replace(temp_path, path)
+        paths[name] = path
+    return paths
+
+
+# --- 單一階段的量測 (在獨立子行程中執行) ---
+
+def _children_cpu_seconds():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_stage(stage, input_gif_path, output_gif_path, ffmpeg_path, ffprobe_path):
+    """
+    執行一個階段並返回結果字典。在空白的工作資料夾中執行，探測與調色盤快取都是冷的。
+    probe/verify 探測 GIF 資訊；process 以 FFmpeg 路徑 (保留延遲) 處理為一半幀數；native 以原生抽幀處理。
+    """
+    # 延遲匯入：GUI 模組依賴 PyQt6，只在需要時載入
+    from GIF_Frame_Adjuster_GUI_V2 import get_gif_info_backend, process_gif_backend
+
+    result = {"ok": False, "message": "", "wall": None, "cpu": None, "output_size": None, "frames": None}
+    if stage == "verify":
+        input_gif_path = output_gif_path
+    info = get_gif_info_backend(ffprobe_path, input_gif_path) if stage in ("process", "native") else None
+    target_frame_count = max(1, info["total_frames"] // 2) if info else None
+
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time() + _children_cpu_seconds()
+    if stage in ("probe", "verify"):
+        info = get_gif_info_backend(ffprobe_path, input_gif_path)
+        result["ok"] = not info.get("error")
+        result["message"] = info.get("error") or ""
+        result["frames"] = info.get("total_frames")
+    elif stage == "process":
+        frame_plan = plan_kept_frames(info["frame_delays"], target_frame_count) if info.get("frame_delays") else None
+        target_fps = target_frame_count / info["total_frames"] * info["avg_fps"]
+        result["ok"], result["message"], _ = process_gif_backend(
+            ffmpeg_path, input_gif_path, output_gif_path, target_fps,
+            show_progress_messages=False, target_frame_count=target_frame_count, frame_plan=frame_plan
+        )
+    elif stage == "native":
+        try:
+            stats = decimate_gif(input_gif_path, output_gif_path, target_frame_count)
+            result["ok"] = stats is not None
+            result["message"] = f"重新合成 {stats['recomposited']} 幀" if stats else ""
+        except (DecimationUnsupported, GIFFormatError) as e:
+            result["message"] = str(e)
+    result["wall"] = time.perf_counter() - wall_started
+    result["cpu"] = time.process_time() + _children_cpu_seconds() - cpu_started if resource is not None else None
+    if stage in ("process", "native") and os.path.exists(output_gif_path):
+        result["output_size"] = os.path.getsize(output_gif_path)
+    return result
+
+
+def measure_stage(stage, input_gif_path, output_gif_path, ffmpeg_path, ffprobe_path, work_dir):
+    """
+    在子行程中執行一個階段，返回結果字典並加上 peak_rss (位元組，整個子行程樹的峰值；不支援的平台為 None)。
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--worker', stage,
+               os.path.abspath(input_gif_path), os.path.abspath(output_gif_path), ffmpeg_path, ffprobe_path]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')))))
+    process = subprocess.Popen(command, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    if hasattr(os, 'wait4'):
+        stdout = process.stdout.read()
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # Linux 的 ru_maxrss 單位為 KiB，macOS 為位元組
+        peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    else:
+        stdout, stderr = process.communicate()
+        peak_rss = None
+    lines = stdout.decode('utf-8', errors='replace').strip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        last_error = stderr.decode('utf-8', errors='replace').strip().splitlines()
+        result = {"ok": False, "message": last_error[-1] if last_error else f"子行程返回碼 {process.returncode}",
+                  "wall": None, "cpu": None, "output_size": None, "frames": None}
+    result["peak_rss"] = peak_rss
+    return result
+
+
+def measure_startup(work_dir):
+    """
+    以 GIF_ADJUSTER_STARTUP_PROBE 啟動 GUI，返回結果字典：wall 為從建立行程到第一次繪製的時間，
+    first_paint 為 GUI 自行量測 (從模組載入開始) 的部分，deferred_modules_loaded 為第一次繪製時已載入的延後模組。
+    沒有顯示器的 Linux 環境使用 offscreen 平台。
+    """
+    gui_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GIF_Frame_Adjuster_GUI_V2.py')
+    env = dict(os.environ, GIF_ADJUSTER_STARTUP_PROBE='1')
+    if sys.platform.startswith('linux') and not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    result = {"ok": False, "message": "", "wall": None, "cpu": None, "output_size": None, "frames": None,
+              "first_paint": None, "deferred_modules_loaded": None, "peak_rss": None}
+    started_at = time.time()
+    process = subprocess.Popen([sys.executable, gui_path], cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    try:
+        stdout, stderr = process.communicate(timeout=STARTUP_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        result["message"] = f"{STARTUP_TIMEOUT_SECONDS} 秒內沒有完成第一次繪製"
+        return result
+    for line in stdout.decode('utf-8', errors='replace').splitlines():
+        try:
+            probe = json.loads(line)
+        except ValueError:
+            continue
+        result["ok"] = True
+        result["first_paint"] = probe["first_paint"]
+        result["deferred_modules_loaded"] = probe.get("deferred_modules_loaded")
+        result["wall"] = probe["painted_at"] - started_at
+        return result
+    last_error = stderr.decode('utf-8', errors='replace').strip().splitlines()
+    result["message"] = last_error[-1] if last_error else f"子行程返回碼 {process.returncode}"
+    return result
+
+
+def run_startup_benchmark(repeat, budget):
+    runs = []
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix='gif_bench_')
+        try:
+            runs.append(measure_startup(work_dir))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    wall_median = _median(run["wall"] for run in runs)
+    entry = {
+        "case": "gui",
+        "stage": STARTUP_STAGE,
+        "ok": all(run["ok"] for run in runs) and wall_median is not None and wall_median <= budget,
+        "wall_median": wall_median,
+        "cpu_median": None,
+        "peak_rss_max": None,
+        "output_size": None,
+        "first_paint_median": _median(run["first_paint"] for run in runs),
+        "budget": budget,
+        "runs": runs,
+    }
+    print(format_entry(entry))
+    if wall_median is not None and wall_median > budget:
+        print(f"❌ 啟動時間 {wall_median:.3f}s 超過預算 {budget:.3f}s")
+    return entry
+
+
+# --- 彙整與比較 ---
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else None
+
+
+def ffmpeg_version(ffmpeg_path):
+    try:
+        output = subprocess.run([ffmpeg_path, '-version'], capture_output=True, text=True, timeout=10).stdout
+        return output.splitlines()[0] if output else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(corpus, ffmpeg_path, ffprobe_path, repeat, stages):
+    results = []
+    for name, input_gif_path in corpus.items():
+        for stage in stages:
+            runs = []
+            for _ in range(repeat):
+                # 每次都在新的工作資料夾執行 (冷快取)；verify 需要 process 的輸出，故同一資料夾先執行 process
+                work_dir = tempfile.mkdtemp(prefix='gif_bench_')
+                try:
+                    output_gif_path = os.path.join(work_dir, 'output.gif')
+                    if stage == "verify":
+                        measure_stage("process", input_gif_path, output_gif_path, ffmpeg_path, ffprobe_path, work_dir)
+                        shutil.rmtree(os.path.join(work_dir, 'driver'), ignore_errors=True)
+                    runs.append(measure_stage(stage, input_gif_path, output_gif_path, ffmpeg_path, ffprobe_path, work_dir))
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+            entry = {
+                "case": name,
+                "stage": stage,
+                "ok": all(run["ok"] for run in runs),
+                "wall_median": _median(run["wall"] for run in runs),
+                "cpu_median": _median(run["cpu"] for run in runs),
+                "peak_rss_max": max((run["peak_rss"] for run in runs if run["peak_rss"] is not None), default=None),
+                "output_size": runs[-1]["output_size"],
+                "runs": runs,
+            }
+            results.append(entry)
+            print(format_entry(entry))
+    return results
+
+
+def format_entry(entry, baseline=None):
+    wall = f"{entry['wall_median']:.3f}s" if entry["wall_median"] is not None else "-"
+    cpu = f"{entry['cpu_median']:.3f}s" if entry["cpu_median"] is not None else "-"
+    rss = f"{entry['peak_rss_max'] / (1024 * 1024):.1f}MiB" if entry["peak_rss_max"] is not None else "-"
+    size = f"{entry['output_size'] / 1024:.1f}KiB" if entry["output_size"] is not None else "-"
+    line = f"{'✅' if entry['ok'] else '❌'} {entry['case']:<14} {entry['stage']:<8} 牆鐘 {wall:>9} CPU {cpu:>9} 峰值 {rss:>9} 輸出 {size:>10}"
+    if baseline and baseline.get("wall_median") and entry["wall_median"] is not None:
+        change = (entry["wall_median"] / baseline["wall_median"] - 1) * 100
+        line += f"  ({change:+.1f}% 牆鐘)"
+    return line
+
+
+def print_comparison(results, baseline_path):
+    """
+    與先前的 JSON 結果比較，依 (素材, 階段) 對照並輸出牆鐘時間變化。
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get("corpus_version") != BENCH_CORPUS_VERSION:
+        print(f"注意：基準檔的素材版本 ({baseline.get('corpus_version')}) 與目前 ({BENCH_CORPUS_VERSION}) 不同，結果不可直接比較。")
+    previous = {(entry["case"], entry["stage"]): entry for entry in baseline.get("results", [])}
+    print(f"\n--- 與 {baseline_path} 比較 ---")
+    for entry in results:
+        print(format_entry(entry, previous.get((entry["case"], entry["stage"]))))
+
+
+def find_default_tools():
+    # 與 GUI/CLI 相同的解析順序：環境變數、設定檔、安裝清單、./driver、PATH
+    try:
+        ffmpeg_path, ffprobe_path, _ = resolve_ffmpeg_tools()
+    except ToolResolutionError:
+        return None, None
+    return [os.path.abspath(path) if path else None for path in (ffmpeg_path, ffprobe_path)]
+
+
+def main(argv):
+    if argv[:1] == ['--worker']:
+        stage, input_gif_path, output_gif_path, ffmpeg_path, ffprobe_path = argv[1:6]
+        print(json.dumps(run_stage(stage, input_gif_path, output_gif_path, ffmpeg_path, ffprobe_path)))
+        return 0
+
+    default_ffmpeg, default_ffprobe = find_default_tools()
+    parser = argparse.ArgumentParser(description="GIF 幀數調整工具效能基準：以固定的合成素材量測探測、處理與檢驗。")
+    parser.add_argument('-o', '--output', default='bench_results.json', help="結果 JSON 檔 (預設: bench_results.json)")
+    parser.add_argument('-n', '--repeat', type=int, default=3, help="每個階段重複次數，取中位數 (預設: 3)")
+    parser.add_argument('--cases', default=None, help="只執行指定素材，以逗號分隔 (可用: " + ", ".join(c[0] for c in BENCH_CORPUS) + ")")
+    parser.add_argument('--stages', default=",".join(BENCH_STAGES), help=f"執行的階段，以逗號分隔 (預設: 全部素材階段；{STARTUP_STAGE} 量測 GUI 冷啟動)")
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_SECONDS, help=f"{STARTUP_STAGE} 階段的時間預算，超過時結束碼非零 (預設: {STARTUP_BUDGET_SECONDS} 秒)")
+    parser.add_argument('--corpus-dir', default=BENCH_CORPUS_DIR, help="合成素材資料夾")
+    parser.add_argument('--compare', default=None, metavar='JSON', help="與先前的結果 JSON 比較")
+    parser.add_argument('--ffmpeg', default=default_ffmpeg, help="FFmpeg 路徑")
+    parser.add_argument('--ffprobe', default=default_ffprobe, help="FFprobe 路徑")
+    args = parser.parse_args(argv)
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    if any(stage not in BENCH_STAGES + (STARTUP_STAGE,) for stage in stages):
+        parser.error(f"未知的階段，可用: {', '.join(BENCH_STAGES + (STARTUP_STAGE,))}")
+    if args.repeat <= 0:
+        parser.error("重複次數必須是正整數。")
+    corpus_stages = [stage for stage in stages if stage != STARTUP_STAGE]
+    if corpus_stages and (not args.ffmpeg or not args.ffprobe):
+        parser.error("找不到 FFmpeg/FFprobe，請以 --ffmpeg/--ffprobe 指定，或先執行主程式自動安裝。")
+
+    results = []
+    if corpus_stages:
+        case_names = {name.strip() for name in args.cases.split(',')} if args.cases else None
+        corpus = ensure_corpus(args.corpus_dir, case_names)
+        if not corpus:
+            parser.error("沒有符合的素材。")
+
+        print(f"\n開始量測 {len(corpus)} 個素材 x {len(corpus_stages)} 個階段 (重複 {args.repeat} 次)...")
+        results += run_benchmark(corpus, args.ffmpeg, args.ffprobe, args.repeat, corpus_stages)
+    if STARTUP_STAGE in stages:
+        print(f"\n量測 GUI 冷啟動到第一次繪製 (重複 {args.repeat} 次，預算 {args.startup_budget:.2f} 秒)...")
+        results.append(run_startup_benchmark(args.repeat, args.startup_budget))
+    report = {
+        "corpus_version": BENCH_CORPUS_VERSION,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version(args.ffmpeg) if args.ffmpeg else None,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+    return 0 if all(entry["ok"] for entry in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,7 +2,29 @@ import subprocess
 import re
 import os
 
+from GIF_Frame_Adjuster_Core import GIFFormatError, read_gif_metadata, gif_info_from_metadata
+
 def get_gif_info(input_gif_path):
+    """
+    優先以原生 GIF 解析器單次讀取檔案，取得精確總幀數與依每幀延遲計算的總時長；
+    原生解析失敗時才改用 ffprobe 推算。
+    同時獲取檔案大小。
+    """
+    try:
+        meta = read_gif_metadata(input_gif_path)
+    except (GIFFormatError, OSError):
+        return _get_gif_info_ffprobe(input_gif_path)
+
+    avg_frame_rate, duration, total_frames = gif_info_from_metadata(meta)
+    try:
+        file_size_mib = os.path.getsize(input_gif_path) / (1024 * 1024) # 轉換為 MiB
+    except Exception as e:
+        print(f"警告: 無法獲取檔案大小: {e}")
+        file_size_mib = None
+
+    return avg_frame_rate, duration, total_frames, file_size_mib
+
+def _get_gif_info_ffprobe(input_gif_path):
     """
     使用 ffprobe 獲取 GIF 的平均幀率、總時長和計算總幀數。
     同時獲取檔案大小。
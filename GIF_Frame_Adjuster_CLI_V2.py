@@ -1,55 +1,58 @@
 import subprocess
 import re
 import os
+import sys
+import glob
+import time
 import shutil
-import requests
-from alive_progress import alive_bar # 確保已安裝: pip install alive-progress requests
+import signal
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from GIF_Frame_Adjuster_Core import (
+    GIFFormatError, probe_gif, CancelToken, run_cancellable, remove_partial_output,
+    generate_palette, build_paletteuse_command, single_pass_filter, read_gif_dimensions,
+    plan_memory_strategy, MemoryLimitExceeded, DEFAULT_JOB_MEMORY_LIMIT_MIB, decimate_gif, DecimationUnsupported,
+    fps_filter, select_frames_filter, DEFAULT_PALETTEUSE_OPTIONS, plan_kept_frames, rewrite_gif_delays, optimize_gif_frames,
+    encode_to_size, format_size_attempt, download_file,
+    check_install_manifest, install_manifest_mismatches, record_installed_tools,
+    frame_difference_scores, plan_frames_by_difference, RunReport, RUN_REPORT_PATH, parse_progress_output,
+    get_ffmpeg_capabilities, physical_core_count, default_job_concurrency, resolve_ffmpeg_tools, ToolResolutionError, bundled_tool_path,
+    extract_archive, native_7z_available, TOOL_BOOTSTRAP_SUPPORTED, TOOL_INSTALL_HINT
+)
 
 # --- FFmpeg 和 7-Zip 自動安裝相關函式 ---
 
-# 下載檔案 (包含進度條)
-def download_file_with_progress(url, local_filename):
+# 下載檔案 (包含進度條)：支援斷點續傳、分段並行下載與 SHA-256 驗證
+def download_file_with_progress(url, local_filename, checksum_url=None):
+    from alive_progress import alive_bar # 只在需要下載時載入 (pip install alive-progress requests)
+
     print(f"開始下載 {os.path.basename(local_filename)}...")
-    os.makedirs(os.path.dirname(local_filename), exist_ok=True) # 確保目錄存在
-    try:
-        with requests.get(url, stream=True) as r, open(local_filename, 'wb') as f:
-            r.raise_for_status() # 檢查 HTTP 請求是否成功
-            file_size = int(r.headers.get('content-length', 0))
-            chunk_size = 8192
-            
-            bar_length = file_size // chunk_size if file_size > chunk_size else 1 # 避免為0
-            if file_size == 0:
-                print("警告: 檔案大小未知，可能無法顯示精確進度條。")
-                bar_length = 100 # 提供一個預設值，讓進度條仍能動
-
-            with alive_bar(bar_length, bar='smooth', spinner='dots_waves', length=40, enrich_print=False) as bar:
-                bar.text(f'下載 {os.path.basename(local_filename)} 進度')
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    f.write(chunk)
-                    bar() # 更新進度條
-                bar(bar_length) # 手動設置進度條到 100%
-
-        print(f"成功下載 {os.path.basename(local_filename)} 到 {local_filename}")
+    with alive_bar(manual=True, bar='smooth', spinner='dots_waves', length=40, enrich_print=False) as bar:
+        bar.text(f'下載 {os.path.basename(local_filename)} 進度')
+        success, message = download_file(
+            url, local_filename, checksum_url=checksum_url,
+            progress_callback=lambda downloaded, total: bar(downloaded / total) if total else None
+        )
+        if success:
+            bar(1.0)
+
+    if success:
+        print(f"成功下載 {os.path.basename(local_filename)} 到 {local_filename}：{message}")
         return local_filename
-    except requests.exceptions.RequestException as e:
-        print(f"下載失敗：{e}")
-        return None
-    except Exception as e:
-        print(f"下載時發生未知錯誤：{e}")
-        return None
+    print(message)
+    return None
 
-# 解壓縮並重新命名 (使用指定的 7za.exe 路徑)
-def extract_and_rename_archive(archive_path, target_directory, new_foldername, seven_zip_exec_path):
+# 解壓縮並重新命名 (以 Python 解壓縮；.7z 在沒有 py7zr 時使用指定的 7za 路徑)
+def extract_and_rename_archive(archive_path, target_directory, new_foldername, seven_zip_exec_path=None):
     print(f"正在解壓縮 {os.path.basename(archive_path)}...")
     if not os.path.exists(target_directory):
         os.makedirs(target_directory)
-    
-    if not os.path.exists(seven_zip_exec_path):
-        print(f"錯誤：解壓縮工具 '{seven_zip_exec_path}' 不存在。無法進行解壓縮。")
-        return None
 
     try:
-        subprocess.run([seven_zip_exec_path, 'x', archive_path, f'-o{target_directory}', '-y'], check=True, capture_output=True, text=True)
+        extract_archive(archive_path, target_directory, seven_zip_exec_path)
         print(f"成功解壓縮 {os.path.basename(archive_path)}")
         
         extracted_items = os.listdir(target_directory)
@@ -106,19 +109,32 @@ def extract_and_rename_archive(archive_path, target_directory, new_foldername, s
         print(f"解壓縮時發生未知錯誤：{e}")
         return None
 
+def _report_manifest_mismatch(names):
+    print(f"\n警告：背景驗證發現 {', '.join(names)} 的 SHA-256 與安裝清單不符，下次執行時將重新安裝。")
+
 def check_and_install_7z():
     """
-    檢查 7z 解壓縮工具是否存在，如果不存在則自動下載並配置。
-    返回 7za.exe 的執行檔路徑。
+    檢查 7z 解壓縮工具是否存在，如果不存在則自動下載並配置 (僅 Windows；其他平台使用 PATH 中的 7za/7z)。
+    返回 7za.exe 的執行檔路徑。只有在未安裝 py7zr 而需要解壓縮 .7z 時才會用到。
     """
+    if not TOOL_BOOTSTRAP_SUPPORTED:
+        return shutil.which('7za') or shutil.which('7z')
+
     seven_zip_dir = os.path.join('.', 'driver', '7z')
     seven_zip_exec_path = os.path.join(seven_zip_dir, '7za.exe')
 
-    if os.path.exists(seven_zip_exec_path):
+    # 安裝清單命中時只需 os.stat，不重新檢查或安裝
+    manifest_tools = check_install_manifest(('7za',), on_mismatch=_report_manifest_mismatch)
+    if manifest_tools:
+        print("7-Zip (7za.exe) 已存在。")
+        return manifest_tools['7za']
+
+    if os.path.exists(seven_zip_exec_path) and not install_manifest_mismatches(('7za',)):
         print("7-Zip (7za.exe) 已存在。")
+        record_installed_tools({'7za': seven_zip_exec_path}, background=True)
         return seven_zip_exec_path
 
-    print("\n偵測到 7-Zip (7za.exe) 不存在，將嘗試自動安裝...")
+    print("\n偵測到 7-Zip (7za.exe) 不存在或已損毀，將嘗試自動安裝...")
     
     # 7-Zip Command Line Version 下載 URL (Windows 64-bit)
     # 請定期檢查這個 URL 是否仍然有效
@@ -145,6 +161,7 @@ def check_and_install_7z():
         # 確保 7za.exe 就在 seven_zip_dir 下
         if os.path.exists(seven_zip_exec_path):
             print("7-Zip (7za.exe) 安裝完成。")
+            record_installed_tools({'7za': seven_zip_exec_path}, source_url=seven_zip_download_url)
             return seven_zip_exec_path
         else:
             # 如果解壓出來的檔案不在根目錄，可能需要找一下
@@ -155,6 +172,7 @@ def check_and_install_7z():
                     if found_7za_path != seven_zip_exec_path:
                         shutil.move(found_7za_path, seven_zip_exec_path)
                         print(f"已將 7za.exe 移動到正確位置：{seven_zip_exec_path}")
+                    record_installed_tools({'7za': seven_zip_exec_path}, source_url=seven_zip_download_url)
                     return seven_zip_exec_path
             print("錯誤：解壓縮後未能找到 7za.exe。")
             return None
@@ -175,19 +193,28 @@ def check_and_install_7z():
                 print(f"刪除 7-Zip 壓縮檔失敗：{e}")
 
 
-def check_and_install_ffmpeg(seven_zip_exec_path):
+def check_and_install_ffmpeg(seven_zip_exec_path=None):
     """
-    檢查 FFmpeg 是否存在，如果不存在則自動下載並配置。
+    尋找 FFmpeg 與 FFprobe (環境變數、設定檔、安裝清單、./driver、PATH)，找不到時在 Windows 上自動下載並配置。
     返回 FFmpeg 和 FFprobe 的執行檔路徑。
     """
-    ffmpeg_exec_path = os.path.join('.', 'driver', 'ffmpeg', 'bin', 'ffmpeg.exe')
-    ffprobe_exec_path = os.path.join('.', 'driver', 'ffmpeg', 'bin', 'ffprobe.exe')
+    ffmpeg_exec_path = bundled_tool_path('ffmpeg')
+    ffprobe_exec_path = bundled_tool_path('ffprobe')
 
-    if os.path.exists(ffmpeg_exec_path) and os.path.exists(ffprobe_exec_path):
-        print("FFmpeg 和 FFprobe 已存在。")
-        return ffmpeg_exec_path, ffprobe_exec_path
+    try:
+        ffmpeg_found, ffprobe_found, source = resolve_ffmpeg_tools(on_mismatch=_report_manifest_mismatch)
+    except ToolResolutionError as e:
+        print(f"錯誤：{e}")
+        return None, None
+    if ffmpeg_found:
+        print(f"FFmpeg 和 FFprobe 已存在 ({source})。")
+        return ffmpeg_found, ffprobe_found
+
+    if not TOOL_BOOTSTRAP_SUPPORTED:
+        print(TOOL_INSTALL_HINT)
+        return None, None
 
-    print("\n偵測到 FFmpeg 或 FFprobe 不存在，將嘗試自動安裝...")
+    print("\n偵測到 FFmpeg 或 FFprobe 不存在或已損毀，將嘗試自動安裝...")
     
     driver_dir = './driver/'
     ffmpeg_archive_path = os.path.join(driver_dir, 'ffmpeg.7z')
@@ -195,11 +222,18 @@ def check_and_install_ffmpeg(seven_zip_exec_path):
     # FFmpeg 下載 URL (Windows 64-bit full build)
     ffmpeg_download_url = 'https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-full.7z'
 
-    if not download_file_with_progress(ffmpeg_download_url, ffmpeg_archive_path):
+    # 沒有 py7zr 時才需要 7za 解壓縮 .7z
+    if seven_zip_exec_path is None and not native_7z_available():
+        seven_zip_exec_path = check_and_install_7z()
+        if seven_zip_exec_path is None:
+            print("7-Zip (7za.exe) 未成功配置，無法解壓縮 FFmpeg。")
+            return None, None
+
+    if not download_file_with_progress(ffmpeg_download_url, ffmpeg_archive_path, checksum_url=ffmpeg_download_url + '.sha256'):
         print("FFmpeg 壓縮檔下載失敗，無法繼續安裝。")
         return None, None
     
-    # 使用傳入的 7za.exe 路徑來解壓縮 FFmpeg
+    # 以 py7zr 解壓縮，沒有時使用 7za.exe
     if not extract_and_rename_archive(ffmpeg_archive_path, driver_dir, 'ffmpeg', seven_zip_exec_path):
         print("FFmpeg 解壓縮或重命名失敗，無法繼續安裝。")
         return None, None
@@ -213,6 +247,7 @@ def check_and_install_ffmpeg(seven_zip_exec_path):
 
     if os.path.exists(ffmpeg_exec_path) and os.path.exists(ffprobe_exec_path):
         print("FFmpeg 和 FFprobe 安裝完成。")
+        record_installed_tools({'ffmpeg': ffmpeg_exec_path, 'ffprobe': ffprobe_exec_path}, source_url=ffmpeg_download_url)
         return ffmpeg_exec_path, ffprobe_exec_path
     else:
         print("FFmpeg 和 FFprobe 安裝失敗，執行檔未找到。")
@@ -221,6 +256,26 @@ def check_and_install_ffmpeg(seven_zip_exec_path):
 # --- 原始 GIF 處理應用程式邏輯 (無變動，除了函式調用傳參) ---
 
 def get_gif_info(ffmpeg_path, ffprobe_path, input_gif_path):
+    """
+    優先查詢探測快取，其次以原生 GIF 解析器單次讀取檔案，取得精確總幀數與依每幀延遲計算的總時長；
+    原生解析失敗時才改用 ffprobe 推算；ffprobe 的結果沒有每幀延遲與尺寸，不寫入快取。
+    同時獲取檔案大小。
+    """
+    try:
+        probe = probe_gif(input_gif_path)
+    except (GIFFormatError, OSError):
+        return _get_gif_info_ffprobe(ffprobe_path, input_gif_path)
+
+    avg_frame_rate, duration, total_frames = probe["avg_fps"], probe["duration"], probe["total_frames"]
+    try:
+        file_size_mib = os.path.getsize(input_gif_path) / (1024 * 1024) # 轉換為 MiB
+    except Exception as e:
+        print(f"警告: 無法獲取檔案大小: {e}")
+        file_size_mib = None
+
+    return avg_frame_rate, duration, total_frames, file_size_mib
+
+def _get_gif_info_ffprobe(ffprobe_path, input_gif_path):
     """
     使用指定的 ffprobe 路徑獲取 GIF 的平均幀率、總時長和計算總幀數。
     同時獲取檔案大小。
@@ -283,9 +338,19 @@ def get_gif_info(ffmpeg_path, ffprobe_path, input_gif_path):
 def process_gif(ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, target_frame_count):
     """
     根據目標幀數計算 FPS，並執行 FFmpeg 命令。
+    各階段的時間附加到 RUN_REPORT_PATH (JSON Lines)。
     """
+    report = RunReport(os.path.basename(input_gif_path), RUN_REPORT_PATH)
+    report.emit("job_start", input=input_gif_path, output=output_gif_path, target_frames=target_frame_count)
+    success = _process_gif_interactive(ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, target_frame_count, report)
+    report.emit("job_end", success=success, seconds=round(time.monotonic() - report.started, 4), stage_seconds=report.stage_seconds())
+    return success
+
+def _process_gif_interactive(ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, target_frame_count, report):
     print("\n--- 步驟 2: 取得 GIF 資訊並顯示 ---")
-    avg_fps, duration, original_frame_count, file_size_mib = get_gif_info(ffmpeg_path, ffprobe_path, input_gif_path)
+    with report.stage("probe") as stage:
+        avg_fps, duration, original_frame_count, file_size_mib = get_gif_info(ffmpeg_path, ffprobe_path, input_gif_path)
+        stage.update(frames=original_frame_count, duration=duration)
 
     if avg_fps is None or duration is None or original_frame_count is None:
         print("無法獲取原始 GIF 資訊，請檢查檔案路徑或 FFmpeg/FFprobe 安裝。")
@@ -310,13 +375,16 @@ def process_gif(ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, targ
     elif target_frame_count == original_frame_count:
         print(f"提示：目標幀數與原始幀數相同。將進行調色盤優化但不改變幀數。")
 
-    new_fps = target_frame_count / duration
+    with report.stage("fps_calc") as stage:
+        new_fps = target_frame_count / duration
+        stage["target_fps"] = new_fps
 
     print("\n--- 步驟 4: 計算並輸出 (執行 FFmpeg) ---")
     print(f"  計算後的新 FPS 參數: {new_fps:.15f}")
 
     ffmpeg_command = [
         ffmpeg_path,
+        *get_ffmpeg_capabilities(ffmpeg_path).progress_args('pipe:1'),
         '-i', input_gif_path,
         '-vf', f"fps={new_fps:.15f},split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse",
         output_gif_path
@@ -326,11 +394,16 @@ def process_gif(ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, targ
     print(f"命令: {' '.join(ffmpeg_command)}")
 
     try:
-        process = subprocess.run(ffmpeg_command, capture_output=True, text=True, check=False)
+        with report.stage("ffmpeg_encode") as stage:
+            process = subprocess.run(ffmpeg_command, capture_output=True, text=True, check=False)
+            stage["return_code"] = process.returncode
+            # stdout 只有 -progress 區塊，不直接顯示
+            snapshot = parse_progress_output(process.stdout or "", target_frame_count)
+            if snapshot is not None:
+                report.ffmpeg_progress(snapshot)
+                stage.update(frame=snapshot["frame"], speed=snapshot["speed"])
 
         print("\n--- FFmpeg 輸出 ---")
-        if process.stdout:
-            print(process.stdout)
         if process.stderr:
             print(process.stderr)
         print("-------------------\n")
@@ -339,7 +412,8 @@ def process_gif(ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, targ
             print(f"✅ FFmpeg 處理完成！新的 GIF 已儲存至：{output_gif_path}")
             
             print(f"\n--- 檢驗輸出 GIF 檔案資訊 ---")
-            out_avg_fps, out_duration, final_frame_count, out_file_size_mib = get_gif_info(ffmpeg_path, ffprobe_path, output_gif_path)
+            with report.stage("verify_probe"):
+                out_avg_fps, out_duration, final_frame_count, out_file_size_mib = get_gif_info(ffmpeg_path, ffprobe_path, output_gif_path)
             
             if out_avg_fps is not None and out_duration is not None and final_frame_count is not None:
                 print(f"輸出 GIF 實際資訊：")
@@ -372,38 +446,558 @@ def process_gif(ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, targ
         print(f"執行 FFmpeg 時發生未知錯誤：{e}")
         return False
 
+# --- 批次模式 (非互動，多檔案並行處理) ---
+
+def collect_input_gifs(patterns, recursive=False):
+    """
+    將輸入的檔案、資料夾與萬用字元展開為不重複的 GIF 檔案清單 (保持輸入順序)。
+    返回 (GIF 檔案清單, 沒有對應到任何 GIF 檔案的檔案路徑或萬用字元清單)。
+    """
+    found = []
+    unmatched = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            search = os.path.join(pattern, '**', '*') if recursive else os.path.join(pattern, '*')
+            candidates = sorted(glob.glob(search, recursive=recursive))
+        else:
+            candidates = sorted(glob.glob(pattern, recursive=recursive)) or [pattern]
+        matched = False
+        for path in candidates:
+            if not path.lower().endswith('.gif') or not os.path.isfile(path):
+                continue
+            matched = True
+            key = os.path.normcase(os.path.abspath(path))
+            if key not in seen:
+                seen.add(key)
+                found.append(path)
+        if not matched and not os.path.isdir(pattern):
+            unmatched.append(pattern)
+    return found, unmatched
+
+def read_frame_delays(input_gif_path):
+    """
+    返回原生解析取得的每幀延遲，無法原生解析 (或沒有延遲資訊) 時返回 None，由呼叫端改用不需要延遲的路徑。
+    """
+    try:
+        return probe_gif(input_gif_path)["frame_delays"] or None
+    except (GIFFormatError, OSError):
+        return None
+
+def resolve_target_frames(original_frame_count, target_frames=None, ratio=None):
+    """
+    依固定幀數或比例計算目標幀數 (至少 1 幀)。
+    """
+    if target_frames is not None:
+        return target_frames
+    return max(1, round(original_frame_count * ratio))
+
+def format_output_path(template, input_gif_path, target_frame_count, output_dir=None):
+    """
+    依輸出範本產生輸出路徑。可用欄位: {dir} {name} {stem} {ext} {frames}。
+    相對路徑以 output_dir (未指定時為輸入檔所在資料夾) 為基準。
+    """
+    directory = os.path.dirname(input_gif_path)
+    name = os.path.basename(input_gif_path)
+    stem, ext = os.path.splitext(name)
+    output_path = template.format(dir=directory, name=name, stem=stem, ext=ext, frames=target_frame_count)
+    if not os.path.isabs(output_path):
+        output_path = os.path.join(output_dir if output_dir is not None else directory, output_path)
+    return output_path
+
+def process_gif_job(ffmpeg_path, ffprobe_path, input_gif_path, output_template, target_frames=None, ratio=None, output_dir=None, cancel_token=None, two_pass=False, memory_limit_mib=0, engine='auto', timing='preserve', selection='uniform', dedupe_threshold=None, optimize=False, max_size_mib=None, report=None, filter_threads=None):
+    """
+    批次模式的單一工作：不輸出進度訊息，返回結果字典供彙整表格使用。
+    cancel_token 被取消時會終止 FFmpeg 並刪除不完整的輸出檔。
+    two_pass 為 True 時先產生 (或重用快取的) 調色盤 PNG，再串流套用 paletteuse。
+    memory_limit_mib > 0 時為低記憶體模式：估計峰值記憶體、必要時改用兩階段，並在 FFmpeg 超過上限時終止。
+    engine 為 'auto' 時減少幀數優先使用原生抽幀 (無法處理時改用 FFmpeg)，'native' 不退回，'ffmpeg' 一律使用 FFmpeg。
+    timing 為 'preserve' 時 FFmpeg 路徑依每幀延遲選幀並寫回合併後的延遲，'fps' 則以固定 fps 重新取樣。
+    selection 為 'content' 時依相鄰幀差異優先丟棄近似重複的幀；dedupe_threshold (0~1) 以下的幀一律合併。
+    optimize 為 True 時 FFmpeg 編碼器只寫出變化的矩形 (未變化的像素設為透明)，小型輸出再以 optimize_gif_frames 重新編碼 (以時間換取大小)。
+    max_size_mib 為目標檔案大小模式的上限：目標幀數視為上限，每次取樣與完整編碼都會輸出一行紀錄。
+    report (RunReport) 記錄各階段的時間、FFmpeg 的 frame/speed 與 job_start/job_end 事件。
+    filter_threads 為 FFmpeg 的濾鏡執行緒數 (並行工作時依核心數分配)，None 表示使用 FFmpeg 預設。
+    """
+    started = time.monotonic()
+    report = report if report is not None else RunReport(None)
+    report.emit(
+        "job_start", input=input_gif_path, target_frames=target_frames, ratio=ratio, engine=engine, timing=timing,
+        selection=selection, two_pass=two_pass, memory_limit_mib=memory_limit_mib, optimize=optimize, max_size_mib=max_size_mib
+    )
+    result = {
+        "input": input_gif_path,
+        "output": None,
+        "success": False,
+        "message": "",
+        "original_frames": None,
+        "target_frames": None,
+        "final_frames": None,
+        "output_size_mib": None,
+        "elapsed": 0.0,
+    }
+
+    try:
+        if cancel_token is not None and cancel_token.cancelled:
+            result["message"] = "已取消"
+            return result
+        with report.stage("probe") as stage:
+            avg_fps, duration, original_frame_count, _ = get_gif_info(ffmpeg_path, ffprobe_path, input_gif_path)
+            stage.update(frames=original_frame_count, duration=duration)
+        if avg_fps is None or duration is None or not original_frame_count or not duration:
+            result["message"] = "無法獲取原始 GIF 資訊"
+            return result
+        result["original_frames"] = original_frame_count
+
+        target_frame_count = resolve_target_frames(original_frame_count, target_frames, ratio)
+        result["target_frames"] = target_frame_count
+        output_gif_path = format_output_path(output_template, input_gif_path, target_frame_count, output_dir)
+        result["output"] = output_gif_path
+        if os.path.abspath(output_gif_path) == os.path.abspath(input_gif_path):
+            result["message"] = "輸出路徑與輸入相同"
+            return result
+        os.makedirs(os.path.dirname(output_gif_path) or '.', exist_ok=True)
+
+        if max_size_mib is not None:
+            def on_attempt(attempt):
+                report.emit("size_attempt", **attempt)
+                print(f"  {os.path.basename(input_gif_path)}: {format_size_attempt(attempt)}")
+
+            frame_delays = read_frame_delays(input_gif_path)
+            if frame_delays is None:
+                result["message"] = "無法讀取每幀延遲，目標檔案大小模式需要原生解析 GIF"
+                return result
+            max_bytes = int(max_size_mib * 1024 * 1024)
+            with report.stage("size_search", max_bytes=max_bytes) as stage:
+                size_result = encode_to_size(
+                    ffmpeg_path, input_gif_path, output_gif_path, max_bytes,
+                    frame_delays, target_frame_count,
+                    optimize=optimize, cancel_token=cancel_token, attempt_callback=on_attempt,
+                    memory_limit=memory_limit_mib * 1024 * 1024 if memory_limit_mib > 0 else None
+                )
+                stage["status"] = "cancelled" if size_result is None else ("ok" if size_result["success"] else "failed")
+            if size_result is None:
+                result["message"] = "已取消"
+                return result
+            if not size_result["success"]:
+                result["message"] = f"無法達到目標大小: {size_result['message']}"
+                return result
+            result["target_frames"] = target_frame_count = size_result["frames"]
+            with report.stage("verify_probe"):
+                _, _, final_frame_count, out_file_size_mib = get_gif_info(ffmpeg_path, ffprobe_path, output_gif_path)
+            result["final_frames"] = final_frame_count
+            result["output_size_mib"] = out_file_size_mib
+            result["success"] = final_frame_count is not None
+            result["message"] = (
+                f"完成 (縮放 {size_result['scale'] * 100:.0f}%，{size_result['colors']} 色，編碼 {len(size_result['attempts'])} 次)"
+                if result["success"] else "無法獲取輸出 GIF 資訊進行驗證"
+            )
+            return result
+
+        content_plan = None
+        frame_delays = read_frame_delays(input_gif_path) if selection == 'content' or dedupe_threshold is not None else None
+        if frame_delays is not None:
+            try:
+                with report.stage("content_analysis") as stage:
+                    scores = frame_difference_scores(input_gif_path, cancel_token=cancel_token)
+                    if scores is None:
+                        stage["status"] = "cancelled"
+                        result["message"] = "已取消"
+                        return result
+                    content_plan = plan_frames_by_difference(
+                        scores, frame_delays,
+                        target_frame_count if selection == 'content' else len(frame_delays),
+                        merge_threshold=dedupe_threshold
+                    )
+                    stage["kept_frames"] = len(content_plan[0])
+                if selection != 'content' and len(content_plan[0]) > target_frame_count:
+                    # 只合併近似重複幀後仍多於目標時，再從剩下的幀中平均選取
+                    kept, delays = content_plan
+                    sub_kept, sub_delays = plan_kept_frames(delays, target_frame_count)
+                    content_plan = ([kept[i] for i in sub_kept], sub_delays)
+                target_frame_count = min(target_frame_count, len(content_plan[0]))
+                result["target_frames"] = target_frame_count
+            except (DecimationUnsupported, GIFFormatError):
+                content_plan = None # 無法分析時改用平均選幀
+
+        engine_note = ""
+        used_native = False
+        if engine != 'ffmpeg' and target_frame_count < original_frame_count:
+            try:
+                with report.stage("native_decimate") as stage:
+                    stats = decimate_gif(
+                        input_gif_path, output_gif_path, target_frame_count, cancel_token=cancel_token, frame_plan=content_plan
+                    )
+                    if stats is None:
+                        stage["status"] = "cancelled"
+                        result["message"] = "已取消"
+                        return result
+                    stage.update(frames=stats["frames"], copied=stats["copied"], recomposited=stats["recomposited"])
+                used_native = True
+                engine_note = f"原生，重新合成 {stats['recomposited']} 幀"
+            except (DecimationUnsupported, GIFFormatError) as e:
+                if engine == 'native':
+                    result["message"] = f"原生抽幀無法處理: {e}"
+                    return result
+                engine_note = "原生抽幀不適用，已用 FFmpeg"
+        elif engine == 'native':
+            result["message"] = "原生抽幀只支援減少幀數"
+            return result
+        if not used_native:
+            frame_plan = content_plan
+            if frame_plan is None and timing == 'preserve' and target_frame_count <= original_frame_count:
+                frame_delays = read_frame_delays(input_gif_path)
+                if frame_delays is not None and target_frame_count <= len(frame_delays):
+                    frame_plan = plan_kept_frames(frame_delays, target_frame_count)
+                # 沒有每幀延遲時 frame_plan 維持 None，改以固定 fps 重新取樣
+            error_message = _run_ffmpeg_job(
+                ffmpeg_path, input_gif_path, output_gif_path, target_frame_count, duration,
+                cancel_token, two_pass, memory_limit_mib, frame_plan, report, filter_threads, optimize
+            )
+            if error_message is not None:
+                result["message"] = error_message
+                return result
+            if optimize:
+                try:
+                    with report.stage("optimize") as stage:
+                        stats = optimize_gif_frames(output_gif_path, cancel_token=cancel_token)
+                        if stats is None:
+                            stage["status"] = "cancelled"
+                        else:
+                            stage.update(applied=stats["applied"], original_size=stats["original_size"], optimized_size=stats["optimized_size"])
+                    if stats is None:
+                        remove_partial_output(output_gif_path)
+                        result["message"] = "已取消"
+                        return result
+                    if stats["applied"]:
+                        saved = 100.0 * (1 - stats["optimized_size"] / stats["original_size"])
+                        engine_note = (engine_note + "，" if engine_note else "") + f"差異矩形縮小 {saved:.0f}%"
+                except (DecimationUnsupported, GIFFormatError):
+                    pass # 無法逐像素處理時保留 FFmpeg 輸出
+
+        with report.stage("verify_probe"):
+            _, _, final_frame_count, out_file_size_mib = get_gif_info(ffmpeg_path, ffprobe_path, output_gif_path)
+        result["final_frames"] = final_frame_count
+        result["output_size_mib"] = out_file_size_mib
+        if final_frame_count is None:
+            result["message"] = "無法獲取輸出 GIF 資訊進行驗證"
+            return result
+
+        result["success"] = True
+        result["message"] = "完成" if abs(final_frame_count - target_frame_count) <= 1 else "幀數與目標差異較大"
+        if engine_note:
+            result["message"] += f" ({engine_note})"
+        return result
+    except Exception as e:
+        result["message"] = f"未知錯誤: {e}"
+        return result
+    finally:
+        result["elapsed"] = time.monotonic() - started
+        report.emit(
+            "job_end", success=result["success"], cancelled=cancel_token is not None and cancel_token.cancelled,
+            message=result["message"], output=result["output"], final_frames=result["final_frames"],
+            seconds=round(result["elapsed"], 4), stage_seconds=report.stage_seconds()
+        )
+
+def _run_ffmpeg_job(ffmpeg_path, input_gif_path, output_gif_path, target_frame_count, duration, cancel_token, two_pass, memory_limit_mib, frame_plan=None, report=None, filter_threads=None, optimize=False):
+    """
+    以 FFmpeg 處理批次工作，成功時返回 None，否則返回錯誤訊息。
+    frame_plan 為 (保留幀索引, 每幀延遲) 時以 select 選幀並寫回延遲，否則依目標幀數重設 fps。
+    FFmpeg 以 -progress pipe:1 執行，結束後把最後的 frame/speed 記錄到 report 的 ffmpeg_encode 階段。
+    命令列依 get_ffmpeg_capabilities 的探測結果組成，不支援的參數與濾鏡選項不會出現在命令中。
+    optimize 為 True 時 GIF 編碼器只寫出差異矩形 (-gifflags)。
+    """
+    report = report if report is not None else RunReport(None)
+    capabilities = get_ffmpeg_capabilities(ffmpeg_path)
+    paletteuse_options = capabilities.filter_options('paletteuse', DEFAULT_PALETTEUSE_OPTIONS)
+    global_args = (*capabilities.progress_args('pipe:1'), *capabilities.filter_thread_args(filter_threads))
+    if frame_plan is not None:
+        frame_filter = select_frames_filter(frame_plan[0])
+        output_args = capabilities.timing_args()
+    else:
+        frame_filter = fps_filter(target_frame_count / duration)
+        output_args = ()
+    if optimize:
+        output_args = (*output_args, *capabilities.gif_diff_args())
+    memory_limit = memory_limit_mib * 1024 * 1024 if memory_limit_mib > 0 else None
+    if memory_limit:
+        try:
+            width, height = read_gif_dimensions(input_gif_path)
+        except (GIFFormatError, OSError):
+            width = height = None
+        two_pass, estimate, fits = plan_memory_strategy(width, height, target_frame_count, memory_limit, two_pass)
+        if not fits:
+            return f"估計記憶體 {estimate / (1024 * 1024):.0f} MiB 超過上限 {memory_limit_mib} MiB"
+
+    try:
+        if two_pass:
+            with report.stage("palette") as stage:
+                palette_path, from_cache, palette_log = generate_palette(
+                    ffmpeg_path, input_gif_path, frame_filter, cancel_token=cancel_token, memory_limit=memory_limit
+                )
+                stage.update(cached=from_cache, status="ok" if palette_path else "failed")
+            if cancel_token is not None and cancel_token.cancelled:
+                return "已取消"
+            if palette_path is None:
+                last_line = palette_log.strip().splitlines()[-1] if palette_log.strip() else ""
+                return f"產生調色盤失敗: {last_line}"
+            ffmpeg_command = build_paletteuse_command(
+                ffmpeg_path, input_gif_path, palette_path, output_gif_path, frame_filter, paletteuse_options,
+                extra_args=global_args, output_args=output_args
+            )
+        else:
+            ffmpeg_command = [
+                ffmpeg_path,
+                '-nostdin',
+                '-y',
+                '-nostats',
+                *global_args,
+                '-i', input_gif_path,
+                '-vf', single_pass_filter(frame_filter, paletteuse_options=paletteuse_options),
+                *output_args,
+                output_gif_path
+            ]
+        with report.stage("ffmpeg_encode", two_pass=two_pass) as stage:
+            return_code, stdout, stderr = run_cancellable(ffmpeg_command, cancel_token, memory_limit)
+            stage["return_code"] = return_code
+            if cancel_token is not None and cancel_token.cancelled:
+                stage["status"] = "cancelled"
+            snapshot = parse_progress_output(stdout, target_frame_count)
+            if snapshot is not None:
+                report.ffmpeg_progress(snapshot)
+                stage.update(frame=snapshot["frame"], speed=snapshot["speed"])
+    except MemoryLimitExceeded as e:
+        remove_partial_output(output_gif_path)
+        return str(e)
+    if cancel_token is not None and cancel_token.cancelled:
+        remove_partial_output(output_gif_path)
+        return "已取消"
+    if return_code != 0:
+        last_line = stderr.strip().splitlines()[-1] if stderr.strip() else ""
+        return f"FFmpeg 返回碼 {return_code}: {last_line}"
+    if frame_plan is not None:
+        with report.stage("rewrite_delays") as stage:
+            stage["status"] = "ok" if rewrite_gif_delays(output_gif_path, frame_plan[1]) else "skipped"
+    return None
+
+def failed_job_result(input_gif_path, message):
+    """
+    未實際處理的檔案 (找不到、已取消) 在結果表格中的失敗列。
+    """
+    return {
+        "input": input_gif_path, "output": None, "success": False, "message": message,
+        "original_frames": None, "target_frames": None, "final_frames": None,
+        "output_size_mib": None, "elapsed": 0.0,
+    }
+
+def print_batch_results(results):
+    """
+    以表格輸出每個檔案的處理結果。
+    """
+    print("\n--- 批次處理結果 ---")
+    print(f"{'狀態':<4} {'原始':>7} {'目標':>7} {'輸出':>7} {'大小(MiB)':>10} {'耗時(秒)':>9}  檔案 / 訊息")
+    for r in results:
+        status = "✅" if r["success"] else "❌"
+        size = f"{r['output_size_mib']:.2f}" if r["output_size_mib"] is not None else "-"
+        print(
+            f"{status:<4} {r['original_frames'] if r['original_frames'] is not None else '-':>7} "
+            f"{r['target_frames'] if r['target_frames'] is not None else '-':>7} "
+            f"{r['final_frames'] if r['final_frames'] is not None else '-':>7} "
+            f"{size:>10} {r['elapsed']:>9.2f}  {r['input']} -> {r['output'] or '-'} ({r['message']})"
+        )
+    failed = sum(1 for r in results if not r["success"])
+    print(f"共 {len(results)} 個檔案，成功 {len(results) - failed} 個，失敗 {failed} 個。")
+
+def parse_batch_args(argv):
+    parser = argparse.ArgumentParser(
+        description="GIF 幀數調整工具批次模式：不帶參數執行時進入互動模式。"
+    )
+    default_jobs = default_job_concurrency()
+    parser.add_argument('inputs', nargs='+', help="輸入 GIF 檔案、資料夾或萬用字元 (例如: 'clips/*.gif')")
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('-f', '--frames', type=int, help="目標總幀數")
+    target_group.add_argument('-r', '--ratio', type=float, help="目標幀數相對原始幀數的比例 (例如: 0.5)")
+    parser.add_argument('-o', '--output', default='{stem}_{frames}{ext}',
+                        help="輸出檔名範本，可用 {dir} {name} {stem} {ext} {frames} (預設: {stem}_{frames}{ext})")
+    parser.add_argument('-d', '--output-dir', default=None, help="輸出資料夾 (預設為輸入檔所在資料夾)")
+    parser.add_argument('-j', '--jobs', type=int, default=default_jobs,
+                        help=f"並行處理的工作數，每個工作在獨立行程中執行 (預設為實體核心數除以每個工作的 FFmpeg 執行緒數: {default_jobs})")
+    parser.add_argument('-R', '--recursive', action='store_true', help="遞迴搜尋資料夾中的 GIF 檔案")
+    parser.add_argument('--engine', choices=('auto', 'native', 'ffmpeg'), default='auto',
+                        help="處理引擎：auto 減少幀數時優先原生抽幀 (不重新編碼)，失敗再用 FFmpeg (預設: auto)")
+    parser.add_argument('--timing', choices=('preserve', 'fps'), default='preserve',
+                        help="FFmpeg 路徑的時間模式：preserve 保留原始每幀延遲與精確總時長，fps 以固定 fps 重新取樣 (預設: preserve)")
+    parser.add_argument('--select', choices=('uniform', 'content'), default='uniform',
+                        help="選幀方式：uniform 依時間平均選幀，content 依相鄰幀差異優先丟棄近似重複的幀 (預設: uniform)")
+    parser.add_argument('--dedupe', type=float, default=None, metavar='PCT',
+                        help="合併與前一幀差異不超過 PCT%% 像素的幀 (延遲相加)，可能使輸出少於目標幀數")
+    parser.add_argument('--max-size', type=float, default=None, metavar='MIB',
+                        help="目標檔案大小模式：-f/-r 的幀數視為上限，取樣估計後搜尋不超過 MIB 的最多幀數，必要時降低色數與縮放")
+    parser.add_argument('--optimize', action='store_true',
+                        help="差異矩形：FFmpeg 編碼器每幀只寫出變化的矩形，未變化的像素設為透明 (適合大部分靜止的畫面)；"
+                             "寬x高x幀數不超過 1M 像素的輸出另以純 Python 重新編碼，以額外時間 (約 1 秒) 換取更小的檔案")
+    parser.add_argument('--report', default=RUN_REPORT_PATH, metavar='PATH',
+                        help=f"各階段計時的 JSON Lines 報告附加到此檔案，'-' 為標準輸出，空字串停用 (預設: {RUN_REPORT_PATH})")
+    parser.add_argument('--two-pass', action='store_true',
+                        help="兩階段調色盤：先產生調色盤 PNG (可快取重用) 再套用，降低大型 GIF 的記憶體用量")
+    parser.add_argument('--low-memory', action='store_true',
+                        help="低記憶體模式：依尺寸與幀數估計記憶體，必要時自動改用兩階段，並限制每個工作的記憶體")
+    parser.add_argument('--memory-limit', type=int, default=None, metavar='MIB',
+                        help=f"低記憶體模式下每個工作的記憶體上限 (MiB，指定時自動啟用低記憶體模式，預設: {DEFAULT_JOB_MEMORY_LIMIT_MIB})")
+    args = parser.parse_args(argv)
+    if args.frames is not None and args.frames <= 0:
+        parser.error("目標幀數必須是正整數。")
+    if args.ratio is not None and args.ratio <= 0:
+        parser.error("比例必須大於 0。")
+    if args.jobs <= 0:
+        parser.error("並行工作數必須是正整數。")
+    if args.dedupe is not None and not 0 <= args.dedupe <= 100:
+        parser.error("--dedupe 必須介於 0 到 100 之間。")
+    if args.max_size is not None and args.max_size <= 0:
+        parser.error("大小上限必須大於 0。")
+    if args.memory_limit is not None and args.memory_limit <= 0:
+        parser.error("記憶體上限必須是正整數。")
+    if args.memory_limit is None:
+        args.memory_limit = DEFAULT_JOB_MEMORY_LIMIT_MIB if args.low_memory else 0
+    return args
+
+BATCH_CANCEL_POLL_SECONDS = 0.2 # 工作行程檢查取消事件的間隔
+_batch_cancel_event = None # 工作行程中由 _init_batch_worker 設定
+
+
+def _init_batch_worker(cancel_event):
+    """
+    批次工作行程的初始化：忽略 Ctrl+C (由主行程處理)，並保存共用的取消事件。
+    """
+    global _batch_cancel_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _batch_cancel_event = cancel_event
+
+def _run_batch_job(report_path, ffmpeg_path, ffprobe_path, input_gif_path, output_template, **options):
+    """
+    在工作行程中執行 process_gif_job；主行程設定取消事件時，監看執行緒會取消這個工作的 CancelToken。
+    """
+    cancel_token = CancelToken()
+    finished = threading.Event()
+
+    def watch_cancel():
+        while not finished.is_set():
+            if _batch_cancel_event.wait(BATCH_CANCEL_POLL_SECONDS):
+                cancel_token.cancel()
+                return
+
+    if _batch_cancel_event is not None:
+        threading.Thread(target=watch_cancel, daemon=True).start()
+    try:
+        return process_gif_job(
+            ffmpeg_path, ffprobe_path, input_gif_path, output_template,
+            cancel_token=cancel_token, report=RunReport(input_gif_path, report_path), **options
+        )
+    finally:
+        finished.set()
+
+def run_batch(argv):
+    """
+    批次模式進入點，任何檔案失敗時返回非零結束碼。
+    """
+    args = parse_batch_args(argv)
+
+    input_files, unmatched = collect_input_gifs(args.inputs, args.recursive)
+    # 找不到的檔案或沒有符合的萬用字元列為失敗，計入非零結束碼
+    missing_results = [failed_job_result(pattern, "找不到符合的 GIF 檔案") for pattern in unmatched]
+    for pattern in unmatched:
+        print(f"警告：找不到符合 '{pattern}' 的 GIF 檔案。")
+    if not input_files:
+        print("錯誤：找不到任何符合的 GIF 檔案。")
+        return 2
+
+    ffmpeg_exec, ffprobe_exec = check_and_install_ffmpeg()
+    if ffmpeg_exec is None or ffprobe_exec is None:
+        print("\nFFmpeg/FFprobe 未成功配置，程式無法繼續執行。")
+        return 2
+    capabilities = get_ffmpeg_capabilities(ffmpeg_exec) # 在啟動工作前探測 (或讀取快取) 一次
+    if capabilities.version:
+        print(f"使用 {capabilities.version}")
+
+    jobs = min(args.jobs, len(input_files))
+    print(f"\n開始批次處理 {len(input_files)} 個檔案 (並行工作數: {jobs})...")
+
+    # 原生抽幀、內容分析與差異矩形重新編碼都是純 Python 的 CPU 工作，執行緒會被 GIL 序列化，
+    # 因此每個工作在獨立的工作行程中執行。
+    # 工作行程與 FFmpeg 子行程都不處理 Ctrl+C，由主行程設定取消事件，再由各工作的 CancelToken 終止
+    cancel_event = multiprocessing.Event()
+    filter_threads = max(1, physical_core_count() // jobs)
+    options = {
+        "target_frames": args.frames, "ratio": args.ratio, "output_dir": args.output_dir,
+        "two_pass": args.two_pass, "memory_limit_mib": args.memory_limit, "engine": args.engine,
+        "timing": args.timing, "selection": args.select,
+        "dedupe_threshold": None if args.dedupe is None else args.dedupe / 100.0,
+        "optimize": args.optimize, "max_size_mib": args.max_size, "filter_threads": filter_threads,
+    }
+    results = {}
+    futures = {}
+    interrupted = False
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker, initargs=(cancel_event,))
+    try:
+        futures = {
+            executor.submit(_run_batch_job, args.report or None, ffmpeg_exec, ffprobe_exec, path, args.output, **options): path
+            for path in input_files
+        }
+        for done_count, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results[futures[future]] = result
+            status = "✅" if result["success"] else "❌"
+            print(f"[{done_count}/{len(input_files)}] {status} {result['input']} ({result['elapsed']:.2f} 秒)")
+    except KeyboardInterrupt:
+        interrupted = True
+        print("\n收到中斷訊號，正在取消所有工作...")
+        cancel_event.set()
+        for future, path in futures.items():
+            if future.cancel():
+                results[path] = failed_job_result(path, "已取消")
+    finally:
+        executor.shutdown(wait=True)
+
+    for future, path in futures.items():
+        if path not in results and future.done() and not future.cancelled():
+            results[path] = future.result()
+    ordered_results = missing_results + [results[path] for path in input_files if path in results]
+    print_batch_results(ordered_results)
+    if interrupted:
+        return 130
+    return 0 if all(r["success"] for r in ordered_results) else 1
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # 打包成執行檔時，批次模式的工作行程需要
+    # 帶參數執行時進入批次模式
+    if len(sys.argv) > 1:
+        sys.exit(run_batch(sys.argv[1:]))
+
     print("--- GIF 幀數調整與檔案優化工具 (FFmpeg 及 7-Zip 自動安裝) ---")
 
-    # 首先，檢查並安裝 7-Zip 解壓縮工具
-    seven_zip_path = check_and_install_7z()
+    # 檢查 FFmpeg (Windows 上找不到時自動安裝，7-Zip 只在需要解壓縮 .7z 時才安裝)
+    ffmpeg_exec, ffprobe_exec = check_and_install_ffmpeg()
 
-    if seven_zip_path is None:
-        print("\n7-Zip (7za.exe) 未成功配置，程式無法繼續執行。")
+    if ffmpeg_exec is None or ffprobe_exec is None:
+        print("\nFFmpeg/FFprobe 未成功配置，程式無法繼續執行。")
     else:
-        # 然後，檢查並安裝 FFmpeg，並將 7-Zip 的路徑傳遞給它
-        ffmpeg_exec, ffprobe_exec = check_and_install_ffmpeg(seven_zip_path)
-
-        if ffmpeg_exec is None or ffprobe_exec is None:
-            print("\nFFmpeg/FFprobe 未成功配置，程式無法繼續執行。")
+        input_file = input("請輸入原始 GIF 檔案名稱 (例如: input.gif): ").strip()
+        
+        if not os.path.exists(input_file):
+            print(f"錯誤：檔案 '{input_file}' 不存在。請檢查路徑和檔名。")
         else:
-            input_file = input("請輸入原始 GIF 檔案名稱 (例如: input.gif): ").strip()
-            
-            if not os.path.exists(input_file):
-                print(f"錯誤：檔案 '{input_file}' 不存在。請檢查路徑和檔名。")
+            try:
+                target_frames_str = input("請輸入您希望修改的總幀數 (例如: 250): ").strip()
+                target_frames = int(target_frames_str)
+                if target_frames <= 0:
+                    raise ValueError("目標幀數必須是正整數。")
+            except ValueError as e:
+                print(f"輸入錯誤：{e}")
             else:
-                try:
-                    target_frames_str = input("請輸入您希望修改的總幀數 (例如: 250): ").strip()
-                    target_frames = int(target_frames_str)
-                    if target_frames <= 0:
-                        raise ValueError("目標幀數必須是正整數。")
-                except ValueError as e:
-                    print(f"輸入錯誤：{e}")
+                output_file = input("請輸入輸出 GIF 檔案名稱 (例如: output_250_frames.gif): ").strip()
+                if not output_file:
+                    print("錯誤：輸出檔案名稱不能為空。")
                 else:
-                    output_file = input("請輸入輸出 GIF 檔案名稱 (例如: output_250_frames.gif): ").strip()
-                    if not output_file:
-                        print("錯誤：輸出檔案名稱不能為空。")
-                    else:
-                        process_gif(ffmpeg_exec, ffprobe_exec, input_file, output_file, target_frames)
+                    process_gif(ffmpeg_exec, ffprobe_exec, input_file, output_file, target_frames)
 
     print("\n--- 程式結束 ---")
\ No newline at end of file
@@ -0,0 +1,3220 @@
+import codecs
+import collections
+import contextlib
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import re
+import selectors
+import shutil
+import signal
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+# --- GIF 原生解析 (不需呼叫 ffprobe) ---
+
+# FFmpeg 的 GIF demuxer 會把小於 min_delay 的延遲視為 default_delay，
+# 這裡採用相同規則計算時長，讓結果與 ffprobe/ffmpeg 的 fps 濾鏡一致。
+FFMPEG_MIN_DELAY_CS = 2
+FFMPEG_DEFAULT_DELAY_CS = 10
+
+
+class GIFFormatError(Exception):
+    """GIF 檔案結構無法解析時拋出。"""
+
+
+def effective_delay_cs(delay_cs):
+    """
+    將 GCE 中記錄的延遲 (百分之一秒) 轉換為 FFmpeg 實際使用的延遲。
+    """
+    if delay_cs < FFMPEG_MIN_DELAY_CS:
+        return FFMPEG_DEFAULT_DELAY_CS
+    return delay_cs
+
+
+def _skip_sub_blocks(buf, pos):
+    # 依照子區塊長度跳過資料 (LZW 影像資料或未知擴充)，不進行解碼，返回結束後的位移
+    end = len(buf)
+    while True:
+        if pos >= end:
+            raise GIFFormatError("子區塊在檔案結尾前被截斷。")
+        size = buf[pos]
+        pos += 1
+        if size == 0:
+            return pos
+        pos += size
+
+
+class GIFIndex:
+    """
+    以 mmap 映射 GIF 檔案並建立區塊位移索引 (第 N 幀 → GCE 與影像描述的位移)。
+    所有幀資料皆以 memoryview 切片取得，不複製 LZW 內容；
+    建立索引只需走訪區塊標頭，成本與區塊數量成正比。
+    """
+
+    def __init__(self, input_gif_path):
+        self.path = input_gif_path
+        self._file = open(input_gif_path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空檔案無法映射
+            self._file.close()
+            raise GIFFormatError("不是有效的 GIF 檔案 (檔案為空)。")
+        self.buffer = memoryview(self._mmap)
+        self.version = None
+        self.width = None
+        self.height = None
+        self.global_palette_offset = None
+        self.global_palette_size = 0
+        self.background_index = 0
+        self.loop_count = None # None 表示沒有 NETSCAPE 擴充 (只播放一次)，0 表示無限循環
+        self.frames = []
+        self.trailer_offset = None
+        self.truncated = False
+        try:
+            self._scan()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                # 呼叫端仍持有幀資料切片，交由垃圾回收在切片釋放後關閉映射
+                pass
+            self._file.close()
+
+    def _scan(self):
+        buf = self.buffer
+        end = len(buf)
+        if end < 13 or bytes(buf[:3]) != b'GIF':
+            raise GIFFormatError("不是有效的 GIF 檔案 (缺少 GIF 標頭)。")
+        self.version = bytes(buf[3:6]).decode('ascii', errors='replace')
+        self.width, self.height, packed, self.background_index, _aspect = struct.unpack_from('<HHBBB', buf, 6)
+        pos = 13
+        if packed & 0x80:
+            self.global_palette_size = 2 ** ((packed & 0x07) + 1)
+            self.global_palette_offset = pos
+            pos += 3 * self.global_palette_size
+
+        pending_gce = None
+        while True:
+            if pos >= end:
+                # 缺少結尾區塊，保留已讀到的幀
+                self.truncated = True
+                break
+            block_type = buf[pos]
+
+            if block_type == 0x3B: # 檔案結尾
+                self.trailer_offset = pos
+                break
+
+            try:
+                if block_type == 0x21: # 擴充區塊
+                    if pos + 1 >= end:
+                        raise GIFFormatError("擴充區塊被截斷。")
+                    label = buf[pos + 1]
+                    if label == 0xF9: # 圖形控制擴充 (GCE)
+                        if pos + 8 > end or buf[pos + 2] != 4:
+                            raise GIFFormatError("圖形控制擴充被截斷。")
+                        gce_packed = buf[pos + 3]
+                        pending_gce = {
+                            "offset": pos,
+                            "disposal": (gce_packed >> 2) & 0x07,
+                            "transparent_index": buf[pos + 6] if gce_packed & 0x01 else None,
+                            "delay": struct.unpack_from('<H', buf, pos + 4)[0],
+                        }
+                        pos = _skip_sub_blocks(buf, pos + 2)
+                    elif label == 0xFF: # 應用程式擴充 (NETSCAPE2.0 循環次數)
+                        if pos + 2 >= end:
+                            raise GIFFormatError("應用程式擴充被截斷。")
+                        app_size = buf[pos + 2]
+                        app_id = bytes(buf[pos + 3:pos + 3 + app_size])
+                        data_pos = pos + 3 + app_size
+                        if (app_id in (b'NETSCAPE2.0', b'ANIMEXTS1.0') and data_pos + 4 <= end
+                                and buf[data_pos] == 3 and buf[data_pos + 1] == 1):
+                            self.loop_count = struct.unpack_from('<H', buf, data_pos + 2)[0]
+                        pos = _skip_sub_blocks(buf, data_pos)
+                    else:
+                        pos = _skip_sub_blocks(buf, pos + 2)
+
+                elif block_type == 0x2C: # 影像描述
+                    if pos + 10 > end:
+                        raise GIFFormatError("影像描述被截斷。")
+                    left, top, frame_width, frame_height, img_packed = struct.unpack_from('<HHHHB', buf, pos + 1)
+                    descriptor_offset = pos
+                    pos += 10
+                    local_palette_size = 0
+                    local_palette_offset = None
+                    if img_packed & 0x80:
+                        local_palette_size = 2 ** ((img_packed & 0x07) + 1)
+                        local_palette_offset = pos
+                        pos += 3 * local_palette_size
+                    if pos >= end: # LZW 最小碼長
+                        raise GIFFormatError("影像資料被截斷。")
+                    lzw_offset = pos
+                    pos = _skip_sub_blocks(buf, pos + 1)
+
+                    self.frames.append({
+                        "gce_offset": pending_gce["offset"] if pending_gce else None,
+                        "descriptor_offset": descriptor_offset,
+                        "lzw_offset": lzw_offset,
+                        "end_offset": pos,
+                        "rect": (left, top, frame_width, frame_height),
+                        "interlaced": bool(img_packed & 0x40),
+                        "local_palette_offset": local_palette_offset,
+                        "local_palette_size": local_palette_size,
+                        "delay": pending_gce["delay"] if pending_gce else 0,
+                        "disposal": pending_gce["disposal"] if pending_gce else 0,
+                        "transparent_index": pending_gce["transparent_index"] if pending_gce else None,
+                    })
+                    pending_gce = None
+
+                else:
+                    raise GIFFormatError(f"未知的區塊類型 0x{block_type:02X}。")
+
+            except GIFFormatError:
+                # 最後一幀被截斷時視為不完整檔案，保留之前的幀
+                if self.frames:
+                    self.truncated = True
+                    break
+                raise
+
+    def frame_block(self, frame_number):
+        """
+        返回第 N 幀從 GCE (若有) 到影像資料結尾的 memoryview 切片 (零複製)。
+        """
+        frame = self.frames[frame_number]
+        start = frame["gce_offset"] if frame["gce_offset"] is not None else frame["descriptor_offset"]
+        return self.buffer[start:frame["end_offset"]]
+
+    def frame_image_data(self, frame_number):
+        """
+        返回第 N 幀的 LZW 最小碼長與其後子區塊資料的 memoryview 切片 (零複製)。
+        """
+        frame = self.frames[frame_number]
+        return self.buffer[frame["lzw_offset"]:frame["end_offset"]]
+
+    def palette(self, frame_number=None):
+        """
+        返回指定幀實際使用的調色盤 (RGB 位元組的 memoryview)，未指定時返回全域調色盤。
+        """
+        if frame_number is not None:
+            frame = self.frames[frame_number]
+            if frame["local_palette_offset"] is not None:
+                start = frame["local_palette_offset"]
+                return self.buffer[start:start + 3 * frame["local_palette_size"]]
+        if self.global_palette_offset is None:
+            return None
+        start = self.global_palette_offset
+        return self.buffer[start:start + 3 * self.global_palette_size]
+
+    def metadata(self):
+        """
+        返回與 read_gif_metadata 相同格式的字典。
+        """
+        return {
+            "version": self.version,
+            "width": self.width,
+            "height": self.height,
+            "global_palette_size": self.global_palette_size,
+            "background_index": self.background_index,
+            "loop_count": self.loop_count,
+            "frame_count": len(self.frames),
+            "frame_delays": [frame["delay"] for frame in self.frames],
+            "local_palette_sizes": [frame["local_palette_size"] for frame in self.frames],
+            "truncated": self.truncated,
+        }
+
+
+def read_gif_metadata(input_gif_path):
+    """
+    讀取 GIF 區塊結構 (邏輯螢幕描述、圖形控制擴充、影像描述)，
+    取得精確幀數、每幀延遲、尺寸、循環次數與調色盤大小。
+    返回一個字典；結構錯誤時拋出 GIFFormatError。
+    """
+    with GIFIndex(input_gif_path) as index:
+        return index.metadata()
+
+
+def read_gif_dimensions(input_gif_path):
+    """
+    只讀取 GIF 標頭與邏輯螢幕描述 (13 位元組)，快速返回 (寬, 高)。
+    """
+    with open(input_gif_path, 'rb') as f:
+        header = f.read(13)
+    if len(header) < 13 or header[:3] != b'GIF':
+        raise GIFFormatError("不是有效的 GIF 檔案 (缺少 GIF 標頭)。")
+    return struct.unpack_from('<HH', header, 6)
+
+
+def gif_info_from_metadata(meta):
+    """
+    將 read_gif_metadata 的結果轉換為與 ffprobe 相同意義的平均幀率、總時長與總幀數。
+    """
+    frame_count = meta["frame_count"]
+    duration = sum(effective_delay_cs(d) for d in meta["frame_delays"]) / 100.0
+    avg_fps = frame_count / duration if duration > 0 else 0
+    return avg_fps, duration, frame_count
+
+
+# --- 探測結果快取 (SQLite，存放於 driver 資料夾) ---
+
+PROBE_CACHE_PATH = os.path.join('.', 'driver', 'probe_cache.sqlite3')
+PROBE_CACHE_MAX_BYTES = 16 * 1024 * 1024 # 快取結果總大小上限，超過時依最久未使用 (LRU) 淘汰
+FINGERPRINT_SAMPLE_BYTES = 64 * 1024
+
+# 存入快取的探測欄位 (檔案大小每次都即時取得，不存入快取)
+PROBE_CACHE_KEYS = (
+    "avg_fps", "duration", "total_frames", "width", "height", "frame_delays",
+    "loop_count", "global_palette_size", "local_palette_sizes",
+)
+
+
+def file_fingerprint(input_path, file_size=None):
+    """
+    以檔案大小加上開頭、中段、結尾各 64 KiB 內容計算內容指紋。
+    只讀取少量資料，用於檔案被複製、搬移或僅更新修改時間時仍能命中快取。
+    """
+    if file_size is None:
+        file_size = os.path.getsize(input_path)
+    digest = hashlib.sha1(str(file_size).encode('ascii'))
+    with open(input_path, 'rb') as f:
+        for offset in (0, max(0, file_size // 2 - FINGERPRINT_SAMPLE_BYTES // 2), max(0, file_size - FINGERPRINT_SAMPLE_BYTES)):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+class ProbeCache:
+    """
+    以 (路徑, 大小, 修改時間, inode) 為鍵的持久化探測結果快取。
+    鍵不符時改以內容指紋查找；總大小超過上限時淘汰最久未使用的項目。
+    所有 SQLite 錯誤都視為未命中，快取失效不會影響探測本身。
+    """
+
+    def __init__(self, db_path=PROBE_CACHE_PATH, max_bytes=PROBE_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS probe_cache ("
+                " path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,"
+                " fingerprint TEXT, result TEXT NOT NULL, result_bytes INTEGER NOT NULL, last_used REAL NOT NULL,"
+                " PRIMARY KEY (path, size, mtime_ns, inode))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS probe_cache_fingerprint ON probe_cache (fingerprint)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _stat_key(input_path):
+        st = os.stat(input_path)
+        return os.path.abspath(input_path), st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, input_path):
+        """
+        返回快取的探測結果字典，未命中時返回 None。
+        """
+        try:
+            key = self._stat_key(input_path)
+        except OSError:
+            return None
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT result FROM probe_cache WHERE path=? AND size=? AND mtime_ns=? AND inode=?", key
+                ).fetchone()
+                if row is None:
+                    # 鍵不符時以內容指紋查找，命中後以新鍵重新登記
+                    fingerprint = file_fingerprint(input_path, key[1])
+                    row = conn.execute(
+                        "SELECT result FROM probe_cache WHERE fingerprint=? AND size=? ORDER BY last_used DESC LIMIT 1",
+                        (fingerprint, key[1])
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    self._store(conn, key, fingerprint, row[0])
+                else:
+                    conn.execute(
+                        "UPDATE probe_cache SET last_used=? WHERE path=? AND size=? AND mtime_ns=? AND inode=?",
+                        (time.time(),) + key
+                    )
+                conn.commit()
+                return json.loads(row[0])
+            except (sqlite3.Error, OSError, ValueError):
+                return None
+
+    def put(self, input_path, result):
+        """
+        存入探測結果 (僅保留 PROBE_CACHE_KEYS 中的欄位)。
+        """
+        payload = json.dumps({k: result.get(k) for k in PROBE_CACHE_KEYS}, separators=(',', ':'))
+        try:
+            key = self._stat_key(input_path)
+            fingerprint = file_fingerprint(input_path, key[1])
+        except OSError:
+            return
+        with self._lock:
+            try:
+                conn = self._connect()
+                self._store(conn, key, fingerprint, payload)
+                self._evict(conn)
+                conn.commit()
+            except sqlite3.Error:
+                pass
+
+    def _store(self, conn, key, fingerprint, payload):
+        # 同一路徑的舊版本 (大小或修改時間不同) 已失效，一併移除
+        conn.execute("DELETE FROM probe_cache WHERE path=?", (key[0],))
+        conn.execute(
+            "INSERT OR REPLACE INTO probe_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            key + (fingerprint, payload, len(payload), time.time())
+        )
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(result_bytes), 0) FROM probe_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 淘汰到上限的九成，避免每次寫入都觸發淘汰
+        excess = total - int(self.max_bytes * 0.9)
+        rows = conn.execute("SELECT rowid, result_bytes FROM probe_cache ORDER BY last_used ASC").fetchall()
+        doomed = []
+        for rowid, result_bytes in rows:
+            if excess <= 0:
+                break
+            doomed.append((rowid,))
+            excess -= result_bytes
+        conn.executemany("DELETE FROM probe_cache WHERE rowid=?", doomed)
+
+
+_probe_cache = None
+_probe_cache_lock = threading.Lock()
+
+
+def get_probe_cache():
+    """
+    返回全程式共用的 ProbeCache 實例。
+    """
+    global _probe_cache
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            _probe_cache = ProbeCache()
+        return _probe_cache
+
+
+def probe_gif(input_gif_path, use_cache=True):
+    """
+    取得 GIF 的探測結果字典 (PROBE_CACHE_KEYS 中的欄位)，優先查詢快取，未命中時以原生解析器讀取並寫入快取。
+    無法以原生方式解析時拋出 GIFFormatError，由呼叫端決定是否改用 ffprobe (ffprobe 的結果不寫入快取)。
+    """
+    cache = get_probe_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(input_gif_path)
+        # 缺少每幀延遲的項目 (舊版寫入的 ffprobe 結果) 視為未命中
+        if cached is not None and cached.get("frame_delays"):
+            return cached
+
+    meta = read_gif_metadata(input_gif_path)
+    result = {key: meta.get(key) for key in PROBE_CACHE_KEYS}
+    result["avg_fps"], result["duration"], result["total_frames"] = gif_info_from_metadata(meta)
+
+    if cache is not None:
+        cache.put(input_gif_path, result)
+    return result
+
+
+# --- 並行工作數 ---
+
+# GIF 解碼、palettegen/paletteuse 與 GIF 編碼在 FFmpeg 內大多是單執行緒，
+# 一個工作實際約佔用兩個核心 (解碼與濾鏡/編碼管線)。
+FFMPEG_THREADS_PER_JOB = 2
+
+
+def physical_core_count():
+    """
+    返回實體核心數；無法判斷時以邏輯處理器數量代替。
+    """
+    logical = os.cpu_count() or 1
+    if sys.platform.startswith('linux'):
+        try:
+            cores = set()
+            physical_id = core_id = None
+            with open('/proc/cpuinfo', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    key = key.strip()
+                    if key == 'physical id':
+                        physical_id = value.strip()
+                    elif key == 'core id':
+                        core_id = value.strip()
+                    elif not key:
+                        if core_id is not None:
+                            cores.add((physical_id, core_id))
+                        physical_id = core_id = None
+            if core_id is not None:
+                cores.add((physical_id, core_id))
+            if cores:
+                return len(cores)
+        except OSError:
+            pass
+    elif sys.platform == 'win32':
+        try:
+            return _windows_physical_core_count() or logical
+        except (OSError, AttributeError, ValueError):
+            pass
+    return logical
+
+
+def _windows_physical_core_count():
+    # 透過 GetLogicalProcessorInformation 計算 RelationProcessorCore 的項目數
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessorInformation(ctypes.Structure):
+        _fields_ = [
+            ("ProcessorMask", ctypes.c_size_t),
+            ("Relationship", ctypes.c_int),
+            ("Reserved", ctypes.c_ulonglong * 2),
+        ]
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    length = wintypes.DWORD(0)
+    kernel32.GetLogicalProcessorInformation(None, ctypes.byref(length))
+    count = length.value // ctypes.sizeof(_ProcessorInformation)
+    if count == 0:
+        return None
+    buffer = (_ProcessorInformation * count)()
+    if not kernel32.GetLogicalProcessorInformation(buffer, ctypes.byref(length)):
+        return None
+    return sum(1 for item in buffer if item.Relationship == 0) # 0 = RelationProcessorCore
+
+
+def default_job_concurrency():
+    """
+    預設同時執行的 FFmpeg 工作數：實體核心數除以每個工作的執行緒用量 (至少 1)。
+    """
+    return max(1, physical_core_count() // FFMPEG_THREADS_PER_JOB)
+
+
+# --- FFmpeg 進度解析 (-progress 輸出) ---
+
+# -progress 輸出的 key=value 欄位名稱，用於與一般日誌行區分
+FFMPEG_PROGRESS_KEYS = frozenset((
+    "frame", "fps", "stream_0_0_q", "bitrate", "total_size", "out_time_us", "out_time_ms",
+    "out_time", "dup_frames", "drop_frames", "speed", "progress",
+))
+
+
+class FFmpegProgressParser:
+    """
+    解析 FFmpeg 以 -progress 輸出的 key=value 區塊，並依目標幀數計算百分比、處理速度與預估剩餘時間。
+    """
+
+    def __init__(self, target_frame_count=None):
+        self.target_frame_count = target_frame_count
+        self.started = time.monotonic()
+        self._fields = {}
+        self.last_snapshot = None
+
+    @staticmethod
+    def is_progress_line(line):
+        key, sep, _ = line.partition('=')
+        return bool(sep) and key.strip() in FFMPEG_PROGRESS_KEYS
+
+    def feed(self, line):
+        """
+        餵入一行輸出；若為一個進度區塊的結尾 (progress=...)，返回進度快照字典，否則返回 None。
+        """
+        key, sep, value = line.strip().partition('=')
+        if not sep or key not in FFMPEG_PROGRESS_KEYS:
+            return None
+        self._fields[key] = value.strip()
+        if key != "progress":
+            return None
+
+        elapsed = time.monotonic() - self.started
+        try:
+            frame = int(self._fields.get("frame", 0))
+        except ValueError:
+            frame = 0
+        try:
+            processing_fps = float(self._fields.get("fps", 0))
+        except ValueError:
+            processing_fps = 0.0
+        if processing_fps <= 0 and elapsed > 0:
+            processing_fps = frame / elapsed
+        speed = self._fields.get("speed", "").rstrip('x').strip()
+        try:
+            speed = float(speed)
+        except ValueError:
+            speed = None
+
+        finished = value.strip() == "end"
+        percentage = -1.0
+        eta = None
+        if self.target_frame_count:
+            percentage = 100.0 if finished else min(99.9, frame * 100.0 / self.target_frame_count)
+            if finished:
+                eta = 0.0
+            elif processing_fps > 0:
+                eta = max(0.0, (self.target_frame_count - frame) / processing_fps)
+
+        self.last_snapshot = {
+            "frame": frame,
+            "processing_fps": processing_fps,
+            "speed": speed,
+            "percentage": percentage,
+            "eta": eta,
+            "elapsed": elapsed,
+            "finished": finished,
+        }
+        return self.last_snapshot
+
+
+def format_progress(snapshot):
+    """
+    將進度快照格式化為單行文字。
+    """
+    parts = []
+    if snapshot["percentage"] >= 0:
+        parts.append(f"{snapshot['percentage']:.1f}%")
+    parts.append(f"{snapshot['frame']} 幀")
+    if snapshot["processing_fps"] > 0:
+        parts.append(f"{snapshot['processing_fps']:.1f} fps")
+    if snapshot["eta"] is not None:
+        parts.append(f"預估剩餘 {snapshot['eta']:.0f} 秒")
+    return "進度: " + "，".join(parts)
+
+
+def parse_progress_output(output, target_frame_count=None):
+    """
+    解析一段完整的 -progress 輸出 (例如執行結束後收集的 stdout)，返回最後的進度快照，沒有進度區塊時返回 None。
+    """
+    parser = FFmpegProgressParser(target_frame_count)
+    for line in output.splitlines():
+        parser.feed(line)
+    return parser.last_snapshot
+
+
+# --- 階段計時與結構化報告 (JSON Lines) ---
+
+RUN_REPORT_PATH = os.path.join('.', 'driver', 'run_report.jsonl')
+RUN_REPORT_MAX_BYTES = 4 * 1024 * 1024 # 報告檔超過此大小時輪替為 <path>.1 (只保留一份舊檔)，避免無限成長
+_report_write_lock = threading.Lock() # 多個工作共用同一個報告檔時，確保每行完整寫入
+
+
+def rotate_run_report(path, max_bytes=RUN_REPORT_MAX_BYTES):
+    """
+    報告檔超過 max_bytes 時改名為 <path>.1 (覆蓋既有的舊檔)，之後的事件寫入新檔。需在 _report_write_lock 內呼叫。
+    """
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return False
+        os.replace(path, path + '.1')
+        return True
+    except OSError:
+        return False
+
+
+class RunReport:
+    """
+    一個工作的結構化事件紀錄，每個事件為一行 JSON：
+    ts 為 Unix 時間，t 為工作開始後的單調時鐘秒數，job 為工作名稱，event 為事件種類。
+    path 為 None 時只保留在 events 中，為 '-' 時寫到標準輸出，否則附加到該檔案。
+    """
+
+    def __init__(self, job, path=None):
+        self.job = job
+        self.path = path
+        self.started = time.monotonic()
+        self.events = []
+
+    def emit(self, event, **fields):
+        record = {"ts": round(time.time(), 3), "t": round(time.monotonic() - self.started, 4), "job": self.job, "event": event}
+        record.update(fields)
+        self.events.append(record)
+        if self.path:
+            line = json.dumps(record, ensure_ascii=False) + '\n'
+            with _report_write_lock:
+                if self.path == '-':
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+                else:
+                    try:
+                        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                        rotate_run_report(self.path)
+                        with open(self.path, 'a', encoding='utf-8') as f:
+                            f.write(line)
+                    except OSError:
+                        pass # 報告寫入失敗不影響處理
+        return record
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """
+        以單調時鐘計時一個階段，結束時送出 stage 事件 (含 seconds 與 status)。
+        區塊內可在取得的字典中補充欄位，設定 "status" 可覆寫狀態 (例如 cancelled)；發生例外時狀態為 error 並重新拋出。
+        """
+        extra = dict(fields)
+        started = time.monotonic()
+        status = "ok"
+        try:
+            yield extra
+        except BaseException as e:
+            status = "error"
+            extra.setdefault("error", str(e) or type(e).__name__)
+            raise
+        finally:
+            status = extra.pop("status", status)
+            self.emit("stage", stage=name, status=status, seconds=round(time.monotonic() - started, 4), **extra)
+
+    def ffmpeg_progress(self, snapshot):
+        # FFmpeg 自己回報的 frame= 與 speed= 數值
+        self.emit("ffmpeg_progress", frame=snapshot["frame"], speed=snapshot["speed"],
+                  fps=round(snapshot["processing_fps"], 2), ffmpeg_elapsed=round(snapshot["elapsed"], 3))
+
+    def stage_seconds(self):
+        """
+        返回 {階段名稱: 累計秒數}，供結果摘要使用。
+        """
+        totals = {}
+        for record in self.events:
+            if record["event"] == "stage":
+                totals[record["stage"]] = totals.get(record["stage"], 0.0) + record["seconds"]
+        return totals
+
+
+# --- 可取消的子行程 ---
+
+PROCESS_TERMINATE_TIMEOUT = 3.0 # 送出終止訊號後等待的秒數，逾時則強制結束
+
+
+def process_group_kwargs():
+    """
+    返回讓子行程自成一個行程群組的 Popen 參數，取消時才能連同其子行程一併終止。
+    """
+    if sys.platform == 'win32':
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def terminate_process_tree(process, timeout=PROCESS_TERMINATE_TIMEOUT):
+    """
+    終止子行程及其整個行程樹：先要求結束，逾時後強制結束，總等待時間有上限。
+    """
+    if process.poll() is not None:
+        return
+    if sys.platform == 'win32':
+        try:
+            subprocess.run(
+                ['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                capture_output=True, timeout=timeout,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+            )
+        except (OSError, subprocess.SubprocessError):
+            pass
+        if process.poll() is None:
+            process.kill()
+    else:
+        try:
+            pgid = os.getpgid(process.pid)
+            os.killpg(pgid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pgid = None
+            process.terminate()
+        try:
+            process.wait(timeout=timeout)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+        try:
+            if pgid is not None:
+                os.killpg(pgid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+class CancelToken:
+    """
+    跨執行緒的取消旗標。執行中的子行程可附加到 token 上，
+    cancel() 會立即終止該行程樹，讓等待中的讀取迴圈在有限時間內返回。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._process = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def attach(self, process):
+        with self._lock:
+            self._process = process
+        # 附加前已取消時直接終止
+        if self.cancelled:
+            terminate_process_tree(process)
+
+    def detach(self):
+        with self._lock:
+            self._process = None
+
+    def cancel(self, wait=True):
+        """
+        設定取消旗標並終止已附加的行程樹；wait 為 False 時在背景執行緒終止，不阻塞呼叫端 (例如 GUI 執行緒)。
+        """
+        self._event.set()
+        with self._lock:
+            process = self._process
+        if process is None:
+            return
+        if wait:
+            terminate_process_tree(process)
+        else:
+            threading.Thread(target=terminate_process_tree, args=(process,), daemon=True).start()
+
+
+FILTER_INLINE_MAX_CHARS = 4096 # 過長的濾鏡圖改寫入腳本檔，避免超過 Windows 命令列長度上限
+_FILTER_SCRIPT_OPTIONS = {
+    '-vf': '-filter_script:v',
+    '-filter:v': '-filter_script:v',
+    '-lavfi': '-filter_complex_script',
+    '-filter_complex': '-filter_complex_script',
+}
+
+
+@contextlib.contextmanager
+def long_filters_as_scripts(command):
+    """
+    將命令中過長的 -vf/-lavfi 濾鏡圖寫入暫存腳本並改用對應的 *_script 選項，離開時刪除暫存檔。
+    """
+    temp_paths = []
+    rewritten = list(command)
+    try:
+        for i in range(len(rewritten) - 1):
+            option = rewritten[i]
+            graph = rewritten[i + 1]
+            if option in _FILTER_SCRIPT_OPTIONS and len(graph) > FILTER_INLINE_MAX_CHARS:
+                fd, script_path = tempfile.mkstemp(prefix='gif_filter_', suffix='.txt')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(graph)
+                temp_paths.append(script_path)
+                rewritten[i] = _FILTER_SCRIPT_OPTIONS[option]
+                rewritten[i + 1] = script_path
+        yield rewritten
+    finally:
+        for script_path in temp_paths:
+            remove_partial_output(script_path)
+
+
+PIPE_TAIL_LINES = 200 # 每個管線保留的最後行數，供錯誤訊息與進度解析使用
+PIPE_READ_SIZE = 65536
+
+
+class PipeReader:
+    """
+    單一管線的讀取狀態：位元組以 UTF-8 增量解碼後切成行 (\r 也視為換行)，
+    每個非空行交給回調，並只保留最後 tail_lines 行 (None 表示全部保留)。
+    """
+
+    def __init__(self, pipe, on_line=None, tail_lines=PIPE_TAIL_LINES):
+        self.pipe = pipe
+        self.on_line = on_line
+        self.lines = collections.deque(maxlen=tail_lines)
+        self.error = None # 回調拋出的第一個例外，等待端會重新拋出
+        self.closed = threading.Event()
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial = ''
+
+    def feed(self, data, final=False):
+        text = self._partial + self._decoder.decode(data, final)
+        parts = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        self._partial = '' if final else parts.pop()
+        for line in parts:
+            line = line.rstrip()
+            if not line:
+                continue
+            self.lines.append(line)
+            if self.on_line is not None and self.error is None:
+                try:
+                    self.on_line(line)
+                except Exception as e:
+                    self.error = e
+
+    def close(self):
+        self.feed(b'', final=True)
+        try:
+            self.pipe.close()
+        except OSError:
+            pass
+        self.closed.set()
+
+
+class PipePump:
+    """
+    以單一執行緒 (selectors + 非阻塞讀取) 同時讀取多個子行程的 stdout/stderr：
+    任一管線塞滿都不會讓子行程卡住，批次模式的多個 FFmpeg 也共用同一個 I/O 執行緒。
+    Windows 的 select 不支援管線，改為每個管線一個讀取執行緒，介面相同。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._selector = None
+        self._wakeup = None
+        self._thread = None
+
+    def add(self, pipe, on_line=None, tail_lines=PIPE_TAIL_LINES):
+        """
+        開始讀取 pipe (Popen 的二進位管線)，返回 PipeReader；讀到 EOF 後其 closed 事件會被設定。
+        """
+        reader = PipeReader(pipe, on_line, tail_lines)
+        if sys.platform == 'win32':
+            threading.Thread(target=self._read_blocking, args=(reader,), daemon=True).start()
+            return reader
+        with self._lock:
+            self._pending.append(reader)
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup = os.pipe()
+                for fd in self._wakeup:
+                    os.set_blocking(fd, False)
+                self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+                self._thread = threading.Thread(target=self._run, name="PipePump", daemon=True)
+                self._thread.start()
+        try:
+            os.write(self._wakeup[1], b'\0')
+        except BlockingIOError:
+            pass # 喚醒管線已有未讀取的位元組，I/O 執行緒一定會醒來
+        return reader
+
+    @staticmethod
+    def _read_blocking(reader):
+        try:
+            while True:
+                chunk = reader.pipe.read1(PIPE_READ_SIZE)
+                if not chunk:
+                    break
+                reader.feed(chunk)
+        except (OSError, ValueError):
+            pass
+        reader.close()
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    try:
+                        os.read(key.fd, 4096)
+                    except BlockingIOError:
+                        pass
+                    with self._lock:
+                        pending, self._pending = self._pending, []
+                    for reader in pending:
+                        fd = reader.pipe.fileno()
+                        os.set_blocking(fd, False)
+                        self._selector.register(fd, selectors.EVENT_READ, reader)
+                    continue
+                reader = key.data
+                try:
+                    chunk = os.read(key.fd, PIPE_READ_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b''
+                if chunk:
+                    reader.feed(chunk)
+                else:
+                    self._selector.unregister(key.fd)
+                    reader.close()
+
+
+_pipe_pump = None
+_pipe_pump_lock = threading.Lock()
+
+
+def get_pipe_pump():
+    global _pipe_pump
+    with _pipe_pump_lock:
+        if _pipe_pump is None:
+            _pipe_pump = PipePump()
+        return _pipe_pump
+
+
+def run_streaming(command, on_stdout_line=None, on_stderr_line=None, cancel_token=None, memory_limit=None,
+                  tail_lines=PIPE_TAIL_LINES, **popen_kwargs):
+    """
+    執行命令，由共用的 I/O 執行緒同時讀取 stdout 與 stderr，每個完整行交給對應的回調 (在 I/O 執行緒中呼叫)。
+    可透過 cancel_token 中途終止；提供 memory_limit (位元組) 時，常駐記憶體超過上限會終止行程並拋出 MemoryLimitExceeded。
+    返回 (返回碼, stdout 最後幾行, stderr 最後幾行)，各最多 tail_lines 行。
+    """
+    with long_filters_as_scripts(command) as command:
+        process = subprocess.Popen(
+            command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            **process_group_kwargs(), **popen_kwargs
+        )
+        pump = get_pipe_pump()
+        readers = (pump.add(process.stdout, on_stdout_line, tail_lines), pump.add(process.stderr, on_stderr_line, tail_lines))
+        if cancel_token is not None:
+            cancel_token.attach(process)
+        watchdog = MemoryWatchdog(process, memory_limit) if memory_limit else None
+        try:
+            for reader in readers:
+                reader.closed.wait()
+            return_code = process.wait()
+        finally:
+            if cancel_token is not None:
+                cancel_token.detach()
+            if watchdog is not None:
+                watchdog.stop()
+    if watchdog is not None:
+        watchdog.check()
+    for reader in readers:
+        if reader.error is not None:
+            raise reader.error
+    return return_code, list(readers[0].lines), list(readers[1].lines)
+
+
+def run_cancellable(command, cancel_token=None, memory_limit=None, tail_lines=PIPE_TAIL_LINES, **popen_kwargs):
+    """
+    執行命令並收集 stdout/stderr (文字，各只保留最後 tail_lines 行)，可透過 cancel_token 中途終止。
+    提供 memory_limit (位元組) 時，常駐記憶體超過上限會終止行程並拋出 MemoryLimitExceeded。
+    返回 (返回碼, stdout, stderr)。
+    """
+    return_code, stdout_lines, stderr_lines = run_streaming(
+        command, cancel_token=cancel_token, memory_limit=memory_limit, tail_lines=tail_lines, **popen_kwargs
+    )
+    return return_code, "\n".join(stdout_lines), "\n".join(stderr_lines)
+
+
+def remove_partial_output(output_path):
+    """
+    刪除被取消或失敗的工作留下的不完整輸出檔。
+    """
+    try:
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+    except OSError:
+        pass
+
+
+# --- 記憶體估算與上限 (低記憶體模式) ---
+
+MEMORY_BASE_OVERHEAD = 64 * 1024 * 1024 # FFmpeg 本身與解碼器/編碼器的固定開銷估計
+DECODED_BYTES_PER_PIXEL = 4 # GIF 解碼後為 BGRA
+STREAMING_FRAME_BUFFER = 8 # 串流處理時濾鏡鏈與編碼器中同時存在的幀數估計
+DEFAULT_JOB_MEMORY_LIMIT_MIB = 1024
+MEMORY_POLL_INTERVAL = 0.2
+
+
+class MemoryLimitExceeded(Exception):
+    """
+    子行程的常駐記憶體超過設定的上限而被終止。
+    """
+
+
+def estimate_peak_memory(width, height, output_frame_count, two_pass=False):
+    """
+    依尺寸與輸出幀數估計 FFmpeg 的峰值記憶體 (位元組)。
+    單階段的 split + palettegen 會保留所有輸出幀直到調色盤完成，兩階段則只需少量串流緩衝。
+    """
+    frame_bytes = width * height * DECODED_BYTES_PER_PIXEL
+    buffered_frames = STREAMING_FRAME_BUFFER if two_pass else output_frame_count + STREAMING_FRAME_BUFFER
+    return MEMORY_BASE_OVERHEAD + frame_bytes * buffered_frames
+
+
+def plan_memory_strategy(width, height, output_frame_count, memory_limit_bytes, two_pass=False):
+    """
+    低記憶體模式的處理策略：單階段估計超過上限時自動改用兩階段調色盤。
+    返回 (是否使用兩階段, 估計峰值位元組, 是否在上限內)；尺寸未知時無法估計，估計值為 None。
+    """
+    if not width or not height or not output_frame_count:
+        return two_pass, None, True
+    if not two_pass and estimate_peak_memory(width, height, output_frame_count, False) > memory_limit_bytes:
+        two_pass = True
+    estimate = estimate_peak_memory(width, height, output_frame_count, two_pass)
+    return two_pass, estimate, estimate <= memory_limit_bytes
+
+
+def process_rss_bytes(pid):
+    """
+    返回行程目前的常駐記憶體 (位元組)，平台不支援或行程已結束時返回 None。
+    """
+    if sys.platform == 'win32':
+        try:
+            return _windows_process_rss_bytes(pid)
+        except (OSError, AttributeError, ValueError):
+            return None
+    try:
+        with open(f'/proc/{pid}/status', encoding='ascii', errors='replace') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _windows_process_rss_bytes(pid):
+    # 透過 K32GetProcessMemoryInfo 讀取 WorkingSetSize
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    handle = kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        return None
+    try:
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(_ProcessMemoryCounters)
+        if not kernel32.K32GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+class MemoryWatchdog:
+    """
+    在背景定期檢查子行程的常駐記憶體，超過上限時終止整個行程樹，
+    避免批次工作把系統推向 OOM。
+    """
+
+    def __init__(self, process, limit_bytes, interval=MEMORY_POLL_INTERVAL):
+        self.process = process
+        self.limit_bytes = limit_bytes
+        self.interval = interval
+        self.exceeded = False
+        self.peak_bytes = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.process.poll() is not None:
+                return
+            rss = process_rss_bytes(self.process.pid)
+            if rss is None:
+                continue
+            self.peak_bytes = max(self.peak_bytes, rss)
+            if rss > self.limit_bytes:
+                self.exceeded = True
+                terminate_process_tree(self.process)
+                return
+
+    def stop(self):
+        self._stop_event.set()
+
+    def check(self):
+        """
+        停止監看；若曾超過上限則拋出 MemoryLimitExceeded。
+        """
+        self.stop()
+        if self.exceeded:
+            raise MemoryLimitExceeded(
+                f"FFmpeg 記憶體用量 {self.peak_bytes / (1024 * 1024):.0f} MiB 超過上限 "
+                f"{self.limit_bytes / (1024 * 1024):.0f} MiB，已終止。"
+            )
+
+
+# --- 兩階段調色盤與調色盤快取 ---
+
+# 單階段濾鏡 split + palettegen 會把所有幀保留在記憶體中直到調色盤產生完畢；
+# 兩階段模式先把調色盤寫成 PNG，再以串流方式執行 paletteuse。
+PALETTE_CACHE_DIR = os.path.join('.', 'driver', 'palette_cache')
+PALETTE_CACHE_MAX_FILES = 256 # 超過時依最久未使用刪除
+DEFAULT_PALETTEGEN_OPTIONS = ""
+DEFAULT_PALETTEUSE_OPTIONS = "diff_mode=rectangle" # 只在變化的矩形內重新抖色，靜止區域逐幀保持相同的索引
+
+
+def _filter_with_options(filter_name, options):
+    return f"{filter_name}={options}" if options else filter_name
+
+
+def fps_filter(target_fps):
+    return f"fps={target_fps:.15f}"
+
+
+def single_pass_filter(frame_filter, palettegen_options=DEFAULT_PALETTEGEN_OPTIONS, paletteuse_options=DEFAULT_PALETTEUSE_OPTIONS):
+    """
+    原本的單階段濾鏡圖：選幀 (fps 或 select) → split → palettegen/paletteuse。
+    """
+    palettegen = _filter_with_options('palettegen', palettegen_options)
+    paletteuse = _filter_with_options('paletteuse', paletteuse_options)
+    return f"{frame_filter},split[s0][s1];[s0]{palettegen}[p];[s1][p]{paletteuse}"
+
+
+def build_palettegen_command(ffmpeg_path, input_gif_path, palette_path, frame_filter, palettegen_options=DEFAULT_PALETTEGEN_OPTIONS):
+    """
+    第一階段：只產生調色盤 PNG。
+    """
+    return [
+        ffmpeg_path, '-y', '-nostats',
+        '-i', input_gif_path,
+        '-vf', f"{frame_filter},{_filter_with_options('palettegen', palettegen_options)}",
+        '-frames:v', '1', '-update', '1',
+        palette_path
+    ]
+
+
+def build_paletteuse_command(ffmpeg_path, input_gif_path, palette_path, output_gif_path, frame_filter,
+                             paletteuse_options=DEFAULT_PALETTEUSE_OPTIONS, extra_args=(), output_args=()):
+    """
+    第二階段：以現成的調色盤串流套用 paletteuse，不需保留整段影片。
+    extra_args 會放在輸入之前 (例如 -progress pipe:2)，output_args 放在輸出檔之前 (例如 -fps_mode passthrough)。
+    """
+    return [
+        ffmpeg_path, '-y', '-nostats', *extra_args,
+        '-i', input_gif_path,
+        '-i', palette_path,
+        '-lavfi', f"[0:v]{frame_filter}[x];[x][1:v]{_filter_with_options('paletteuse', paletteuse_options)}",
+        *output_args,
+        output_gif_path
+    ]
+
+
+def palette_cache_path(input_gif_path, frame_filter, palettegen_options=DEFAULT_PALETTEGEN_OPTIONS, cache_dir=PALETTE_CACHE_DIR):
+    """
+    依 (輸入檔指紋, 選幀濾鏡, palettegen 參數) 決定調色盤快取檔路徑，
+    同一來源嘗試不同目標幀數但選幀結果相同時可直接重用。
+    """
+    stat = os.stat(input_gif_path)
+    key = "|".join((
+        file_fingerprint(input_gif_path, stat.st_size),
+        str(stat.st_mtime_ns),
+        frame_filter,
+        palettegen_options or "",
+    ))
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".png")
+
+
+def _prune_palette_cache(cache_dir, max_files=PALETTE_CACHE_MAX_FILES):
+    try:
+        entries = [
+            entry for entry in os.scandir(cache_dir)
+            if entry.is_file() and entry.name.endswith('.png') and '.tmp-' not in entry.name
+        ]
+    except OSError:
+        return
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def generate_palette(ffmpeg_path, input_gif_path, frame_filter, palettegen_options=DEFAULT_PALETTEGEN_OPTIONS,
+                     cancel_token=None, cache_dir=PALETTE_CACHE_DIR, use_cache=True, memory_limit=None):
+    """
+    取得 (或產生) 調色盤 PNG。
+    返回 (調色盤路徑, 是否來自快取, FFmpeg 輸出)；失敗或取消時調色盤路徑為 None。
+    超過 memory_limit 時拋出 MemoryLimitExceeded。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    palette_path = palette_cache_path(input_gif_path, frame_filter, palettegen_options, cache_dir)
+    if use_cache and os.path.exists(palette_path):
+        try:
+            os.utime(palette_path) # 更新時間作為 LRU 依據
+        except OSError:
+            pass
+        return palette_path, True, ""
+
+    # 先寫入暫存檔再原子替換，多個工作同時產生同一調色盤時也不會讀到半個檔案
+    stem = os.path.splitext(palette_path)[0]
+    temp_path = f"{stem}.tmp-{os.getpid()}-{threading.get_ident()}.png"
+    command = build_palettegen_command(ffmpeg_path, input_gif_path, temp_path, frame_filter, palettegen_options)
+    try:
+        return_code, _, stderr = run_cancellable(command, cancel_token, memory_limit)
+    except OSError as e:
+        remove_partial_output(temp_path)
+        return None, False, str(e)
+    except MemoryLimitExceeded:
+        remove_partial_output(temp_path)
+        raise
+    if return_code != 0 or (cancel_token is not None and cancel_token.cancelled) or not os.path.exists(temp_path):
+        remove_partial_output(temp_path)
+        return None, False, stderr
+    os.replace(temp_path, palette_path)
+    _prune_palette_cache(cache_dir)
+    return palette_path, False, stderr
+
+
+# --- 原生抽幀引擎 (只減少幀數時不經過 FFmpeg) ---
+
+# 只丟棄幀時，保留幀的 LZW 資料可原封不動複製，只需改寫 GCE 的延遲；
+# 僅在被丟棄的幀留下的畫面差異無法被下一個保留幀完整覆蓋時，才解碼並重新合成該幀。
+# 重新合成使用原始顏色 (全域調色盤或無損的區域調色盤)，不會重新量化。
+NATIVE_RECOMPOSITE_MAX_PIXELS = 32 * 1024 * 1024 # 需要逐像素合成時可解碼的像素總量上限，超過時交給 FFmpeg
+GCE_MAX_DELAY_CS = 0xFFFF
+TRANSPARENT_PIXEL = -1 # 畫布上被清除 (透明) 的像素
+
+
+class DecimationUnsupported(Exception):
+    """原生抽幀引擎無法無損處理此 GIF 時拋出，呼叫端應改用 FFmpeg。"""
+
+
+def plan_kept_frames(frame_delays, target_frame_count):
+    """
+    依累積延遲以 Bresenham 方式平均選出要保留的幀，並把被丟棄幀的延遲併入前一個保留幀。
+    返回 (保留幀索引列表, 每個保留幀的新延遲 (百分之一秒))，總時長與原始相同 (精確到百分之一秒)。
+    """
+    delays = [effective_delay_cs(d) for d in frame_delays]
+    frame_count = len(delays)
+    if target_frame_count <= 0:
+        raise ValueError("目標幀數必須是正整數。")
+    if target_frame_count >= frame_count:
+        return list(range(frame_count)), delays
+
+    starts = [0]
+    for delay in delays:
+        starts.append(starts[-1] + delay)
+    total = starts[-1]
+
+    kept = []
+    frame = 0
+    for j in range(target_frame_count):
+        # 第 j 個取樣時間點為 j * total / target，以整數比較避免浮點誤差
+        sample = j * total
+        while frame + 1 < frame_count and starts[frame + 1] * target_frame_count <= sample:
+            frame += 1
+        candidate = frame
+        if kept and candidate <= kept[-1]:
+            candidate = kept[-1] + 1
+        # 保留足夠的幀給剩下的取樣點
+        candidate = min(candidate, frame_count - (target_frame_count - j))
+        kept.append(candidate)
+
+    merged_delays = [starts[kept[j + 1]] - starts[kept[j]] for j in range(len(kept) - 1)]
+    merged_delays.append(total - starts[kept[-1]])
+    return kept, merged_delays
+
+
+def _read_sub_blocks(buf, pos):
+    # 讀取並串接子區塊內容，返回 (資料, 結束後的位移)
+    chunks = []
+    end = len(buf)
+    while pos < end:
+        size = buf[pos]
+        pos += 1
+        if size == 0:
+            break
+        chunks.append(bytes(buf[pos:pos + size]))
+        pos += size
+    return b''.join(chunks), pos
+
+
+def _pack_sub_blocks(data):
+    out = bytearray()
+    for start in range(0, len(data), 255):
+        chunk = data[start:start + 255]
+        out.append(len(chunk))
+        out += chunk
+    out.append(0)
+    return bytes(out)
+
+
+def lzw_decode(data, min_code_size, pixel_count):
+    """
+    解碼 GIF 的 LZW 影像資料，返回長度為 pixel_count 的索引位元組 (資料不足時以 0 補齊)。
+    """
+    if not 2 <= min_code_size <= 11:
+        raise GIFFormatError(f"無效的 LZW 最小碼長 {min_code_size}。")
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    base_table = [bytes((i,)) for i in range(clear_code)] + [b'', b'']
+    table = list(base_table)
+    code_size = min_code_size + 1
+    code_mask = (1 << code_size) - 1
+    output = bytearray()
+    previous = None
+    bit_buffer = 0
+    bit_count = 0
+
+    for byte in data:
+        bit_buffer |= byte << bit_count
+        bit_count += 8
+        while bit_count >= code_size:
+            code = bit_buffer & code_mask
+            bit_buffer >>= code_size
+            bit_count -= code_size
+
+            if code == clear_code:
+                table = list(base_table)
+                code_size = min_code_size + 1
+                code_mask = (1 << code_size) - 1
+                previous = None
+                continue
+            if code == end_code:
+                bit_count = 0
+                break
+
+            if previous is None:
+                entry = table[code] if code < len(table) else b''
+            elif code < len(table):
+                entry = table[code]
+                if len(table) < 4096:
+                    table.append(previous + entry[:1])
+            elif code == len(table):
+                entry = previous + previous[:1]
+                if len(table) < 4096:
+                    table.append(entry)
+            else:
+                raise GIFFormatError("LZW 影像資料損毀。")
+            output += entry
+            previous = entry
+            if len(table) == code_mask + 1 and code_size < 12:
+                code_size += 1
+                code_mask = (1 << code_size) - 1
+        else:
+            # 已取得足夠像素時不再讀取 (部分編碼器的結束碼長度不正確)
+            if len(output) < pixel_count:
+                continue
+        break
+
+    if len(output) < pixel_count:
+        output += bytes(pixel_count - len(output))
+    return bytes(output[:pixel_count])
+
+
+def lzw_encode(indices, min_code_size):
+    """
+    以 GIF 的 LZW 編碼索引位元組 (字典滿時送出清除碼)，返回未分塊的壓縮資料。
+    """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    code_size = min_code_size + 1
+    next_code = end_code + 1
+    table = {}
+    output = bytearray()
+    bit_buffer = 0
+    bit_count = 0
+
+    def emit(code):
+        nonlocal bit_buffer, bit_count
+        bit_buffer |= code << bit_count
+        bit_count += code_size
+        while bit_count >= 8:
+            output.append(bit_buffer & 0xFF)
+            bit_buffer >>= 8
+            bit_count -= 8
+
+    emit(clear_code)
+    if indices:
+        prefix = indices[0]
+        for value in indices[1:]:
+            key = (prefix << 8) | value
+            code = table.get(key)
+            if code is not None:
+                prefix = code
+                continue
+            emit(prefix)
+            table[key] = next_code
+            next_code += 1
+            if next_code == 4096:
+                emit(clear_code)
+                table.clear()
+                next_code = end_code + 1
+                code_size = min_code_size + 1
+            elif next_code > (1 << code_size):
+                code_size += 1
+            prefix = value
+        emit(prefix)
+        # 解碼端讀到最後一個碼時會再新增一個字典項，結束碼需使用對應的碼長
+        if next_code >= (1 << code_size) and code_size < 12:
+            code_size += 1
+    emit(end_code)
+    if bit_count:
+        output.append(bit_buffer & 0xFF)
+    return bytes(output)
+
+
+def _deinterlace_rows(height):
+    # 交錯式影像的資料列順序 → 實際列號
+    return [row for start, step in ((0, 8), (4, 8), (2, 4), (1, 2)) for row in range(start, height, step)]
+
+
+def _palette_colors(palette):
+    # 將 RGB 位元組轉為整數顏色列表，補滿 256 項以容忍超出範圍的索引
+    raw = bytes(palette)
+    colors = [(raw[i] << 16) | (raw[i + 1] << 8) | raw[i + 2] for i in range(0, len(raw) - 2, 3)]
+    return colors + [0] * (256 - len(colors))
+
+
+def _rect_contains(outer, inner):
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and inner[0] + inner[2] <= outer[0] + outer[2] and inner[1] + inner[3] <= outer[1] + outer[3])
+
+
+def _clip_rect(rect, width, height):
+    left, top, frame_width, frame_height = rect
+    right = min(left + frame_width, width)
+    bottom = min(top + frame_height, height)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right - left, bottom - top
+
+
+def _union_rect(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    left = min(a[0], b[0])
+    top = min(a[1], b[1])
+    right = max(a[0] + a[2], b[0] + b[2])
+    bottom = max(a[1] + a[3], b[1] + b[3])
+    return left, top, right - left, bottom - top
+
+
+def _needs_recomposite_rects(index, kept_set):
+    """
+    只依矩形判斷 (不解碼)：每個保留幀是否能直接複製。
+    被丟棄幀可能改變的區域累積為 dirty，保留幀不透明且完整覆蓋 dirty 時才安全。
+    """
+    dirty = []
+    for number, frame in enumerate(index.frames):
+        if number not in kept_set:
+            if frame["disposal"] != 3: # 還原為前一畫面的幀不留下痕跡
+                dirty.append(frame["rect"])
+            continue
+        if dirty:
+            if frame["transparent_index"] is not None:
+                return True
+            if not all(_rect_contains(frame["rect"], rect) for rect in dirty):
+                return True
+        # 繪製後兩邊畫面一致；還原為前一畫面時會回到不同的前一畫面
+        if frame["disposal"] != 3:
+            dirty = []
+    return False
+
+
+class _Canvas:
+    """
+    以整數 RGB (透明為 TRANSPARENT_PIXEL) 保存的完整畫布，用於逐像素合成。
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = [TRANSPARENT_PIXEL] * (width * height)
+
+    def copy_region(self, rect):
+        left, top, w, h = rect
+        return [self.pixels[(top + y) * self.width + left:(top + y) * self.width + left + w] for y in range(h)]
+
+    def paste_region(self, rect, rows):
+        left, top, w, h = rect
+        for y, row in enumerate(rows):
+            start = (top + y) * self.width + left
+            self.pixels[start:start + w] = row
+
+    def clear_region(self, rect):
+        left, top, w, h = rect
+        blank = [TRANSPARENT_PIXEL] * w
+        for y in range(h):
+            start = (top + y) * self.width + left
+            self.pixels[start:start + w] = blank
+
+    def draw(self, frame, indices, colors):
+        left, top, frame_width, frame_height = frame["rect"]
+        clipped = _clip_rect(frame["rect"], self.width, self.height)
+        if clipped is None:
+            return
+        visible_width = clipped[2]
+        transparent = frame["transparent_index"]
+        row_order = _deinterlace_rows(frame_height) if frame["interlaced"] else range(frame_height)
+        for data_row, y in enumerate(row_order):
+            if top + y >= self.height:
+                continue
+            row = indices[data_row * frame_width:data_row * frame_width + visible_width]
+            start = (top + y) * self.width + left
+            if transparent is None:
+                self.pixels[start:start + visible_width] = [colors[i] for i in row]
+            else:
+                old = self.pixels[start:start + visible_width]
+                self.pixels[start:start + visible_width] = [
+                    o if i == transparent else colors[i] for i, o in zip(row, old)
+                ]
+
+    def diff_bounds(self, other):
+        """
+        返回與另一畫布不同像素的外接矩形，完全相同時返回 None。
+        """
+        if self.pixels == other.pixels:
+            return None
+        top = bottom = None
+        left, right = self.width, 0
+        width = self.width
+        for y in range(self.height):
+            start = y * width
+            a = self.pixels[start:start + width]
+            b = other.pixels[start:start + width]
+            if a == b:
+                continue
+            if top is None:
+                top = y
+            bottom = y
+            first = next(x for x in range(width) if a[x] != b[x])
+            last = next(x for x in range(width - 1, -1, -1) if a[x] != b[x])
+            left = min(left, first)
+            right = max(right, last + 1)
+        return left, top, right - left, bottom - top + 1
+
+
+def _gce_bytes(packed, delay_cs, transparent_index):
+    return b'\x21\xF9\x04' + bytes((packed,)) + struct.pack('<H', min(delay_cs, GCE_MAX_DELAY_CS)) + bytes((transparent_index or 0,)) + b'\x00'
+
+
+def write_gif(output_gif_path, width, height, palette, frames, loop_count=0):
+    """
+    以全域調色盤寫出 GIF (例如產生測試素材)。palette 為 RGB 位元組 (2 的次方個顏色)；
+    frames 為字典列表: rect, indices (每像素調色盤索引的 bytes), delay, disposal, transparent_index。
+    """
+    color_count = len(palette) // 3
+    size_bits = max(1, (color_count - 1).bit_length())
+    min_code_size = max(2, size_bits)
+    with open(output_gif_path, 'wb') as output:
+        output.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0x80 | 0x70 | (size_bits - 1), 0, 0))
+        output.write(bytes(palette) + bytes(3 * ((1 << size_bits) - color_count)))
+        if loop_count is not None:
+            output.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', loop_count) + b'\x00')
+        for frame in frames:
+            transparent_index = frame.get("transparent_index")
+            packed = (frame.get("disposal", 1) << 2) | (0x01 if transparent_index is not None else 0)
+            output.write(_gce_bytes(packed, frame["delay"], transparent_index))
+            output.write(b'\x2C' + struct.pack('<HHHHB', *frame["rect"], 0))
+            output.write(bytes((min_code_size,)) + _pack_sub_blocks(lzw_encode(frame["indices"], min_code_size)))
+        output.write(b'\x3B')
+
+
+def _encode_recomposited_frame(index, true_canvas, out_canvas, region, global_colors, allow_transparent=True):
+    """
+    將 true_canvas 在 region 內的像素編碼為一個影像區塊 (影像描述 + [區域調色盤] + LZW)。
+    與 out_canvas 相同的像素以透明略過；需要「清除」已繪製像素時無法以繪製表達，拋出 DecimationUnsupported。
+    allow_transparent 為 False 時相同的像素仍照原色寫出 (調色盤沒有空位給透明索引時使用)。
+    返回 (影像區塊位元組, 透明索引或 None)。
+    """
+    left, top, w, h = region
+    needed = []
+    need_transparent = False
+    width = true_canvas.width
+    for y in range(h):
+        start = (top + y) * width + left
+        target_row = true_canvas.pixels[start:start + w]
+        current_row = out_canvas.pixels[start:start + w]
+        row = []
+        for target, current in zip(target_row, current_row):
+            if target == current and (allow_transparent or target == TRANSPARENT_PIXEL):
+                row.append(None)
+                need_transparent = True
+            elif target == TRANSPARENT_PIXEL:
+                raise DecimationUnsupported("被丟棄的幀清除了畫面，無法以繪製重現。")
+            else:
+                row.append(target)
+        needed.append(row)
+
+    used_colors = {color for row in needed for color in row if color is not None}
+    palette_bytes = b''
+    color_to_index = None
+    transparent_index = None
+    if global_colors is not None:
+        lookup = {}
+        for i, color in enumerate(global_colors[:index.global_palette_size]):
+            lookup.setdefault(color, i)
+        if used_colors.issubset(lookup):
+            color_to_index = {color: lookup[color] for color in used_colors}
+            if need_transparent:
+                used_indices = set(color_to_index.values())
+                free = [i for i in range(index.global_palette_size) if i not in used_indices]
+                if free:
+                    transparent_index = free[0]
+                else:
+                    color_to_index = None
+    if color_to_index is None:
+        # 以實際用到的顏色建立無損的區域調色盤
+        colors = sorted(used_colors)
+        if len(colors) + (1 if need_transparent else 0) > 256:
+            raise DecimationUnsupported("重新合成的幀超過 256 色。")
+        color_to_index = {color: i for i, color in enumerate(colors)}
+        if need_transparent:
+            transparent_index = len(colors)
+        size_bits = max(1, (max(len(colors) + (1 if need_transparent else 0), 2) - 1).bit_length())
+        table = bytearray()
+        for color in colors:
+            table += bytes(((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF))
+        table += bytes(3 * ((1 << size_bits) - len(colors)))
+        palette_bytes = bytes(table)
+        descriptor_packed = 0x80 | (size_bits - 1)
+        min_code_size = max(2, size_bits)
+    else:
+        descriptor_packed = 0
+        min_code_size = max(2, (index.global_palette_size - 1).bit_length())
+
+    fill = transparent_index if transparent_index is not None else 0
+    pixels = bytearray()
+    for row in needed:
+        pixels += bytes(fill if color is None else color_to_index[color] for color in row)
+    descriptor = b'\x2C' + struct.pack('<HHHHB', left, top, w, h, descriptor_packed)
+    image = descriptor + palette_bytes + bytes((min_code_size,)) + _pack_sub_blocks(lzw_encode(bytes(pixels), min_code_size))
+    return image, transparent_index
+
+
+def decimate_gif(input_gif_path, output_gif_path, target_frame_count, cancel_token=None, progress_callback=None, frame_plan=None):
+    """
+    只減少幀數的原生處理：選出保留幀、合併延遲，並盡量直接複製 LZW 資料。
+    frame_plan 為 (保留幀索引, 每幀延遲) 時直接使用 (例如依內容差異選幀)，否則依累積延遲平均選幀。
+    progress_callback(已處理幀數, 總幀數) 約每 1% 呼叫一次。
+    返回統計字典 {"frames", "copied", "recomposited", "duration_cs"}；取消時刪除輸出並返回 None。
+    無法無損處理時拋出 DecimationUnsupported。
+    """
+    with GIFIndex(input_gif_path) as index:
+        frame_count = len(index.frames)
+        if frame_count == 0:
+            raise GIFFormatError("GIF 檔案中沒有任何幀。")
+        if frame_plan is not None:
+            kept, merged_delays = frame_plan
+        else:
+            kept, merged_delays = plan_kept_frames([frame["delay"] for frame in index.frames], min(target_frame_count, frame_count))
+        if len(kept) >= frame_count:
+            raise DecimationUnsupported("原生引擎只支援減少幀數。")
+        kept_delays = dict(zip(kept, merged_delays))
+        recomposite = _needs_recomposite_rects(index, set(kept))
+        if recomposite:
+            decoded_pixels = sum(frame["rect"][2] * frame["rect"][3] for frame in index.frames)
+            if decoded_pixels > NATIVE_RECOMPOSITE_MAX_PIXELS:
+                raise DecimationUnsupported("需要逐像素合成的資料量過大。")
+            if index.global_palette_offset is None and any(f["local_palette_offset"] is None for f in index.frames):
+                raise DecimationUnsupported("部分幀沒有調色盤。")
+
+        buf = index.buffer
+        header_end = 13 + 3 * index.global_palette_size
+        first_frame = index.frames[0]
+        first_start = first_frame["gce_offset"] if first_frame["gce_offset"] is not None else first_frame["descriptor_offset"]
+        preamble = bytes(buf[header_end:first_start])
+
+        stats = {"frames": len(kept), "copied": 0, "recomposited": 0, "duration_cs": sum(merged_delays)}
+        progress_step = max(1, frame_count // 100)
+        global_colors = _palette_colors(index.palette()) if index.global_palette_offset is not None else None
+        true_canvas = _Canvas(index.width, index.height) if recomposite else None
+        out_canvas = _Canvas(index.width, index.height) if recomposite else None
+
+        try:
+            with open(output_gif_path, 'wb') as output:
+                output.write(bytes(buf[:header_end]))
+                output.write(preamble)
+                if index.loop_count is not None and b'NETSCAPE2.0' not in preamble and b'ANIMEXTS1.0' not in preamble:
+                    output.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', index.loop_count) + b'\x00')
+
+                for number, frame in enumerate(index.frames):
+                    if cancel_token is not None and cancel_token.cancelled:
+                        output.close()
+                        remove_partial_output(output_gif_path)
+                        return None
+                    if progress_callback and (number % progress_step == 0):
+                        progress_callback(number, frame_count)
+
+                    is_kept = number in kept_delays
+                    gce_packed = buf[frame["gce_offset"] + 3] if frame["gce_offset"] is not None else 0
+                    image_block = bytes(buf[frame["descriptor_offset"]:frame["end_offset"]]) if is_kept else None
+                    transparent_index = frame["transparent_index"]
+
+                    if recomposite:
+                        clipped = _clip_rect(frame["rect"], index.width, index.height)
+                        saved_true = true_canvas.copy_region(clipped) if frame["disposal"] == 3 and clipped else None
+                        diff = out_canvas.diff_bounds(true_canvas) if is_kept else None
+                        palette = index.palette(number)
+                        colors = _palette_colors(palette) if palette is not None else [0] * 256
+                        min_code_size = buf[frame["lzw_offset"]]
+                        lzw_data, _ = _read_sub_blocks(buf, frame["lzw_offset"] + 1)
+                        indices = lzw_decode(lzw_data, min_code_size, frame["rect"][2] * frame["rect"][3])
+                        true_canvas.draw(frame, indices, colors)
+
+                        if is_kept:
+                            emitted_rect = clipped
+                            safe = diff is None or (
+                                frame["transparent_index"] is None and clipped is not None and _rect_contains(clipped, diff)
+                            )
+                            if not safe:
+                                region = _union_rect(diff, clipped)
+                                image_block, transparent_index = _encode_recomposited_frame(
+                                    index, true_canvas, out_canvas, region, global_colors
+                                )
+                                gce_packed = (gce_packed & 0x1E) | (0x01 if transparent_index is not None else 0)
+                                emitted_rect = region
+                                stats["recomposited"] += 1
+                            else:
+                                stats["copied"] += 1
+                            saved_out = out_canvas.copy_region(emitted_rect) if frame["disposal"] == 3 and emitted_rect else None
+                            out_canvas.pixels = list(true_canvas.pixels)
+                            if emitted_rect is not None:
+                                if frame["disposal"] == 2:
+                                    out_canvas.clear_region(emitted_rect)
+                                elif frame["disposal"] == 3:
+                                    out_canvas.paste_region(emitted_rect, saved_out)
+
+                        if clipped is not None:
+                            if frame["disposal"] == 2:
+                                true_canvas.clear_region(clipped)
+                            elif frame["disposal"] == 3:
+                                true_canvas.paste_region(clipped, saved_true)
+                    elif is_kept:
+                        stats["copied"] += 1
+
+                    if is_kept:
+                        output.write(_gce_bytes(gce_packed, kept_delays[number], transparent_index))
+                        output.write(image_block)
+
+                output.write(b'\x3B')
+        except BaseException:
+            remove_partial_output(output_gif_path)
+            raise
+
+        if progress_callback:
+            progress_callback(frame_count, frame_count)
+        return stats
+
+
+# --- 保留原始延遲的時間規劃 (FFmpeg 路徑) ---
+
+# 以 select 只保留規劃好的幀並以 passthrough 保留原始時間戳，不會像 fps 濾鏡那樣產生重複幀；
+# 編碼完成後再把規劃的延遲寫回每一幀的 GCE，讓總時長精確到百分之一秒。
+PASSTHROUGH_TIMING_ARGS = ('-fps_mode', 'passthrough')
+
+
+def select_frames_filter(kept_indices):
+    """
+    建立只保留指定幀的 select 濾鏡 (連續的幀合併為 between)。
+    """
+    terms = []
+    run_start = previous = None
+    for number in kept_indices:
+        if previous is not None and number == previous + 1:
+            previous = number
+            continue
+        if run_start is not None:
+            terms.append(f"eq(n,{run_start})" if run_start == previous else f"between(n,{run_start},{previous})")
+        run_start = previous = number
+    if run_start is not None:
+        terms.append(f"eq(n,{run_start})" if run_start == previous else f"between(n,{run_start},{previous})")
+    return f"select='{'+'.join(terms)}'"
+
+
+def rewrite_gif_delays(output_gif_path, delays_cs):
+    """
+    把每一幀的 GCE 延遲改寫為指定值 (原地修改)。
+    幀數不符或某幀缺少 GCE 時不修改並返回 False。
+    """
+    with GIFIndex(output_gif_path) as index:
+        if len(index.frames) != len(delays_cs) or any(frame["gce_offset"] is None for frame in index.frames):
+            return False
+        offsets = [frame["gce_offset"] + 4 for frame in index.frames]
+    with open(output_gif_path, 'r+b') as f:
+        for offset, delay in zip(offsets, delays_cs):
+            f.seek(offset)
+            f.write(struct.pack('<H', min(max(delay, 0), GCE_MAX_DELAY_CS)))
+    return True
+
+
+# --- 依內容差異選幀 (近似重複幀合併) ---
+
+# 螢幕錄影常有連續相同或只差幾個像素的幀；依相鄰合成畫面的差異比例，
+# 優先丟棄資訊量最少的幀 (延遲併入前一個保留幀)，而非平均抽幀。
+DIFF_PIXEL_TOLERANCE = 8 # 各色版差異都不超過此值的像素視為未變化 (忽略抖色雜訊)
+DIFF_BATCH_FRAMES = 32 # NumPy 一次比較的幀數
+# 分析成本以解碼的像素數計算。LZW 解碼無法向量化，480x270x100 (13M 像素) 實測：
+# 有 NumPy 時合成與比較幾乎不花時間，一般畫面約 1 秒、雜訊般難以壓縮的畫面約 11 秒 (幾乎都是 LZW 解碼)；
+# 純 Python 另需逐像素合成與比較，一般畫面約 2.5 秒、難以壓縮的畫面約 13 秒，因此上限較低。
+DIFF_PURE_PYTHON_MAX_PIXELS = 8 * 1024 * 1024
+
+
+def _numpy():
+    # NumPy 為選用依賴，未安裝時使用純 Python 比較
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def iter_composited_frames(index, cancel_token=None):
+    """
+    依序解碼並合成每一幀，產生 (幀編號, 畫布像素列表)。
+    畫布列表會在下一幀被覆寫，需要保存時請自行複製。
+    """
+    canvas = _Canvas(index.width, index.height)
+    buf = index.buffer
+    for number, frame in enumerate(index.frames):
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        clipped = _clip_rect(frame["rect"], index.width, index.height)
+        saved = canvas.copy_region(clipped) if frame["disposal"] == 3 and clipped else None
+        palette = index.palette(number)
+        colors = _palette_colors(palette) if palette is not None else [0] * 256
+        lzw_data, _ = _read_sub_blocks(buf, frame["lzw_offset"] + 1)
+        indices = lzw_decode(lzw_data, buf[frame["lzw_offset"]], frame["rect"][2] * frame["rect"][3])
+        canvas.draw(frame, indices, colors)
+        yield number, canvas.pixels
+        if clipped is not None:
+            if frame["disposal"] == 2:
+                canvas.clear_region(clipped)
+            elif frame["disposal"] == 3:
+                canvas.paste_region(clipped, saved)
+
+
+def _iter_composited_arrays(np, index, cancel_token=None):
+    """
+    與 iter_composited_frames 相同，但畫布為 NumPy 的 (高, 寬) int32 陣列：
+    每幀以調色盤查表 (索引 → 顏色) 並以遮罩一次寫入幀矩形，只有 LZW 解碼仍逐碼執行。
+    畫布陣列會在下一幀被覆寫，需要保存時請自行複製。
+    """
+    canvas = np.full((index.height, index.width), TRANSPARENT_PIXEL, dtype=np.int32)
+    buf = index.buffer
+    blank_colors = np.zeros(256, dtype=np.int32)
+    for number, frame in enumerate(index.frames):
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        clipped = _clip_rect(frame["rect"], index.width, index.height)
+        region = None
+        if clipped is not None:
+            left, top, visible_width, visible_height = clipped
+            region = canvas[top:top + visible_height, left:left + visible_width]
+        saved = region.copy() if frame["disposal"] == 3 and region is not None else None
+        palette = index.palette(number)
+        colors = np.array(_palette_colors(palette), dtype=np.int32) if palette is not None else blank_colors
+        frame_width, frame_height = frame["rect"][2], frame["rect"][3]
+        lzw_data, _ = _read_sub_blocks(buf, frame["lzw_offset"] + 1)
+        indices = lzw_decode(lzw_data, buf[frame["lzw_offset"]], frame_width * frame_height)
+        if region is not None:
+            rows = np.frombuffer(indices, dtype=np.uint8).reshape(frame_height, frame_width)
+            if frame["interlaced"]:
+                ordered = np.empty_like(rows)
+                ordered[_deinterlace_rows(frame_height)] = rows
+                rows = ordered
+            rows = rows[:visible_height, :visible_width]
+            if frame["transparent_index"] is None:
+                region[...] = colors[rows]
+            else:
+                mask = rows != frame["transparent_index"]
+                region[mask] = colors[rows[mask]]
+        yield number, canvas
+        if region is not None:
+            if frame["disposal"] == 2:
+                region[...] = TRANSPARENT_PIXEL
+            elif frame["disposal"] == 3:
+                region[...] = saved
+
+
+def _pixel_changed(a, b, tolerance):
+    if a == b:
+        return False
+    if tolerance <= 0 or a < 0 or b < 0:
+        return True
+    return (abs(((a >> 16) & 0xFF) - ((b >> 16) & 0xFF)) > tolerance
+            or abs(((a >> 8) & 0xFF) - ((b >> 8) & 0xFF)) > tolerance
+            or abs((a & 0xFF) - (b & 0xFF)) > tolerance)
+
+
+def _frame_difference(previous, current, tolerance):
+    # 純 Python：整列相同時由 C 層比較直接略過
+    if previous == current:
+        return 0.0
+    changed = sum(1 for a, b in zip(previous, current) if _pixel_changed(a, b, tolerance))
+    return changed / len(current)
+
+
+def _batch_differences_numpy(np, frames, tolerance):
+    # frames 為連續幀的陣列列表，一次向量化比較相鄰幀，返回後 len(frames) - 1 幀的差異比例
+    stack = np.stack(frames)
+    current = stack[1:]
+    previous = stack[:-1]
+    changed = current != previous
+    if tolerance > 0:
+        opaque = (current >= 0) & (previous >= 0)
+        channel_delta = np.maximum.reduce([
+            np.abs(((current >> shift) & 0xFF) - ((previous >> shift) & 0xFF)) for shift in (16, 8, 0)
+        ])
+        changed &= ~(opaque & (channel_delta <= tolerance))
+    return (changed.sum(axis=1) / stack.shape[1]).tolist()
+
+
+def frame_difference_scores(input_gif_path, tolerance=DIFF_PIXEL_TOLERANCE, cancel_token=None, progress_callback=None):
+    """
+    計算每一幀與前一幀合成畫面的差異比例 (0~1，第一幀為 1.0)。
+    有 NumPy 時以陣列合成 (調色盤查表與遮罩寫入) 並批次向量化比較，否則逐像素合成與比較。取消時返回 None。
+    解碼量超過上限 (有 NumPy 時為 NATIVE_RECOMPOSITE_MAX_PIXELS，否則為 DIFF_PURE_PYTHON_MAX_PIXELS) 時拋出 DecimationUnsupported。
+    """
+    np = _numpy()
+    max_pixels = NATIVE_RECOMPOSITE_MAX_PIXELS if np is not None else DIFF_PURE_PYTHON_MAX_PIXELS
+    with GIFIndex(input_gif_path) as index:
+        frame_count = len(index.frames)
+        if frame_count == 0:
+            raise GIFFormatError("GIF 檔案中沒有任何幀。")
+        if sum(frame["rect"][2] * frame["rect"][3] for frame in index.frames) > max_pixels:
+            raise DecimationUnsupported("需要逐像素合成的資料量過大" + ("。" if np is not None else " (安裝 NumPy 可提高上限)。"))
+        if index.global_palette_offset is None and any(f["local_palette_offset"] is None for f in index.frames):
+            raise DecimationUnsupported("部分幀沒有調色盤。")
+
+        scores = [1.0]
+        progress_step = max(1, frame_count // 100)
+        previous = None
+        batch = []
+        frames = _iter_composited_arrays(np, index, cancel_token) if np is not None else iter_composited_frames(index, cancel_token)
+        for number, pixels in frames:
+            if progress_callback and number % progress_step == 0:
+                progress_callback(number, frame_count)
+            if np is not None:
+                batch.append(pixels.ravel().copy())
+                if len(batch) > DIFF_BATCH_FRAMES:
+                    scores.extend(_batch_differences_numpy(np, batch, tolerance))
+                    batch = batch[-1:]
+            else:
+                if previous is not None:
+                    scores.append(_frame_difference(previous, pixels, tolerance))
+                previous = list(pixels)
+        if cancel_token is not None and cancel_token.cancelled:
+            return None
+        if np is not None and len(batch) > 1:
+            scores.extend(_batch_differences_numpy(np, batch, tolerance))
+    if progress_callback:
+        progress_callback(frame_count, frame_count)
+    return scores
+
+
+def plan_frames_by_difference(scores, frame_delays, target_frame_count, merge_threshold=None):
+    """
+    依差異比例選幀：反覆丟棄差異最小的幀並把延遲併入前一個保留幀，直到剩下 target_frame_count 幀；
+    提供 merge_threshold 時，差異不超過門檻的幀即使已達目標也會合併。
+    被丟棄幀的差異會累加到下一幀 (上界估計)，避免連續丟棄累積成明顯跳動。
+    返回 (保留幀索引列表, 每個保留幀的新延遲)，總時長不變。
+    """
+    delays = [effective_delay_cs(d) for d in frame_delays]
+    frame_count = len(delays)
+    current = list(scores)
+    previous_of = list(range(-1, frame_count - 1))
+    next_of = list(range(1, frame_count + 1))
+    removed = [False] * frame_count
+    heap = [(current[i], i) for i in range(1, frame_count)] # 第一幀一定保留
+    heapq.heapify(heap)
+    remaining = frame_count
+    while heap:
+        score, number = heapq.heappop(heap)
+        if removed[number] or score != current[number]:
+            continue
+        if remaining <= target_frame_count and (merge_threshold is None or score > merge_threshold):
+            break
+        removed[number] = True
+        remaining -= 1
+        keeper = previous_of[number]
+        delays[keeper] += delays[number]
+        following = next_of[number]
+        next_of[keeper] = following
+        if following < frame_count:
+            previous_of[following] = keeper
+            current[following] = min(1.0, current[following] + score)
+            heapq.heappush(heap, (current[following], following))
+    kept = [i for i in range(frame_count) if not removed[i]]
+    return kept, [delays[i] for i in kept]
+
+
+# --- 子矩形差異重新編碼 (輸出最佳化) ---
+
+# paletteuse 的輸出逐幀重新量化；對大部分靜止的畫面 (例如介面錄影)，
+# 只寫出與前一畫面不同的外接矩形，矩形內未變化的像素以透明略過，可減少輸出大小。
+# FFmpeg 的 GIF 編碼器以 -gifflags +offsetting+transdiff 在編碼時做同樣的事 (見 FFmpegCapabilities.gif_diff_args)；
+# 這裡的純 Python 重新編碼 (約每秒 1M 像素) 只是在 FFmpeg 輸出後再多擠出一些大小，是以時間換取大小，
+# 因此只處理 OPTIMIZE_MAX_PIXELS 以下的小型輸出 (約 1 秒)，更大的輸出只使用編碼器內的差異矩形。
+OPTIMIZE_TEMP_SUFFIX = '.optimize.tmp'
+OPTIMIZE_MAX_PIXELS = 1024 * 1024 # 寬 x 高 x 幀數上限
+
+
+def _cleared_bounds(previous, current, width):
+    """
+    返回 current 中變為透明、但 previous 不透明的像素外接矩形，沒有時返回 None。
+    繪製無法把像素變回透明，前一幀需以「還原為背景」清除這個區域。
+    """
+    if TRANSPARENT_PIXEL not in current:
+        return None
+    bounds = None
+    for y in range(len(current) // width):
+        start = y * width
+        row = current[start:start + width]
+        if TRANSPARENT_PIXEL not in row:
+            continue
+        old = previous[start:start + width]
+        columns = [x for x in range(width) if row[x] == TRANSPARENT_PIXEL and old[x] != TRANSPARENT_PIXEL]
+        if columns:
+            bounds = _union_rect(bounds, (columns[0], y, columns[-1] - columns[0] + 1, 1))
+    return bounds
+
+
+def _encode_diff_frame(index, target, displayed, region, global_colors):
+    # 256 色全部用到、沒有空位給透明索引時，改為照原色寫出整個矩形
+    try:
+        return _encode_recomposited_frame(index, target, displayed, region, global_colors)
+    except DecimationUnsupported:
+        return _encode_recomposited_frame(index, target, displayed, region, global_colors, allow_transparent=False)
+
+
+def optimize_gif_frames(gif_path, cancel_token=None, progress_callback=None):
+    """
+    以子矩形差異重新編碼 GIF (原地取代)：每幀只寫出與目前顯示畫面不同的外接矩形，
+    未變化的像素設為透明；下一幀需要變回透明的區域時，前一幀改用「還原為背景」處置。
+    只有結果較小時才取代原檔。progress_callback(已處理幀數, 總幀數) 約每 1% 呼叫一次。
+    這一步只增加處理時間 (換取較小的檔案)，超過 OPTIMIZE_MAX_PIXELS 時不處理。
+    返回統計字典 {"frames", "original_size", "optimized_size", "applied"}；取消時返回 None。
+    無法逐像素處理 (超過 OPTIMIZE_MAX_PIXELS、缺少調色盤或超過 256 色) 時拋出 DecimationUnsupported。
+    """
+    temp_path = gif_path + OPTIMIZE_TEMP_SUFFIX
+    original_size = os.path.getsize(gif_path)
+    try:
+        with GIFIndex(gif_path) as index:
+            frame_count = len(index.frames)
+            if frame_count == 0:
+                raise GIFFormatError("GIF 檔案中沒有任何幀。")
+            if index.width * index.height * frame_count > OPTIMIZE_MAX_PIXELS:
+                raise DecimationUnsupported("輸出超過差異矩形重新編碼的像素上限，只使用 FFmpeg 編碼器的差異矩形。")
+            if index.global_palette_offset is None and any(f["local_palette_offset"] is None for f in index.frames):
+                raise DecimationUnsupported("部分幀沒有調色盤。")
+
+            buf = index.buffer
+            header_end = 13 + 3 * index.global_palette_size
+            first_frame = index.frames[0]
+            first_start = first_frame["gce_offset"] if first_frame["gce_offset"] is not None else first_frame["descriptor_offset"]
+            global_colors = _palette_colors(index.palette()) if index.global_palette_offset is not None else None
+            progress_step = max(1, frame_count // 100)
+            width = index.width
+
+            target = _Canvas(index.width, index.height)
+            displayed = _Canvas(index.width, index.height) # 依輸出檔播放時，繪製下一幀前的畫面
+            pending = None # 等待決定處置方式的上一幀: (幀編號, 矩形, 影像區塊, 透明索引, 合成畫面, 繪製前畫面)
+
+            with open(temp_path, 'wb') as output:
+                output.write(b'GIF89a' + bytes(buf[6:first_start])) # GCE 的處置方式與透明需要 89a
+
+                def write_pending(next_pixels):
+                    number, region, image_block, transparent_index, pending_target, pending_displayed = pending
+                    disposal = 1
+                    cleared = _cleared_bounds(pending_target, next_pixels, width) if next_pixels is not None else None
+                    if cleared is not None:
+                        # 擴大上一幀的矩形以涵蓋需要清除的區域，並在顯示後還原為背景
+                        region = _union_rect(region, cleared)
+                        target.pixels, displayed.pixels = pending_target, pending_displayed
+                        image_block, transparent_index = _encode_diff_frame(index, target, displayed, region, global_colors)
+                        disposal = 2
+                    packed = (disposal << 2) | (0x01 if transparent_index is not None else 0)
+                    output.write(_gce_bytes(packed, index.frames[number]["delay"], transparent_index))
+                    output.write(image_block)
+                    displayed.pixels = list(pending_target)
+                    if disposal == 2:
+                        displayed.clear_region(region)
+
+                for number, pixels in iter_composited_frames(index, cancel_token):
+                    if progress_callback and number % progress_step == 0:
+                        progress_callback(number, frame_count)
+                    if pending is not None:
+                        write_pending(pixels)
+                    target.pixels = pixels
+                    # 與目前畫面完全相同的幀仍需保留 (維持延遲)，以 1x1 的透明像素表示
+                    region = displayed.diff_bounds(target) or (0, 0, 1, 1)
+                    image_block, transparent_index = _encode_diff_frame(index, target, displayed, region, global_colors)
+                    pending = (number, region, image_block, transparent_index, list(pixels), list(displayed.pixels))
+
+                if cancel_token is not None and cancel_token.cancelled:
+                    output.close()
+                    remove_partial_output(temp_path)
+                    return None
+                write_pending(None)
+                output.write(b'\x3B')
+    except BaseException:
+        remove_partial_output(temp_path)
+        raise
+
+    optimized_size = os.path.getsize(temp_path)
+    applied = optimized_size < original_size
+    if applied:
+        os.replace(temp_path, gif_path)
+    else:
+        remove_partial_output(temp_path)
+    if progress_callback:
+        progress_callback(frame_count, frame_count)
+    return {"frames": frame_count, "original_size": original_size, "optimized_size": optimized_size, "applied": applied}
+
+
+# --- 目標檔案大小模式 ---
+
+# 先以少量分散的取樣幀估計每幀位元組數，再以實際完整編碼的結果修正估計，
+# 在 (幀數, 調色盤色數, 縮放) 之間搜尋不超過大小上限的最高品質組合，盡量減少完整編碼次數。
+SIZE_SAMPLE_FRAMES = 8 # 取樣編碼的幀數
+SIZE_MAX_FULL_ENCODES = 6 # 完整編碼次數上限
+SIZE_SAFETY_MARGIN = 0.97 # 依估計選擇幀數時預留的空間
+SIZE_FRAME_TOLERANCE = 0.02 # 可行與不可行幀數的差距小於此比例時停止搜尋
+SIZE_MIN_FRAMES = 2
+SIZE_QUALITY_LADDER = ( # (縮放比例, 調色盤色數)，依品質由高到低
+    (1.0, 256), (1.0, 128), (1.0, 64), (0.75, 128), (0.75, 64), (0.5, 64), (0.5, 32),
+)
+
+
+def sample_frame_indices(frame_count, sample_count=SIZE_SAMPLE_FRAMES):
+    # 平均分散在整段動畫中的取樣幀
+    sample_count = max(1, min(sample_count, frame_count))
+    if sample_count == 1:
+        return [0]
+    return sorted({round(i * (frame_count - 1) / (sample_count - 1)) for i in range(sample_count)})
+
+
+def build_size_attempt_command(ffmpeg_path, input_gif_path, output_gif_path, kept_indices, scale=1.0, max_colors=256, optimize=False):
+    """
+    以 select 選出指定幀、可選縮放與調色盤色數的單階段編碼命令 (保留時間戳)。
+    optimize 為 True 時讓 GIF 編碼器只寫出差異矩形。
+    """
+    frame_filter = select_frames_filter(kept_indices)
+    if scale < 1.0:
+        frame_filter += f",scale=iw*{scale:g}:-1:flags=lanczos"
+    palettegen_options = f"max_colors={max_colors}" if max_colors < 256 else DEFAULT_PALETTEGEN_OPTIONS
+    capabilities = get_ffmpeg_capabilities(ffmpeg_path)
+    return [
+        ffmpeg_path, '-nostdin', '-y', '-nostats',
+        '-i', input_gif_path,
+        '-vf', single_pass_filter(
+            frame_filter, capabilities.filter_options('palettegen', palettegen_options),
+            capabilities.filter_options('paletteuse', DEFAULT_PALETTEUSE_OPTIONS)
+        ),
+        *capabilities.timing_args(),
+        *(capabilities.gif_diff_args() if optimize else ()),
+        output_gif_path
+    ]
+
+
+def _format_bytes(size):
+    return f"{size / (1024 * 1024):.2f} MiB" if size >= 1024 * 1024 else f"{size / 1024:.1f} KiB"
+
+
+def format_size_attempt(attempt):
+    """
+    將一次取樣或完整編碼的紀錄格式化為單行訊息。
+    """
+    quality = f"{attempt['scale'] * 100:.0f}%, {attempt['colors']} 色"
+    if attempt["kind"] == "sample":
+        return (f"取樣 {attempt['frames']} 幀 ({quality}): {_format_bytes(attempt['size'])}，"
+                f"估計每幀 {_format_bytes(attempt['size'] / attempt['frames'])}")
+    status = "符合" if attempt["fits"] else "超過"
+    return (f"完整編碼 {attempt['frames']} 幀 ({quality}): {_format_bytes(attempt['size'])} {status}上限"
+            f" (估計 {_format_bytes(attempt['predicted'])})")
+
+
+def _encode_size_attempt(ffmpeg_path, input_gif_path, output_path, kept_indices, scale, colors, cancel_token, memory_limit, optimize=False):
+    # 返回 (輸出位元組數或 None, stderr)；取消時大小為 None
+    command = build_size_attempt_command(ffmpeg_path, input_gif_path, output_path, kept_indices, scale, colors, optimize)
+    return_code, _, stderr = run_cancellable(command, cancel_token, memory_limit)
+    if return_code != 0 or (cancel_token is not None and cancel_token.cancelled) or not os.path.exists(output_path):
+        remove_partial_output(output_path)
+        return None, stderr
+    return os.path.getsize(output_path), stderr
+
+
+def encode_to_size(ffmpeg_path, input_gif_path, output_gif_path, max_bytes, frame_delays, max_frames,
+                   min_frames=SIZE_MIN_FRAMES, allow_scale=True, optimize=False, cancel_token=None,
+                   attempt_callback=None, memory_limit=None):
+    """
+    目標檔案大小模式：在不超過 max_bytes 的前提下，依 SIZE_QUALITY_LADDER 由高到低的品質，
+    找出最多 (不超過 max_frames) 的幀數。每個品質等級先做取樣編碼估計每幀大小，
+    再以完整編碼的實際大小修正估計並二分搜尋幀數；取樣幀彼此相隔較遠，估計通常偏大 (保守)。
+    每次編碼的紀錄 (見 format_size_attempt) 會傳給 attempt_callback。
+    frame_delays 為原始每幀延遲，保留幀的延遲依 plan_kept_frames 合併後寫回輸出。
+    optimize 為 True 時編碼器只寫出差異矩形，小型輸出在完整編碼後再做子矩形差異重新編碼 (見 optimize_gif_frames) 才量測大小。
+    返回 {"success", "frames", "scale", "colors", "size", "attempts", "message"}；取消時刪除暫存檔並返回 None。
+    """
+    frame_count = len(frame_delays)
+    max_frames = max(1, min(max_frames, frame_count))
+    min_frames = max(1, min(min_frames, max_frames))
+    ladder = [level for level in SIZE_QUALITY_LADDER if allow_scale or level[0] >= 1.0]
+    result = {"success": False, "frames": None, "scale": None, "colors": None, "size": None, "attempts": [], "message": ""}
+    temp_paths = []
+    best = None # (幀數, 縮放, 色數, 大小, 暫存路徑)
+    full_encodes = 0
+
+    def record(kind, frames, scale, colors, size, predicted=None):
+        attempt = {"kind": kind, "frames": frames, "scale": scale, "colors": colors, "size": size,
+                   "predicted": predicted, "fits": size <= max_bytes}
+        result["attempts"].append(attempt)
+        if attempt_callback:
+            attempt_callback(attempt)
+
+    def encode(kept, scale, colors, path):
+        temp_paths.append(path)
+        size, stderr = _encode_size_attempt(ffmpeg_path, input_gif_path, path, kept, scale, colors, cancel_token, memory_limit, optimize)
+        if size is None and not (cancel_token is not None and cancel_token.cancelled):
+            last_line = stderr.strip().splitlines()[-1] if stderr.strip() else ""
+            result["message"] = f"FFmpeg 編碼失敗: {last_line}"
+        return size
+
+    try:
+        for scale, colors in ladder:
+            sample = sample_frame_indices(frame_count, min(SIZE_SAMPLE_FRAMES, max_frames))
+            size = encode(sample, scale, colors, output_gif_path + '.sample.tmp')
+            if size is None:
+                return None if cancel_token is not None and cancel_token.cancelled else result
+            record("sample", len(sample), scale, colors, size)
+            bytes_per_frame = size / len(sample)
+
+            fit_frames, fail_frames = 0, max_frames + 1
+            guess = min(max_frames, int(max_bytes * SIZE_SAFETY_MARGIN / bytes_per_frame))
+            while min_frames <= guess < fail_frames and guess > fit_frames and full_encodes < SIZE_MAX_FULL_ENCODES:
+                kept, delays = plan_kept_frames(frame_delays, guess)
+                path = f"{output_gif_path}.attempt{full_encodes}.tmp"
+                size = encode(kept, scale, colors, path)
+                full_encodes += 1
+                if size is None:
+                    return None if cancel_token is not None and cancel_token.cancelled else result
+                rewrite_gif_delays(path, delays)
+                if optimize:
+                    try:
+                        stats = optimize_gif_frames(path, cancel_token=cancel_token)
+                        if stats is None:
+                            return None
+                        size = os.path.getsize(path)
+                    except (DecimationUnsupported, GIFFormatError):
+                        pass
+                record("full", guess, scale, colors, size, predicted=int(bytes_per_frame * guess))
+                if size <= max_bytes:
+                    if best is not None:
+                        remove_partial_output(best[4])
+                    best = (guess, scale, colors, size, path)
+                    fit_frames = guess
+                else:
+                    remove_partial_output(path)
+                    fail_frames = guess
+                if fail_frames - fit_frames <= max(1, int(fit_frames * SIZE_FRAME_TOLERANCE)):
+                    break
+                # 以實際每幀大小修正估計，並限制在目前的可行/不可行範圍內 (二分搜尋的安全區間)
+                bytes_per_frame = size / guess
+                estimate = int(max_bytes * SIZE_SAFETY_MARGIN / bytes_per_frame)
+                if size <= max_bytes and (size >= max_bytes * SIZE_SAFETY_MARGIN
+                                          or estimate - fit_frames <= max(0, int(fit_frames * SIZE_FRAME_TOLERANCE))):
+                    break # 已接近上限，或再增加的幀數不值得再編碼一次
+                guess = min(max(estimate, fit_frames + 1, min_frames), fail_frames - 1)
+            if best is not None or full_encodes >= SIZE_MAX_FULL_ENCODES:
+                break
+
+        if best is None:
+            result["message"] = result["message"] or "在最低品質與最少幀數下仍無法符合大小上限。"
+            return result
+        os.replace(best[4], output_gif_path)
+        result.update(success=True, frames=best[0], scale=best[1], colors=best[2], size=best[3])
+        return result
+    except MemoryLimitExceeded as e:
+        result["message"] = str(e)
+        return result
+    finally:
+        for path in temp_paths:
+            if path != output_gif_path:
+                remove_partial_output(path)
+
+
+# --- 快速預覽 ---
+
+# 以與正式處理相同的選幀規劃，只編碼開頭一小段並縮小尺寸，讓使用者在排入完整工作前確認效果。
+PREVIEW_MAX_WIDTH = 320
+PREVIEW_MAX_SECONDS = 3.0
+PREVIEW_MAX_FRAMES = 30
+
+
+def plan_preview_frames(frame_delays, target_frame_count, max_seconds=PREVIEW_MAX_SECONDS, max_frames=PREVIEW_MAX_FRAMES):
+    """
+    依 plan_kept_frames 選出保留幀後，只取輸出開頭 max_seconds 秒內的部分；
+    超過 max_frames 幀時每隔 N 個保留幀取一幀並合併延遲。返回 (保留幀索引, 每幀延遲)。
+    """
+    kept, delays = plan_kept_frames(frame_delays, target_frame_count)
+    limit_cs = max_seconds * 100
+    elapsed = 0
+    count = 0
+    for delay in delays:
+        if count and elapsed >= limit_cs:
+            break
+        elapsed += delay
+        count += 1
+    kept, delays = kept[:count], delays[:count]
+    step = -(-len(kept) // max_frames)
+    if step > 1:
+        delays = [sum(delays[i:i + step]) for i in range(0, len(delays), step)]
+        kept = kept[::step]
+    return kept, delays
+
+
+def build_preview_command(ffmpeg_path, input_gif_path, output_gif_path, kept_indices, max_width=PREVIEW_MAX_WIDTH):
+    frame_filter = f"{select_frames_filter(kept_indices)},scale='min(iw,{max_width})':-1:flags=bilinear"
+    capabilities = get_ffmpeg_capabilities(ffmpeg_path)
+    return [
+        ffmpeg_path, '-nostdin', '-y', '-nostats',
+        '-i', input_gif_path,
+        '-vf', single_pass_filter(frame_filter, paletteuse_options=capabilities.filter_options('paletteuse', DEFAULT_PALETTEUSE_OPTIONS)),
+        *capabilities.timing_args(),
+        output_gif_path
+    ]
+
+
+def render_preview(ffmpeg_path, input_gif_path, output_gif_path, frame_delays, target_frame_count, cancel_token=None):
+    """
+    編碼縮小、限時的預覽 GIF。返回 (是否成功, 訊息)；取消時刪除輸出。
+    """
+    kept, delays = plan_preview_frames(frame_delays, min(target_frame_count, len(frame_delays)))
+    started = time.monotonic()
+    return_code, _, stderr = run_cancellable(
+        build_preview_command(ffmpeg_path, input_gif_path, output_gif_path, kept), cancel_token
+    )
+    if cancel_token is not None and cancel_token.cancelled:
+        remove_partial_output(output_gif_path)
+        return False, "已取消"
+    if return_code != 0:
+        remove_partial_output(output_gif_path)
+        last_line = stderr.strip().splitlines()[-1] if stderr.strip() else ""
+        return False, f"預覽編碼失敗: {last_line}"
+    rewrite_gif_delays(output_gif_path, delays)
+    return True, f"預覽 {len(kept)} 幀 ({sum(delays) / 100:.2f} 秒)，耗時 {time.monotonic() - started:.2f} 秒。"
+
+
+# --- 可續傳的分段下載 (安裝相依工具) ---
+
+# 下載中的資料寫入 <檔名>.part，進度寫入 <檔名>.part.json；中斷後再次執行會依 HTTP Range 從斷點繼續。
+# 伺服器支援 Range 且檔案夠大時分成數段並行下載，完成後才改名為正式檔名。
+DOWNLOAD_PART_SUFFIX = '.part'
+DOWNLOAD_STATE_SUFFIX = '.part.json'
+DOWNLOAD_SEGMENTS = 4 # 並行下載的最多分段數
+DOWNLOAD_MIN_SEGMENT_BYTES = 8 * 1024 * 1024 # 每段至少的大小，較小的檔案以單一連線下載
+DOWNLOAD_CHUNK_MIN = 64 * 1024
+DOWNLOAD_CHUNK_MAX = 4 * 1024 * 1024
+DOWNLOAD_CHUNK_TARGET_SECONDS = 0.25 # 依實際速度調整區塊大小，讓每次讀取約花費此時間
+DOWNLOAD_RETRIES = 5 # 每段連續失敗的重試次數 (從目前位置繼續)
+DOWNLOAD_TIMEOUT = (10, 30) # (連線, 讀取) 逾時秒數
+DOWNLOAD_PROGRESS_INTERVAL = 0.1 # 進度回調與進度檔儲存的最短間隔 (秒)
+
+
+class _RangeNotSupported(Exception):
+    # 伺服器未以 206 回應 Range 請求 (不支援或檔案已變更)，需從頭以單一連線下載
+    pass
+
+
+def _adapt_chunk_size(chunk_size, seconds):
+    if seconds < DOWNLOAD_CHUNK_TARGET_SECONDS / 2:
+        return min(chunk_size * 2, DOWNLOAD_CHUNK_MAX)
+    if seconds > DOWNLOAD_CHUNK_TARGET_SECONDS * 2:
+        return max(chunk_size // 2, DOWNLOAD_CHUNK_MIN)
+    return chunk_size
+
+
+def plan_download_segments(size, segments=DOWNLOAD_SEGMENTS, min_segment_bytes=DOWNLOAD_MIN_SEGMENT_BYTES):
+    """
+    把 size 位元組切成最多 segments 段，每段為 [起點, 終點 (含), 已下載位元組數]。
+    """
+    count = max(1, min(segments, size // max(1, min_segment_bytes)))
+    bounds = [size * i // count for i in range(count + 1)]
+    return [[bounds[i], bounds[i + 1] - 1, 0] for i in range(count) if bounds[i + 1] > bounds[i]]
+
+
+def sha256_file(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fetch_sha256(checksum_url):
+    """
+    下載 .sha256 校驗檔並取出第一個 64 位十六進位雜湊值，無法取得時返回 None。
+    """
+    import requests
+    try:
+        r = requests.get(checksum_url, timeout=DOWNLOAD_TIMEOUT)
+        r.raise_for_status()
+    except requests.exceptions.RequestException:
+        return None
+    for token in r.text.split():
+        token = token.strip().lower()
+        if len(token) == 64 and all(c in '0123456789abcdef' for c in token):
+            return token
+    return None
+
+
+class _SegmentAbort:
+    # 分段共用的停止旗標：使用者取消，或任一分段失敗 (例如不支援 Range) 時，其他分段不再繼續下載
+    def __init__(self, cancel_token):
+        self.cancel_token = cancel_token
+        self.failed = False
+
+    @property
+    def cancelled(self):
+        return self.failed or (self.cancel_token is not None and self.cancel_token.cancelled)
+
+
+class _DownloadProgress:
+    # 各分段執行緒共用的進度：節流呼叫回調，並定期把分段進度寫入 .part.json
+    def __init__(self, state, state_path, progress_callback):
+        self.state = state
+        self.state_path = state_path
+        self.progress_callback = progress_callback
+        self.lock = threading.Lock()
+        self.downloaded = sum(segment[2] for segment in state["segments"])
+        self._last_report = 0.0
+
+    def add(self, segment, count):
+        with self.lock:
+            segment[2] += count
+            self.downloaded += count
+            now = time.monotonic()
+            if now - self._last_report >= DOWNLOAD_PROGRESS_INTERVAL:
+                self._last_report = now
+                self._save()
+                if self.progress_callback:
+                    self.progress_callback(self.downloaded, self.state["size"])
+
+    def finish(self):
+        with self.lock:
+            self._save()
+            if self.progress_callback:
+                self.progress_callback(self.downloaded, self.state["size"])
+
+    def _save(self):
+        if self.state_path is None:
+            return
+        try:
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f)
+        except OSError:
+            pass # 進度檔只影響續傳
+
+
+def _load_download_state(state_path, part_path, url, size, validator):
+    # 進度檔與 .part 都與伺服器目前的檔案一致時才續傳
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if (state.get("url") == url and state.get("size") == size and state.get("validator") == validator
+                and os.path.getsize(part_path) == size):
+            return state
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _probe_download(url):
+    # 返回 (大小或 None, 是否支援 Range, ETag/Last-Modified)
+    import requests
+    try:
+        r = requests.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return None, False, None
+    if r.status_code >= 400:
+        return None, False, None
+    size = r.headers.get('Content-Length')
+    size = int(size) if size and size.isdigit() and 'Content-Encoding' not in r.headers else None
+    ranges = r.headers.get('Accept-Ranges', '').lower() == 'bytes' and size is not None and size > 0
+    return size, ranges, r.headers.get('ETag') or r.headers.get('Last-Modified')
+
+
+def _download_errors():
+    # 直接讀取 r.raw 時 urllib3 的例外不會被包裝成 requests 的例外
+    import requests
+    import urllib3
+    return requests.exceptions.RequestException, urllib3.exceptions.HTTPError
+
+
+def _should_retry(error, failures):
+    # 4xx 回應 (例如 404) 重試也不會成功
+    response = getattr(error, 'response', None)
+    if response is not None and 400 <= response.status_code < 500:
+        return False
+    return failures <= DOWNLOAD_RETRIES
+
+
+def _download_segment(url, part_path, segment, validator, progress, cancel_token):
+    import requests
+    failures = 0
+    while segment[0] + segment[2] <= segment[1]:
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        offset = segment[0] + segment[2]
+        headers = {'Range': f'bytes={offset}-{segment[1]}', 'Accept-Encoding': 'identity'}
+        if validator:
+            headers['If-Range'] = validator
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise _RangeNotSupported()
+                with open(part_path, 'r+b') as f:
+                    f.seek(offset)
+                    chunk_size = DOWNLOAD_CHUNK_MIN
+                    while segment[0] + segment[2] <= segment[1]:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            return
+                        started = time.monotonic()
+                        remaining = segment[1] - (segment[0] + segment[2]) + 1
+                        chunk = r.raw.read(min(chunk_size, remaining))
+                        if not chunk:
+                            break # 連線提早結束，下一輪從目前位置繼續
+                        f.write(chunk)
+                        f.flush() # 先寫入再記錄進度，進度檔永遠不超前實際資料
+                        progress.add(segment, len(chunk))
+                        chunk_size = _adapt_chunk_size(chunk_size, time.monotonic() - started)
+                        failures = 0
+        except _download_errors() as e:
+            failures += 1
+            if not _should_retry(e, failures):
+                raise
+            time.sleep(min(2 ** failures, 10))
+
+
+def _download_whole(url, part_path, progress, cancel_token):
+    # 伺服器不支援 Range 時的單一連線下載，失敗時只能從頭重試
+    import requests
+    state = progress.state
+    failures = 0
+    while True:
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        state["segments"][0][2] = 0
+        progress.downloaded = 0
+        try:
+            with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                length = r.headers.get('Content-Length')
+                state["size"] = int(length) if length and length.isdigit() and 'Content-Encoding' not in r.headers else None
+                with open(part_path, 'wb') as f:
+                    chunk_size = DOWNLOAD_CHUNK_MIN
+                    while True:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            return
+                        started = time.monotonic()
+                        chunk = r.raw.read(chunk_size, decode_content=True)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        progress.add(state["segments"][0], len(chunk))
+                        chunk_size = _adapt_chunk_size(chunk_size, time.monotonic() - started)
+            if state["size"] is None or progress.downloaded == state["size"]:
+                return
+            raise requests.exceptions.ConnectionError(f"連線提早結束 ({progress.downloaded}/{state['size']} 位元組)")
+        except _download_errors() as e:
+            failures += 1
+            if not _should_retry(e, failures):
+                raise
+            time.sleep(min(2 ** failures, 10))
+
+
+def download_file(url, local_filename, progress_callback=None, expected_sha256=None, checksum_url=None,
+                  segments=DOWNLOAD_SEGMENTS, cancel_token=None):
+    """
+    下載 url 到 local_filename，返回 (是否成功, 訊息)。
+    支援 Range 時從 .part 的斷點續傳，檔案夠大時分段並行下載；區塊大小依速度在 64 KiB 到 4 MiB 間調整。
+    progress_callback(已下載位元組, 總位元組或 None) 最多每 DOWNLOAD_PROGRESS_INTERVAL 秒呼叫一次 (可能來自不同執行緒)。
+    提供 expected_sha256 或 checksum_url (.sha256 檔) 時驗證雜湊值，不符時刪除下載的資料。
+    支援 Range 時取消或失敗會保留 .part 與進度檔，下次可繼續；不支援時無法續傳，取消會刪除 .part。
+    """
+    part_path = local_filename + DOWNLOAD_PART_SUFFIX
+    state_path = local_filename + DOWNLOAD_STATE_SUFFIX
+    os.makedirs(os.path.dirname(local_filename) or '.', exist_ok=True)
+    try:
+        if expected_sha256 is None and checksum_url:
+            expected_sha256 = fetch_sha256(checksum_url)
+        size, ranges, validator = _probe_download(url)
+        resumed = 0
+        if ranges:
+            state = _load_download_state(state_path, part_path, url, size, validator)
+            if state is not None:
+                resumed = sum(segment[2] for segment in state["segments"])
+            else:
+                state = {"url": url, "size": size, "validator": validator, "segments": plan_download_segments(size, segments)}
+                with open(part_path, 'wb') as f:
+                    f.truncate(size) # 預先配置，各分段直接寫入自己的位置
+            progress = _DownloadProgress(state, state_path, progress_callback)
+            try:
+                pending = [segment for segment in state["segments"] if segment[0] + segment[2] <= segment[1]]
+                if len(pending) > 1:
+                    abort = _SegmentAbort(cancel_token)
+                    with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                        futures = [executor.submit(_download_segment, url, part_path, segment, validator, progress, abort)
+                                   for segment in pending]
+                        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                        errors = [future.exception() for future in done if future.exception() is not None]
+                        if errors:
+                            abort.failed = True # 其他分段在下一個區塊前停止，不必等它們下載完
+                    if errors:
+                        raise errors[0]
+                elif pending:
+                    _download_segment(url, part_path, pending[0], validator, progress, cancel_token)
+            except _RangeNotSupported:
+                ranges = False
+                resumed = 0
+        if not ranges:
+            remove_partial_output(state_path)
+            state = {"url": url, "size": size, "validator": validator, "segments": [[0, -1, 0]]}
+            progress = _DownloadProgress(state, None, progress_callback)
+            _download_whole(url, part_path, progress, cancel_token)
+        if cancel_token is not None and cancel_token.cancelled:
+            progress.finish()
+            if ranges:
+                return False, "已取消 (下次會從中斷處繼續)"
+            remove_partial_output(part_path) # 伺服器不支援 Range，下次只能從頭下載
+            return False, "已取消 (伺服器不支援續傳，已刪除未完成的檔案)"
+        progress.finish()
+
+        if expected_sha256:
+            actual = sha256_file(part_path)
+            if actual != expected_sha256.lower():
+                remove_partial_output(part_path)
+                remove_partial_output(state_path)
+                return False, f"SHA-256 驗證失敗 (預期 {expected_sha256}，實際 {actual})，已刪除下載的檔案"
+        os.replace(part_path, local_filename)
+        remove_partial_output(state_path)
+        notes = []
+        if resumed:
+            notes.append(f"從 {_format_bytes(resumed)} 處續傳")
+        if ranges and len(state["segments"]) > 1:
+            notes.append(f"{len(state['segments'])} 段並行")
+        notes.append("SHA-256 已驗證" if expected_sha256 else "未驗證 SHA-256")
+        return True, f"已下載 {_format_bytes(os.path.getsize(local_filename))} ({'，'.join(notes)})"
+    except _download_errors() as e:
+        return False, f"下載失敗：{e}"
+    except OSError as e:
+        return False, f"下載時發生檔案錯誤：{e}"
+
+
+# --- 相依工具安裝清單 (driver/manifest.json) ---
+
+# 安裝成功後記錄每個工具的路徑、大小、修改時間、SHA-256 與版本 (FFmpeg 的能力探測結果也存於同一清單)；
+# 啟動時只讀取清單並對每個工具呼叫一次 os.stat (不計算雜湊、不連線、不掃描 driver 資料夾)，
+# 完整的雜湊驗證在背景執行，雜湊不符的工具會被標記，下次啟動時重新安裝。
+INSTALL_MANIFEST_PATH = os.path.join('.', 'driver', 'manifest.json')
+INSTALL_MANIFEST_VERSION = 1
+INSTALL_REVERIFY_SECONDS = 24 * 60 * 60 # 背景重新計算雜湊的最短間隔
+TOOL_VERSION_ARGS = {"7za": ()} # 7za 不接受 -version，不帶參數執行時第一行即為版本
+_manifest_lock = threading.Lock()
+
+
+def _run_tool(command, timeout=10):
+    # 執行小型查詢命令並返回 stdout，失敗時返回 None；Windows 上不彈出主控台視窗
+    try:
+        result = subprocess.run(
+            command, stdin=subprocess.DEVNULL, capture_output=True, text=True, encoding='utf-8', errors='replace',
+            timeout=timeout, creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout
+
+
+def probe_tool_version(tool_path, version_args=('-version',)):
+    """
+    返回工具版本資訊的第一行 (例如 "ffmpeg version 7.1-full_build-www.gyan.dev ...")，無法執行時返回 None。
+    """
+    output = _run_tool([tool_path, *version_args])
+    lines = [line.strip() for line in (output or "").splitlines() if line.strip()]
+    return lines[0] if lines else None
+
+
+def load_install_manifest(manifest_path=INSTALL_MANIFEST_PATH):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") == INSTALL_MANIFEST_VERSION and isinstance(manifest.get("tools"), dict):
+            return manifest
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {"version": INSTALL_MANIFEST_VERSION, "tools": {}}
+
+
+def _save_install_manifest(manifest, manifest_path):
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    temp_path = f"{manifest_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def describe_tool(name, tool_path):
+    """
+    計算單一工具的清單項目：路徑、大小、修改時間、SHA-256 與版本。
+    """
+    stat = os.stat(tool_path)
+    return {
+        "path": tool_path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256_file(tool_path),
+        "version": probe_tool_version(tool_path, TOOL_VERSION_ARGS.get(name, ('-version',))),
+        "verified_at": round(time.time(), 3),
+    }
+
+
+def record_installed_tools(tools, source_url=None, manifest_path=INSTALL_MANIFEST_PATH, background=False):
+    """
+    把 {名稱: 路徑} 寫入安裝清單 (取代同名的舊項目)。background 為 True 時在背景執行緒計算雜湊，
+    用於已存在但尚未記錄的安裝，不延遲啟動。
+    """
+    if background:
+        threading.Thread(target=record_installed_tools, args=(tools, source_url, manifest_path), daemon=True).start()
+        return
+    try:
+        entries = {name: describe_tool(name, path) for name, path in tools.items()}
+    except OSError:
+        return
+    for entry in entries.values():
+        entry["source_url"] = source_url
+    with _manifest_lock:
+        manifest = load_install_manifest(manifest_path)
+        manifest["tools"].update(entries)
+        try:
+            _save_install_manifest(manifest, manifest_path)
+        except OSError:
+            pass # 無法寫入清單時只是下次啟動仍走完整檢查
+    if 'ffmpeg' in tools:
+        get_ffmpeg_capabilities(tools['ffmpeg'], manifest_path) # 安裝時探測一次能力並寫入清單
+
+
+def check_install_manifest(names, manifest_path=INSTALL_MANIFEST_PATH, on_mismatch=None):
+    """
+    啟動時的快速檢查：清單中每個工具都存在且大小與修改時間相符時返回 {名稱: 路徑}，否則返回 None。
+    命中時視需要在背景重新計算雜湊，不符的工具會被標記並以名稱列表呼叫 on_mismatch。
+    """
+    manifest = load_install_manifest(manifest_path)
+    found = {}
+    for name in names:
+        entry = manifest["tools"].get(name)
+        if not entry or entry.get("sha256_mismatch"):
+            return None
+        try:
+            stat = os.stat(entry["path"])
+        except (OSError, KeyError, TypeError):
+            return None
+        if stat.st_size != entry.get("size") or stat.st_mtime_ns != entry.get("mtime_ns"):
+            return None
+        found[name] = entry["path"]
+    if any(time.time() - manifest["tools"][name].get("verified_at", 0) >= INSTALL_REVERIFY_SECONDS for name in names):
+        threading.Thread(target=verify_install_manifest, args=(names, manifest_path, on_mismatch), daemon=True).start()
+    return found
+
+
+def install_manifest_mismatches(names, manifest_path=INSTALL_MANIFEST_PATH):
+    """
+    返回被背景驗證標記為雜湊不符 (需要重新安裝) 的工具名稱。
+    """
+    tools = load_install_manifest(manifest_path)["tools"]
+    return [name for name in names if tools.get(name, {}).get("sha256_mismatch")]
+
+
+def verify_install_manifest(names, manifest_path=INSTALL_MANIFEST_PATH, on_mismatch=None):
+    """
+    重新計算清單中工具的 SHA-256，返回雜湊不符的名稱列表並更新清單 (標記不符或更新驗證時間)。
+    """
+    tools = load_install_manifest(manifest_path)["tools"]
+    mismatched = []
+    verified = []
+    for name in names:
+        entry = tools.get(name)
+        if not entry:
+            continue
+        try:
+            actual = sha256_file(entry["path"])
+        except OSError:
+            actual = None
+        (verified if actual == entry.get("sha256") else mismatched).append(name)
+    with _manifest_lock:
+        manifest = load_install_manifest(manifest_path)
+        for name in verified + mismatched:
+            if name in manifest["tools"]:
+                manifest["tools"][name]["verified_at"] = round(time.time(), 3)
+                if name in mismatched:
+                    manifest["tools"][name]["sha256_mismatch"] = True
+        try:
+            _save_install_manifest(manifest, manifest_path)
+        except OSError:
+            pass
+    if mismatched and on_mismatch is not None:
+        on_mismatch(mismatched)
+    return mismatched
+
+
+# --- FFmpeg 能力探測與快取 ---
+
+# V1 使用 PATH 上的 ffmpeg、V2 使用 driver/ffmpeg/bin 內的版本，兩者的版本與編譯選項都可能不同。
+# 每個執行檔 (以絕對路徑、大小與修改時間識別) 只探測一次：版本、濾鏡與其選項、全域選項與編碼器，
+# 結果存於安裝清單的 ffmpeg_capabilities 並在記憶體中快取，建構命令時依此選擇受支援的最快參數。
+FFMPEG_CAPABILITIES_SCHEMA = 2 # 探測內容改變時遞增，舊的快取結果會被重新探測
+REQUIRED_FFMPEG_FILTERS = ('palettegen', 'paletteuse', 'select', 'fps', 'scale', 'split')
+REQUIRED_FFMPEG_ENCODERS = ('gif',)
+PROBED_FFMPEG_OPTIONS = ('filter_threads', 'filter_complex_threads', 'fps_mode', 'vsync', 'progress', 'stats_period')
+GIF_DIFF_FLAGS = '+offsetting+transdiff' # GIF 編碼器只寫出變化的矩形，矩形內未變化的像素設為透明
+_ffmpeg_capabilities_cache = {}
+_ffmpeg_capabilities_lock = threading.Lock()
+
+
+def _parse_ffmpeg_version(version_line):
+    # "ffmpeg version 7.1-full_build-www.gyan.dev" / "ffmpeg version n6.0" -> [7, 1]；開發版 (N-12345-g...) 無法判斷時返回 None
+    match = re.search(r'version\s+n?(\d+)\.(\d+)', version_line or "")
+    return [int(match.group(1)), int(match.group(2))] if match else None
+
+
+def _parse_ffmpeg_help(help_output):
+    """
+    解析 ffmpeg -h full：返回 (全域/輸出選項名稱集合, {區段名稱: 選項名稱集合})。
+    區段名稱為 "AVOptions:" 前的文字，例如 "paletteuse" 或 "GIF encoder"。
+    """
+    options = set()
+    filter_options = {}
+    section = None
+    for line in help_output.splitlines():
+        if line.endswith("AVOptions:"):
+            section = filter_options.setdefault(line[:-len("AVOptions:")].strip(), set())
+            continue
+        match = re.match(r'-([A-Za-z_]\w*)', line)
+        if match:
+            options.add(match.group(1))
+            continue
+        match = re.match(r' {2}-?([A-Za-z_]\w*)\s+<', line) # 編碼器選項帶 "-"；列舉值的縮排較深，不會被當成選項
+        if match and section is not None:
+            section.add(match.group(1))
+    return options, filter_options
+
+
+def _parse_ffmpeg_listing(listing_output):
+    # -filters / -encoders 的每一行為 "旗標 名稱 說明"，取第二欄
+    return {fields[1] for fields in (line.split() for line in listing_output.splitlines()) if len(fields) >= 2}
+
+
+def probe_ffmpeg_capabilities(ffmpeg_path):
+    """
+    執行 FFmpeg 的查詢命令並返回能力資料 (可寫入 JSON)；無法執行時返回 None。
+    """
+    version = probe_tool_version(ffmpeg_path)
+    if version is None:
+        return None
+    filters = _parse_ffmpeg_listing(_run_tool([ffmpeg_path, '-hide_banner', '-filters']) or "")
+    encoders = _parse_ffmpeg_listing(_run_tool([ffmpeg_path, '-hide_banner', '-encoders']) or "")
+    options, filter_options = _parse_ffmpeg_help(_run_tool([ffmpeg_path, '-hide_banner', '-h', 'full'], timeout=30) or "")
+    # 查詢命令沒有輸出時留空 (視為未知)，而不是記錄成全部不支援
+    return {
+        "schema": FFMPEG_CAPABILITIES_SCHEMA,
+        "version": version,
+        "version_number": _parse_ffmpeg_version(version),
+        "filters": {name: name in filters for name in REQUIRED_FFMPEG_FILTERS} if filters else {},
+        "filter_options": {name: sorted(filter_options[name]) for name in ('palettegen', 'paletteuse') if filter_options.get(name)},
+        "encoder_options": {"gif": sorted(filter_options["GIF encoder"])} if filter_options.get("GIF encoder") else {},
+        "options": {name: name in options for name in PROBED_FFMPEG_OPTIONS} if options else {},
+        "encoders": {name: name in encoders for name in REQUIRED_FFMPEG_ENCODERS} if encoders else {},
+    }
+
+
+class FFmpegCapabilities:
+    """
+    單一 FFmpeg 執行檔的能力，並依此組出受支援的命令列參數。
+    沒有探測資料 (data 為 None，例如無法執行查詢命令) 時假設為近期版本，產生的命令與探測前相同。
+    """
+    def __init__(self, data=None):
+        self.data = data or {}
+        self.known = bool(data)
+
+    @property
+    def version(self):
+        return self.data.get("version")
+
+    def _supports(self, group, name, default=True):
+        # 未探測或該項目未知時返回 default
+        return self.data.get(group, {}).get(name, default)
+
+    def has_filter(self, name):
+        return self._supports("filters", name)
+
+    def has_encoder(self, name):
+        return self._supports("encoders", name)
+
+    def has_option(self, name):
+        return self._supports("options", name)
+
+    def filter_options(self, filter_name, options):
+        """
+        移除濾鏡不支援的 key=value 選項 (例如舊版 paletteuse 沒有 diff_mode)，不支援的選項會讓整個命令失敗。
+        """
+        supported = self.data.get("filter_options", {}).get(filter_name)
+        if not supported or not options:
+            return options
+        return ":".join(item for item in options.split(":") if item.split("=", 1)[0] in supported)
+
+    def timing_args(self):
+        # 保留原始時間戳：-fps_mode 為 5.1 起的名稱，舊版使用 -vsync
+        if self.has_option('fps_mode'):
+            return PASSTHROUGH_TIMING_ARGS
+        if self.has_option('vsync'):
+            return ('-vsync', 'passthrough')
+        return ()
+
+    def progress_args(self, target):
+        # 不支援 -progress 時不輸出機器可讀的進度，只保留一般日誌
+        return ('-progress', target) if self.has_option('progress') else ()
+
+    def gif_diff_args(self):
+        # 確定編碼器沒有 -gifflags 時不加 (未探測時假設支援)
+        supported = self.data.get("encoder_options", {}).get("gif")
+        if supported is not None and 'gifflags' not in supported:
+            return ()
+        return ('-gifflags', GIF_DIFF_FLAGS)
+
+    def filter_thread_args(self, threads):
+        """
+        限制濾鏡圖的執行緒數 (預設為 CPU 數)，同時執行多個工作時避免執行緒過度競爭；threads 為 None 時不限制。
+        """
+        if not threads:
+            return ()
+        args = []
+        if self._supports("options", 'filter_threads', default=False):
+            args += ['-filter_threads', str(threads)]
+        if self._supports("options", 'filter_complex_threads', default=False):
+            args += ['-filter_complex_threads', str(threads)]
+        return tuple(args)
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+def _ffmpeg_identity(ffmpeg_path):
+    # 以 (絕對路徑, 大小, 修改時間) 識別執行檔；"ffmpeg" 這類命令名稱先在 PATH 中解析
+    resolved = ffmpeg_path if os.path.dirname(ffmpeg_path) else (shutil.which(ffmpeg_path) or ffmpeg_path)
+    try:
+        stat = os.stat(resolved)
+    except OSError:
+        return None
+    return os.path.abspath(resolved), stat.st_size, stat.st_mtime_ns
+
+
+def get_ffmpeg_capabilities(ffmpeg_path, manifest_path=INSTALL_MANIFEST_PATH):
+    """
+    返回 FFmpegCapabilities：依序查詢記憶體快取、安裝清單，兩者都未命中時才探測一次並寫回清單。
+    執行檔被替換 (大小或修改時間改變) 時會自動重新探測。
+    """
+    identity = _ffmpeg_identity(ffmpeg_path)
+    if identity is None:
+        return FFmpegCapabilities(None)
+    cached = _ffmpeg_capabilities_cache.get(identity)
+    if cached is not None:
+        return cached
+    with _ffmpeg_capabilities_lock: # 同時啟動的多個工作只探測一次
+        cached = _ffmpeg_capabilities_cache.get(identity)
+        if cached is not None:
+            return cached
+        path, size, mtime_ns = identity
+        entry = load_install_manifest(manifest_path).get("ffmpeg_capabilities", {}).get(path) or {}
+        data = entry.get("capabilities")
+        if entry.get("size") != size or entry.get("mtime_ns") != mtime_ns or (data or {}).get("schema") != FFMPEG_CAPABILITIES_SCHEMA:
+            data = probe_ffmpeg_capabilities(path)
+            if data is not None:
+                with _manifest_lock:
+                    manifest = load_install_manifest(manifest_path)
+                    manifest.setdefault("ffmpeg_capabilities", {})[path] = {"size": size, "mtime_ns": mtime_ns, "capabilities": data}
+                    try:
+                        _save_install_manifest(manifest, manifest_path)
+                    except OSError:
+                        pass # 無法寫入時只在本次執行中快取
+        capabilities = FFmpegCapabilities(data)
+        _ffmpeg_capabilities_cache[identity] = capabilities
+        return capabilities
+
+
+# --- 相依工具解析 (跨平台) ---
+
+# 依序尋找 FFmpeg/FFprobe：環境變數 → 設定檔 → 安裝清單 → ./driver 內的自動安裝版本 → PATH。
+# 只有 Windows 會在找不到時自動下載 (gyan.dev 的建置只提供 Windows 版)，其他平台請使用系統套件。
+FFMPEG_ENV_VAR = 'GIF_ADJUSTER_FFMPEG'
+FFPROBE_ENV_VAR = 'GIF_ADJUSTER_FFPROBE'
+TOOL_ENV_VARS = {"ffmpeg": FFMPEG_ENV_VAR, "ffprobe": FFPROBE_ENV_VAR}
+TOOLS_CONFIG_PATH = os.path.join('.', 'driver', 'tools.json') # {"ffmpeg": "路徑", "ffprobe": "路徑"}
+BUNDLED_FFMPEG_DIR = os.path.join('.', 'driver', 'ffmpeg', 'bin')
+TOOL_BOOTSTRAP_SUPPORTED = os.name == 'nt'
+TOOL_INSTALL_HINT = (
+    f"找不到 FFmpeg/FFprobe：請以系統套件安裝 (例如 apt install ffmpeg 或 dnf install ffmpeg)，"
+    f"或以環境變數 {FFMPEG_ENV_VAR}/{FFPROBE_ENV_VAR} 或設定檔 {TOOLS_CONFIG_PATH} 指定路徑。"
+)
+
+
+class ToolResolutionError(Exception):
+    """環境變數或設定檔明確指定的工具無法使用。"""
+    pass
+
+
+def tool_executable(name):
+    # Windows 上的執行檔名稱帶 .exe
+    return name + '.exe' if os.name == 'nt' else name
+
+
+def bundled_tool_path(name):
+    return os.path.join(BUNDLED_FFMPEG_DIR, tool_executable(name))
+
+
+def load_tools_config(config_path=TOOLS_CONFIG_PATH):
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return config if isinstance(config, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _manifest_entry_matches(entry, tool_path):
+    try:
+        stat = os.stat(tool_path)
+    except OSError:
+        return False
+    return (entry.get("path") == tool_path and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns
+            and not entry.get("sha256_mismatch"))
+
+
+def verify_tool(name, tool_path, manifest_path=INSTALL_MANIFEST_PATH):
+    """
+    確認工具可以執行：與安裝清單記錄的路徑、大小與修改時間相同時不啟動行程，否則執行一次 -version 檢查。
+    """
+    if _manifest_entry_matches(load_install_manifest(manifest_path)["tools"].get(name) or {}, tool_path):
+        return True
+    if not os.path.isfile(tool_path):
+        return False
+    version = probe_tool_version(tool_path)
+    return bool(version) and version.startswith(f"{name} version")
+
+
+def _locate(command):
+    # 不含目錄的名稱在 PATH 中尋找
+    return command if os.path.dirname(command) else shutil.which(command)
+
+
+def resolve_ffmpeg_tools(manifest_path=INSTALL_MANIFEST_PATH, config_path=TOOLS_CONFIG_PATH, on_mismatch=None):
+    """
+    尋找並驗證 FFmpeg/FFprobe，返回 (ffmpeg 路徑, ffprobe 路徑, 來源說明)；找不到時返回 (None, None, None)。
+    環境變數或設定檔指定的工具無法使用時拋出 ToolResolutionError，不會改用其他版本。
+    只指定 ffmpeg 時，ffprobe 預設為同一資料夾中的版本。
+    新找到的工具會在背景記錄到安裝清單，下次啟動只需 os.stat。
+    """
+    config = load_tools_config(config_path)
+    explicit = {}
+    for name in ('ffmpeg', 'ffprobe'):
+        if os.environ.get(TOOL_ENV_VARS[name]):
+            explicit[name] = (os.environ[TOOL_ENV_VARS[name]], f"環境變數 {TOOL_ENV_VARS[name]}")
+        elif config.get(name):
+            explicit[name] = (str(config[name]), config_path)
+    if explicit:
+        if 'ffprobe' not in explicit:
+            ffmpeg_command, source = explicit['ffmpeg']
+            explicit['ffprobe'] = (os.path.join(os.path.dirname(_locate(ffmpeg_command) or ffmpeg_command), tool_executable('ffprobe')), source)
+        if 'ffmpeg' not in explicit:
+            raise ToolResolutionError(f"{explicit['ffprobe'][1]} 只指定了 ffprobe，請同時指定 ffmpeg。")
+        tools = {}
+        for name, (command, source) in explicit.items():
+            tool_path = _locate(command)
+            if not tool_path or not verify_tool(name, tool_path, manifest_path):
+                raise ToolResolutionError(f"{source} 指定的 {name} ({command}) 不存在或無法執行。")
+            tools[name] = tool_path
+        recorded = load_install_manifest(manifest_path)["tools"]
+        if not all(_manifest_entry_matches(recorded.get(name) or {}, tool_path) for name, tool_path in tools.items()):
+            record_installed_tools(tools, manifest_path=manifest_path, background=True)
+        return tools['ffmpeg'], tools['ffprobe'], explicit['ffmpeg'][1]
+
+    manifest_tools = check_install_manifest(('ffmpeg', 'ffprobe'), manifest_path, on_mismatch)
+    if manifest_tools:
+        return manifest_tools['ffmpeg'], manifest_tools['ffprobe'], "安裝清單"
+
+    candidates = []
+    if not install_manifest_mismatches(('ffmpeg', 'ffprobe'), manifest_path): # 雜湊不符的自動安裝版本交給重新安裝
+        candidates.append((bundled_tool_path('ffmpeg'), bundled_tool_path('ffprobe'), "./driver"))
+    candidates.append((shutil.which('ffmpeg'), shutil.which('ffprobe'), "PATH"))
+    for ffmpeg_path, ffprobe_path, source in candidates:
+        if (ffmpeg_path and ffprobe_path and verify_tool('ffmpeg', ffmpeg_path, manifest_path)
+                and verify_tool('ffprobe', ffprobe_path, manifest_path)):
+            record_installed_tools({'ffmpeg': ffmpeg_path, 'ffprobe': ffprobe_path}, manifest_path=manifest_path, background=True)
+            return ffmpeg_path, ffprobe_path, source
+    return None, None, None
+
+
+def native_7z_available():
+    # .7z 可由 py7zr 以 Python 解壓縮 (選用套件)，沒有時才需要 7za
+    import importlib.util
+    return importlib.util.find_spec('py7zr') is not None
+
+
+def extract_archive(archive_path, target_directory, seven_zip_exec_path=None):
+    """
+    以 Python 解壓縮 .zip、.tar (.tar.xz/.tar.gz/.tar.bz2) 與 .7z (需要 py7zr) 到 target_directory。
+    .7z 在沒有安裝 py7zr 時改用 seven_zip_exec_path 指定的 7za 執行檔，兩者都無法使用時拋出 RuntimeError。
+    """
+    import tarfile
+    import zipfile
+    os.makedirs(target_directory, exist_ok=True)
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path, 'r') as zf:
+            zf.extractall(target_directory)
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path, 'r:*') as tf:
+            if hasattr(tarfile, 'data_filter'):
+                tf.extractall(target_directory, filter='data') # 拒絕絕對路徑、.. 與指向外部的連結
+            else:
+                tf.extractall(target_directory)
+    elif native_7z_available():
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, mode='r') as archive:
+            archive.extractall(path=target_directory)
+    elif seven_zip_exec_path and os.path.exists(seven_zip_exec_path):
+        subprocess.run(
+            [seven_zip_exec_path, 'x', archive_path, f'-o{target_directory}', '-y'], check=True, capture_output=True, text=True,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+        )
+    else:
+        raise RuntimeError(f"無法解壓縮 {os.path.basename(archive_path)}：需要安裝 py7zr (pip install py7zr) 或 7za。")
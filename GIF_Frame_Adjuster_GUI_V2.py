@@ -3,16 +3,38 @@ import subprocess
 import re
 import os
 import shutil
-import requests
 import base64
-from alive_progress import alive_bar
+import json
+import tempfile
+import time
+import threading
+import collections
+
+# 啟動時間量測的起點 (標準函式庫載入後、PyQt6 與核心模組載入前)
+STARTUP_STARTED = time.perf_counter()
 
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-    QPushButton, QFileDialog, QTextEdit, QMessageBox, QFrame, QCheckBox
+    QPushButton, QFileDialog, QTextEdit, QMessageBox, QFrame, QCheckBox,
+    QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QSpinBox, QDoubleSpinBox, QProgressBar,
+    QDialog, QDialogButtonBox
+)
+from PyQt6.QtCore import Qt, QThread, pyqtSignal, QUrl, QObject, QRunnable, QThreadPool, QTimer
+from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QDesktopServices, QIntValidator, QCursor, QIcon, QPixmap, QMovie
+
+from GIF_Frame_Adjuster_Core import (
+    GIFFormatError, probe_gif, read_gif_dimensions, default_job_concurrency,
+    FFmpegProgressParser, format_progress, CancelToken, remove_partial_output,
+    PROCESS_TERMINATE_TIMEOUT, DEFAULT_PALETTEGEN_OPTIONS, generate_palette, build_paletteuse_command,
+    single_pass_filter, MemoryLimitExceeded, plan_memory_strategy, decimate_gif,
+    DecimationUnsupported, fps_filter, select_frames_filter, DEFAULT_PALETTEUSE_OPTIONS,
+    plan_kept_frames, rewrite_gif_delays, frame_difference_scores, plan_frames_by_difference, optimize_gif_frames,
+    encode_to_size, format_size_attempt, SIZE_MAX_FULL_ENCODES, render_preview,
+    RunReport, RUN_REPORT_PATH, run_streaming, download_file,
+    check_install_manifest, install_manifest_mismatches, record_installed_tools, get_ffmpeg_capabilities,
+    physical_core_count, resolve_ffmpeg_tools, ToolResolutionError, bundled_tool_path, extract_archive,
+    native_7z_available, TOOL_BOOTSTRAP_SUPPORTED, TOOL_INSTALL_HINT
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QUrl
-from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QDesktopServices, QIntValidator, QCursor, QIcon, QPixmap
 
 # --- 嵌入式圖示資料 ---
 LOGO_ICON_BASE64 = """
@@ -23,46 +45,32 @@ iVBORw0KGgoAAAANSUhEUgAAAgAAAAIACAYAAAD0eNT6AAAACXBIWXMAAA7DAAAOwwHHb6hkAAAAGXRF
 
 # --- FFmpeg 及 7-Zip 自動安裝相關函式 ---
 
-def download_file_with_progress(url, local_filename):
+def download_file_with_progress(url, local_filename, checksum_url=None):
+    from alive_progress import alive_bar # 只在需要下載時載入，不拖慢視窗啟動
+
     print(f"開始下載 {os.path.basename(local_filename)}...")
-    os.makedirs(os.path.dirname(local_filename), exist_ok=True)
-    try:
-        with requests.get(url, stream=True) as r, open(local_filename, 'wb') as f:
-            r.raise_for_status()
-            file_size = int(r.headers.get('content-length', 0))
-            chunk_size = 8192
-            bar_length = file_size // chunk_size if file_size > chunk_size else 1
-            if file_size == 0:
-                print("警告: 檔案大小未知，可能無法顯示精確進度條。")
-                bar_length = 100
-
-            with alive_bar(bar_length, bar='smooth', spinner='dots_waves', length=40, enrich_print=False) as bar:
-                bar.text(f'下載 {os.path.basename(local_filename)} 進度')
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    f.write(chunk)
-                    bar()
-                bar(bar_length)
-
-        print(f"成功下載 {os.path.basename(local_filename)} 到 {local_filename}")
+    with alive_bar(manual=True, bar='smooth', spinner='dots_waves', length=40, enrich_print=False) as bar:
+        bar.text(f'下載 {os.path.basename(local_filename)} 進度')
+        success, message = download_file(
+            url, local_filename, checksum_url=checksum_url,
+            progress_callback=lambda downloaded, total: bar(downloaded / total) if total else None
+        )
+        if success:
+            bar(1.0)
+
+    if success:
+        print(f"成功下載 {os.path.basename(local_filename)} 到 {local_filename}：{message}")
         return local_filename
-    except requests.exceptions.RequestException as e:
-        print(f"下載失敗：{e}")
-        return None
-    except Exception as e:
-        print(f"下載時發生未知錯誤：{e}")
-        return None
+    print(message)
+    return None
 
-def extract_and_rename_archive(archive_path, target_directory, new_foldername, seven_zip_exec_path):
+def extract_and_rename_archive(archive_path, target_directory, new_foldername, seven_zip_exec_path=None):
     print(f"正在解壓縮 {os.path.basename(archive_path)}...")
     if not os.path.exists(target_directory):
         os.makedirs(target_directory)
-    
-    if not os.path.exists(seven_zip_exec_path):
-        print(f"錯誤：解壓縮工具 '{seven_zip_exec_path}' 不存在。無法進行解壓縮。")
-        return None
 
     try:
-        subprocess.run([seven_zip_exec_path, 'x', archive_path, f'-o{target_directory}', '-y'], check=True, capture_output=True, text=True)
+        extract_archive(archive_path, target_directory, seven_zip_exec_path)
         print(f"成功解壓縮 {os.path.basename(archive_path)}")
         
         extracted_items = os.listdir(target_directory)
@@ -121,10 +129,12 @@ def extract_and_rename_archive(archive_path, target_directory, new_foldername, s
         print(f"解壓縮時發生未知錯誤：{e}")
         return None
 
-def get_gif_info_backend(ffprobe_path, input_gif_path):
+def get_gif_info_backend(ffprobe_path, input_gif_path, partial_callback=None):
     """
-    使用指定的 ffprobe 路徑獲取 GIF 的平均幀率、總時長和計算總幀數。
+    優先查詢探測快取，其次以原生 GIF 解析器單次讀取檔案，取得精確總幀數、每幀延遲、尺寸與循環次數；
+    僅在原生解析失敗時才改用指定的 ffprobe 路徑推算。
     同時獲取檔案大小。
+    若提供 partial_callback，會依序回報部分結果 (先檔案大小，再尺寸)，最後才完成完整探測。
     返回一個字典
     """
     info = {
@@ -132,11 +142,50 @@ def get_gif_info_backend(ffprobe_path, input_gif_path):
         "duration": None,
         "total_frames": None,
         "file_size_mib": None,
+        "width": None,
+        "height": None,
+        "frame_delays": None,
+        "loop_count": None,
+        "global_palette_size": None,
+        "local_palette_sizes": None,
         "error": None
     }
 
+    # 1. 獲取檔案大小 (最快取得的資訊，先回報)
+    size_error = None
+    try:
+        file_size_bytes = os.path.getsize(input_gif_path)
+        info["file_size_mib"] = file_size_bytes / (1024 * 1024)
+        if partial_callback:
+            partial_callback({"file_size_mib": info["file_size_mib"]})
+    except Exception as e:
+        size_error = f"警告: 無法獲取檔案大小: {e}"
+
+    # 2. 只讀取標頭取得尺寸
+    if partial_callback:
+        try:
+            width, height = read_gif_dimensions(input_gif_path)
+            partial_callback({"width": width, "height": height})
+        except (GIFFormatError, OSError):
+            pass
+
+    try:
+        # 3. 查詢探測快取，未命中時原生解析 GIF 區塊結構
+        info.update(probe_gif(input_gif_path))
+    except (GIFFormatError, OSError):
+        # 3b. 原生解析失敗時退回 ffprobe；結果沒有每幀延遲與尺寸，不寫入快取
+        _get_gif_info_ffprobe(ffprobe_path, input_gif_path, info)
+
+    if size_error:
+        info["error"] = (info["error"] + "\n" if info["error"] else "") + size_error
+
+    return info
+
+def _get_gif_info_ffprobe(ffprobe_path, input_gif_path, info):
+    """
+    使用 ffprobe 獲取平均幀率與總時長並推算總幀數，結果直接寫入 info。
+    """
     try:
-        # 1. 獲取幀率和時長
         command_info = [
             ffprobe_path,
             '-v', 'error',
@@ -171,52 +220,147 @@ def get_gif_info_backend(ffprobe_path, input_gif_path):
     except Exception as e:
         info["error"] = f"獲取 GIF 資訊時發生未知錯誤：{e}"
 
-    # 2. 獲取檔案大小
-    try:
-        file_size_bytes = os.path.getsize(input_gif_path)
-        info["file_size_mib"] = file_size_bytes / (1024 * 1024)
-    except Exception as e:
-        info["error"] = (info["error"] + "\n" if info["error"] else "") + f"警告: 無法獲取檔案大小: {e}"
-
     if info["avg_fps"] is not None and info["duration"] is not None:
         info["total_frames"] = round(info["avg_fps"] * info["duration"])
 
-    return info
+CANCELLED_MESSAGE = "已取消處理。"
 
-def process_gif_backend(ffmpeg_path, input_gif_path, output_gif_path, target_fps, progress_callback=None, show_progress_messages=True):
+FFMPEG_LOG_TAIL_LINES = 1000 # 記憶體中保留的最後幾行 FFmpeg 日誌 (錯誤訊息用)；完整輸出由 log_callback 逐行寫入工作日誌檔
+
+def _stream_ffmpeg(ffmpeg_command, progress_parser, progress_callback, show_progress_messages, cancel_token, log_line, memory_limit=None):
+    """
+    執行 FFmpeg，由共用的 I/O 執行緒同時讀取 stdout 與 stderr：-progress 行轉為進度回調，其餘交給 log_line。返回返回碼。
+    超過 memory_limit (位元組) 時終止 FFmpeg 並拋出 MemoryLimitExceeded。
+    此回調在共用的 I/O 執行緒上執行，不做檔案寫入；最後的進度快照由呼叫端在結束後記錄。
+    """
+    def on_stderr_line(output_line):
+        if progress_parser.is_progress_line(output_line):
+            snapshot = progress_parser.feed(output_line)
+            if snapshot is not None and progress_callback:
+                progress_callback(format_progress(snapshot), snapshot["percentage"])
+            return
+        log_line(output_line.strip())
+        # 僅當 show_progress_messages 為 True 時才將 FFmpeg 輸出發送給 GUI
+        if progress_callback and show_progress_messages:
+            progress_callback(output_line.strip(), -1) # -1 表示日誌行
+
+    return_code, _, _ = run_streaming(
+        ffmpeg_command, on_stderr_line=on_stderr_line, cancel_token=cancel_token, memory_limit=memory_limit
+    )
+    return return_code
+
+def process_gif_backend(ffmpeg_path, input_gif_path, output_gif_path, target_fps, progress_callback=None, show_progress_messages=True, target_frame_count=None, cancel_token=None,
+                        two_pass=False, palettegen_options=DEFAULT_PALETTEGEN_OPTIONS, memory_limit=None, frame_plan=None, report=None,
+                        filter_threads=None, log_callback=None, optimize=False):
     """
     根據目標幀數計算 FPS，並執行 FFmpeg 命令。
     現在接受進度回調，並可選擇是否顯示詳細進度訊息。
+    FFmpeg 以 -progress 輸出進度，回調的百分比 >= 0 時表示進度更新 (依 target_frame_count 計算)，
+    -1 表示一般日誌行。
+    提供 cancel_token 時可中途取消：FFmpeg 行程樹會被終止，不完整的輸出檔會被刪除。
+    two_pass 為 True 時先產生調色盤 PNG (依來源指紋、fps 與參數快取)，再串流套用 paletteuse，
+    避免 split + palettegen 將整段影片保留在記憶體中。
+    memory_limit (位元組) 為 FFmpeg 常駐記憶體上限，超過時終止並返回失敗。
+    frame_plan 為 (保留幀索引, 每幀延遲) 時改用保留原始延遲的時間模式：以 select 選幀、保留時間戳，
+    完成後把規劃的延遲寫回輸出，不使用 target_fps。
+    report (RunReport) 用於記錄 palette、ffmpeg_encode、rewrite_delays 各階段的時間與 FFmpeg 進度。
+    命令列依 get_ffmpeg_capabilities 的探測結果組成 (時間戳參數、-progress、濾鏡選項)，
+    filter_threads 為每個工作的濾鏡執行緒數 (同時處理多個工作時避免過度競爭)，None 表示使用 FFmpeg 預設。
+    optimize 為 True 時 GIF 編碼器只寫出差異矩形 (-gifflags)。
+    返回的日誌只保留最後 FFMPEG_LOG_TAIL_LINES 行；提供 log_callback 時每一行日誌都會交給它 (例如寫入完整的日誌檔)。
     """
-    ffmpeg_command = [
-        ffmpeg_path,
-        '-y', # 自動覆蓋輸出檔案
-        '-i', input_gif_path,
-        '-vf', f"fps={target_fps:.15f},split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse",
-        output_gif_path
-    ]
-
-    ffmpeg_output_log = []
+    ffmpeg_output_log = collections.deque(maxlen=FFMPEG_LOG_TAIL_LINES)
+
+    def log_line(line):
+        ffmpeg_output_log.append(line)
+        if log_callback is not None:
+            log_callback(line)
+
+    report = report if report is not None else RunReport(None)
+    capabilities = get_ffmpeg_capabilities(ffmpeg_path)
+    palettegen_options = capabilities.filter_options('palettegen', palettegen_options)
+    paletteuse_options = capabilities.filter_options('paletteuse', DEFAULT_PALETTEUSE_OPTIONS)
+    global_args = (*capabilities.progress_args('pipe:2'), *capabilities.filter_thread_args(filter_threads))
+    if frame_plan is not None:
+        frame_filter = select_frames_filter(frame_plan[0])
+        output_args = capabilities.timing_args()
+    else:
+        frame_filter = fps_filter(target_fps)
+        output_args = ()
+    if optimize:
+        output_args = (*output_args, *capabilities.gif_diff_args())
+    progress_parser = FFmpegProgressParser(target_frame_count)
+    if cancel_token is not None and cancel_token.cancelled:
+        return False, CANCELLED_MESSAGE, ffmpeg_output_log
     try:
-        process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8')
-        
-        while True:
-            output_line = process.stderr.readline()
-            if output_line == '' and process.poll() is not None:
-                break
-            if output_line:
-                ffmpeg_output_log.append(output_line.strip())
-                # 僅當 show_progress_messages 為 True 時才將 FFmpeg 輸出發送給 GUI
-                if progress_callback and show_progress_messages: # <--- 這裡新增了條件判斷
-                    progress_callback(output_line.strip(), -1) # -1 表示未知百分比
-
-        return_code = process.poll()
+        if two_pass:
+            if progress_callback:
+                progress_callback("兩階段模式：正在準備調色盤...", -1)
+            with report.stage("palette") as stage:
+                palette_path, from_cache, palette_log = generate_palette(
+                    ffmpeg_path, input_gif_path, frame_filter, palettegen_options, cancel_token=cancel_token,
+                    memory_limit=memory_limit
+                )
+                stage.update(cached=from_cache, status="ok" if palette_path else "failed")
+            for line in palette_log.splitlines():
+                if line.strip():
+                    log_line(line.strip())
+            if cancel_token is not None and cancel_token.cancelled:
+                return False, CANCELLED_MESSAGE, ffmpeg_output_log
+            if palette_path is None:
+                last_lines = "\n".join(list(ffmpeg_output_log)[-10:])
+                return False, f"產生調色盤失敗\n{last_lines}", ffmpeg_output_log
+            if progress_callback:
+                progress_callback("使用快取的調色盤。" if from_cache else "調色盤已產生並快取。", -1)
+            ffmpeg_command = build_paletteuse_command(
+                ffmpeg_path, input_gif_path, palette_path, output_gif_path, frame_filter, paletteuse_options,
+                extra_args=global_args, output_args=output_args
+            )
+        else:
+            ffmpeg_command = [
+                ffmpeg_path,
+                '-y', # 自動覆蓋輸出檔案
+                '-nostats', # 以 -progress 取代不易解析的統計行
+                *global_args,
+                '-i', input_gif_path,
+                '-vf', single_pass_filter(frame_filter, palettegen_options, paletteuse_options),
+                *output_args,
+                output_gif_path
+            ]
+
+        with report.stage("ffmpeg_encode", two_pass=two_pass) as stage:
+            return_code = _stream_ffmpeg(
+                ffmpeg_command, progress_parser, progress_callback, show_progress_messages, cancel_token, log_line,
+                memory_limit=memory_limit
+            )
+            stage["return_code"] = return_code
+            if cancel_token is not None and cancel_token.cancelled:
+                stage["status"] = "cancelled"
+            snapshot = progress_parser.last_snapshot
+            if snapshot is not None:
+                # 與 CLI 相同，只記錄最後的快照
+                report.ffmpeg_progress(snapshot)
+                stage.update(frame=snapshot["frame"], speed=snapshot["speed"])
+        if cancel_token is not None and cancel_token.cancelled:
+            remove_partial_output(output_gif_path)
+            return False, CANCELLED_MESSAGE, ffmpeg_output_log
         if return_code == 0:
+            if frame_plan is not None:
+                with report.stage("rewrite_delays") as stage:
+                    rewritten = rewrite_gif_delays(output_gif_path, frame_plan[1])
+                    stage["status"] = "ok" if rewritten else "skipped"
+            if frame_plan is not None and not rewritten:
+                log_line("輸出幀數與規劃不符，未改寫每幀延遲。")
+                return True, "FFmpeg 處理完成！(輸出幀數與規劃不符，每幀延遲未改寫)", ffmpeg_output_log
             return True, "FFmpeg 處理完成！", ffmpeg_output_log
         else:
-            error_message = f"FFmpeg 執行失敗，返回碼：{return_code}\n{''.join(ffmpeg_output_log[-10:])}"
+            last_lines = "\n".join(list(ffmpeg_output_log)[-10:])
+            error_message = f"FFmpeg 執行失敗，返回碼：{return_code}\n{last_lines}"
             return False, error_message, ffmpeg_output_log
 
+    except MemoryLimitExceeded as e:
+        remove_partial_output(output_gif_path)
+        return False, str(e), ffmpeg_output_log
     except FileNotFoundError:
         return False, "錯誤：找不到 'ffmpeg' 命令。請確認 FFmpeg 已安裝並在 PATH 中。", ffmpeg_output_log
     except Exception as e:
@@ -229,17 +373,9 @@ class InstallerThread(QThread):
     completion_signal = pyqtSignal(bool, str, str, str)
 
     def run(self):
-        self.progress_signal.emit("正在檢查並安裝 7-Zip (7za.exe) 依賴項目...", False)
-        seven_zip_path = self._check_and_install_7z_internal()
-        if seven_zip_path is None:
-            self.completion_signal.emit(False, "7-Zip (7za.exe) 未成功配置，程式無法繼續執行。", "", "")
-            return
-
-        # 在 7-Zip 步驟完成後加入分隔
-        self.progress_signal.emit("", False) # 加入空行作為分隔
-        
+        # 7-Zip 只在 Windows 上需要自動安裝 FFmpeg 且沒有 py7zr 時才會檢查
         self.progress_signal.emit("正在檢查並安裝 FFmpeg 和 FFprobe 依賴項目...", False)
-        ffmpeg_exec, ffprobe_exec = self._check_and_install_ffmpeg_internal(seven_zip_path)
+        ffmpeg_exec, ffprobe_exec = self._check_and_install_ffmpeg_internal()
 
         if ffmpeg_exec is None or ffprobe_exec is None:
             self.completion_signal.emit(False, "FFmpeg/FFprobe 未成功配置，程式無法繼續執行。", "", "")
@@ -248,51 +384,36 @@ class InstallerThread(QThread):
             self.progress_signal.emit("", False) # 加入空行作為分隔
             self.completion_signal.emit(True, "✔️ 依賴項目檢測正常", ffmpeg_exec, ffprobe_exec)
 
-    def _download_file_with_progress_internal(self, url, local_filename):
+    def _report_manifest_mismatch(self, names):
+        # 由背景驗證執行緒呼叫，此時安裝執行緒可能已結束，訊號仍可送到主視窗
+        self.progress_signal.emit(f"警告：{', '.join(names)} 的 SHA-256 與安裝清單不符，下次啟動時將重新安裝。", False)
+
+    def _download_file_with_progress_internal(self, url, local_filename, checksum_url=None):
         self.progress_signal.emit(f"開始下載 {os.path.basename(local_filename)}...", False)
-        os.makedirs(os.path.dirname(local_filename), exist_ok=True)
-        try:
-            with requests.get(url, stream=True) as r, open(local_filename, 'wb') as f:
-                r.raise_for_status()
-                file_size = int(r.headers.get('content-length', 0))
-                downloaded_size = 0
-                chunk_size = 8192
-
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    
-                    if file_size > 0:
-                        self.progress_signal.emit(
-                            f"下載 {os.path.basename(local_filename)} 進度: {downloaded_size / (1024*1024):.2f}/{file_size / (1024*1024):.2f} MiB",
-                            True
-                        )
-                    else:
-                        self.progress_signal.emit(
-                            f"下載 {os.path.basename(local_filename)} 進度: {downloaded_size / (1024*1024):.2f} MiB",
-                            True
-                        )
+        name = os.path.basename(local_filename)
+
+        def on_progress(downloaded, total):
+            if total:
+                self.progress_signal.emit(
+                    f"下載 {name} 進度: {downloaded / (1024*1024):.2f}/{total / (1024*1024):.2f} MiB", True
+                )
+            else:
+                self.progress_signal.emit(f"下載 {name} 進度: {downloaded / (1024*1024):.2f} MiB", True)
 
-            self.progress_signal.emit(f"成功下載 {os.path.basename(local_filename)}。", False)
+        success, message = download_file(url, local_filename, progress_callback=on_progress, checksum_url=checksum_url)
+        if success:
+            self.progress_signal.emit(f"成功下載 {name}：{message}", False)
             return local_filename
-        except requests.exceptions.RequestException as e:
-            self.progress_signal.emit(f"下載失敗：{os.path.basename(local_filename)} - {e}", False)
-            return None
-        except Exception as e:
-            self.progress_signal.emit(f"下載 {os.path.basename(local_filename)} 時發生未知錯誤：{e}", False)
-            return None
+        self.progress_signal.emit(f"下載失敗：{name} - {message}", False)
+        return None
 
-    def _extract_and_rename_archive_internal(self, archive_path, target_directory, new_foldername, seven_zip_exec_path):
+    def _extract_and_rename_archive_internal(self, archive_path, target_directory, new_foldername, seven_zip_exec_path=None):
         self.progress_signal.emit(f"正在解壓縮 {os.path.basename(archive_path)}...", False)
         if not os.path.exists(target_directory):
             os.makedirs(target_directory)
-        
-        if not os.path.exists(seven_zip_exec_path):
-            self.progress_signal.emit(f"錯誤：解壓縮工具 '{seven_zip_exec_path}' 不存在。", False)
-            return None
 
         try:
-            subprocess.run([seven_zip_exec_path, 'x', archive_path, f'-o{target_directory}', '-y'], check=True, capture_output=True, text=True)
+            extract_archive(archive_path, target_directory, seven_zip_exec_path)
             self.progress_signal.emit(f"成功解壓縮 {os.path.basename(archive_path)}。", False)
             
             extracted_items = os.listdir(target_directory)
@@ -351,14 +472,23 @@ class InstallerThread(QThread):
             return None
 
     def _check_and_install_7z_internal(self):
+        if not TOOL_BOOTSTRAP_SUPPORTED:
+            return shutil.which('7za') or shutil.which('7z')
+
         seven_zip_dir = os.path.join('.', 'driver', '7z')
         seven_zip_exec_path = os.path.join(seven_zip_dir, '7za.exe')
 
-        if os.path.exists(seven_zip_exec_path):
+        # 安裝清單命中時只需 os.stat，雜湊在背景驗證
+        manifest_tools = check_install_manifest(('7za',), on_mismatch=self._report_manifest_mismatch)
+        if manifest_tools:
+            return manifest_tools['7za']
+
+        if os.path.exists(seven_zip_exec_path) and not install_manifest_mismatches(('7za',)):
             # self.progress_signal.emit("7-Zip (7za.exe) 已存在。", False)
+            record_installed_tools({'7za': seven_zip_exec_path}, background=True)
             return seven_zip_exec_path
 
-        self.progress_signal.emit("偵測到 7-Zip (7za.exe) 不存在，將嘗試自動安裝...", False)
+        self.progress_signal.emit("偵測到 7-Zip (7za.exe) 不存在或已損毀，將嘗試自動安裝...", False)
         
         seven_zip_download_url = 'https://www.7-zip.org/a/7za920.zip'
         seven_zip_archive_path = os.path.join(seven_zip_dir, '7za920.zip')
@@ -377,6 +507,7 @@ class InstallerThread(QThread):
             
             if os.path.exists(seven_zip_exec_path):
                 self.progress_signal.emit("7-Zip (7za.exe) 安裝完成。", False)
+                record_installed_tools({'7za': seven_zip_exec_path}, source_url=seven_zip_download_url)
                 # 這裡加入一個分隔符
                 self.progress_signal.emit("", False)
                 return seven_zip_exec_path
@@ -387,6 +518,7 @@ class InstallerThread(QThread):
                         if found_7za_path != seven_zip_exec_path:
                             shutil.move(found_7za_path, seven_zip_exec_path)
                             self.progress_signal.emit(f"已將 7za.exe 移動到正確位置。", False)
+                        record_installed_tools({'7za': seven_zip_exec_path}, source_url=seven_zip_download_url)
                         self.progress_signal.emit("", False) # 也在此處加入分隔符
                         return seven_zip_exec_path
                 self.progress_signal.emit("錯誤：解壓縮後未能找到 7za.exe。", False)
@@ -406,22 +538,40 @@ class InstallerThread(QThread):
                 except Exception as e:
                     self.progress_signal.emit(f"刪除 7-Zip 壓縮檔失敗：{e}", False)
 
-    def _check_and_install_ffmpeg_internal(self, seven_zip_exec_path):
-        ffmpeg_exec_path = os.path.join('.', 'driver', 'ffmpeg', 'bin', 'ffmpeg.exe')
-        ffprobe_exec_path = os.path.join('.', 'driver', 'ffmpeg', 'bin', 'ffprobe.exe')
+    def _check_and_install_ffmpeg_internal(self, seven_zip_exec_path=None):
+        ffmpeg_exec_path = bundled_tool_path('ffmpeg')
+        ffprobe_exec_path = bundled_tool_path('ffprobe')
 
-        if os.path.exists(ffmpeg_exec_path) and os.path.exists(ffprobe_exec_path):
-            # self.progress_signal.emit("FFmpeg 和 FFprobe 已存在。", False)
-            return ffmpeg_exec_path, ffprobe_exec_path
+        # 環境變數、設定檔、安裝清單、./driver、PATH 依序尋找並驗證
+        try:
+            ffmpeg_found, ffprobe_found, source = resolve_ffmpeg_tools(on_mismatch=self._report_manifest_mismatch)
+        except ToolResolutionError as e:
+            self.progress_signal.emit(f"錯誤：{e}", False)
+            return None, None
+        if ffmpeg_found:
+            # self.progress_signal.emit(f"FFmpeg 和 FFprobe 已存在 ({source})。", False)
+            return ffmpeg_found, ffprobe_found
+
+        if not TOOL_BOOTSTRAP_SUPPORTED:
+            self.progress_signal.emit(TOOL_INSTALL_HINT, False)
+            return None, None
 
-        self.progress_signal.emit("偵測到 FFmpeg 或 FFprobe 不存在，將嘗試自動安裝...", False)
+        self.progress_signal.emit("偵測到 FFmpeg 或 FFprobe 不存在或已損毀，將嘗試自動安裝...", False)
         
         driver_dir = './driver/'
         ffmpeg_archive_path = os.path.join(driver_dir, 'ffmpeg.7z')
         
         ffmpeg_download_url = 'https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-full.7z'
 
-        if not self._download_file_with_progress_internal(ffmpeg_download_url, ffmpeg_archive_path):
+        # 沒有 py7zr 時才需要 7za 解壓縮 .7z
+        if seven_zip_exec_path is None and not native_7z_available():
+            self.progress_signal.emit("正在檢查並安裝 7-Zip (7za.exe) 依賴項目...", False)
+            seven_zip_exec_path = self._check_and_install_7z_internal()
+            if seven_zip_exec_path is None:
+                self.progress_signal.emit("7-Zip (7za.exe) 未成功配置，無法解壓縮 FFmpeg。", False)
+                return None, None
+
+        if not self._download_file_with_progress_internal(ffmpeg_download_url, ffmpeg_archive_path, checksum_url=ffmpeg_download_url + '.sha256'):
             self.progress_signal.emit("FFmpeg 壓縮檔下載失敗，無法繼續安裝。", False)
             return None, None
         
@@ -438,21 +588,69 @@ class InstallerThread(QThread):
 
         if os.path.exists(ffmpeg_exec_path) and os.path.exists(ffprobe_exec_path):
             self.progress_signal.emit("FFmpeg 和 FFprobe 安裝完成。", False)
+            record_installed_tools({'ffmpeg': ffmpeg_exec_path, 'ffprobe': ffprobe_exec_path}, source_url=ffmpeg_download_url)
             return ffmpeg_exec_path, ffprobe_exec_path
         else:
             self.progress_signal.emit("FFmpeg 和 FFprobe 安裝失敗，請檢查日誌。", False)
             return None, None
 
 
+# --- 啟動時間 ---
+
+# 設定此環境變數時 GUI 在第一次繪製後輸出 {"first_paint": 秒數, "painted_at": 時間戳, "deferred_modules_loaded": [...]} 並結束，
+# 供 GIF_Frame_Adjuster_Bench.py --stages startup 與 tests/test_startup.py 量測冷啟動時間。
+STARTUP_PROBE_ENV_VAR = 'GIF_ADJUSTER_STARTUP_PROBE'
+STARTUP_DEFERRED_MODULES = ('requests', 'alive_progress') # 只在下載時才載入，第一次繪製前不應出現在 sys.modules
+
+
+# --- 日誌節流 ---
+
+LOG_FLUSH_INTERVAL_MS = 100 # 日誌視窗每秒最多更新 10 次，進度訊號也以同樣間隔節流
+LOG_MAX_LINES = 5000 # 日誌視窗保留的最多行數，超過時捨棄最舊的行
+LOG_PENDING_MAX_LINES = 2000 # 兩次更新之間最多暫存的行數，超過時只保留最新的行
+LOG_DIR = os.path.join('.', 'driver', 'logs') # 每個工作的完整日誌檔
+
+
+class LogBuffer:
+    """
+    執行緒安全的環形緩衝：工作執行緒只需加鎖附加，主執行緒的計時器一次取出所有累積的行。
+    緩衝已滿時捨棄最舊的行，取出時以一行說明略過的行數。
+    """
+
+    def __init__(self, max_lines=LOG_PENDING_MAX_LINES):
+        self._lines = collections.deque(maxlen=max_lines)
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def append(self, line):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+
+    def drain(self):
+        with self._lock:
+            lines, dropped = list(self._lines), self._dropped
+            self._lines.clear()
+            self._dropped = 0
+        if dropped:
+            lines.insert(0, f"... (略過 {dropped} 行，完整內容請見日誌檔)")
+        return lines
+
+
+def job_log_path(job_id, input_gif_path):
+    return os.path.join(LOG_DIR, f"{job_id}_{os.path.splitext(os.path.basename(input_gif_path))[0]}.log")
+
+
 # --- GIF 處理的 QThread 執行器 ---
 
 class GIFProcessorThread(QThread):
-    progress_signal = pyqtSignal(str, float) # 日誌訊息, 百分比進度
+    progress_signal = pyqtSignal(str, float) # 日誌訊息或進度摘要, 百分比進度 (-1 表示日誌行)
     completion_signal = pyqtSignal(bool, str, list) # 成功狀態, 訊息, FFmpeg 日誌列表
     info_signal = pyqtSignal(dict) # (可選: 用於將額外資訊傳回 GUI)
 
     # 確保 __init__ 接收 original_gif_info 參數
-    def __init__(self, ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, target_frame_count, original_gif_info, show_ffmpeg_output, parent=None):
+    def __init__(self, ffmpeg_path, ffprobe_path, input_gif_path, output_gif_path, target_frame_count, original_gif_info, show_ffmpeg_output, two_pass=False, memory_limit_mib=0, native_engine=True, preserve_timing=True, content_selection=False, optimize_frames=False, max_output_mib=0.0, report=None, log_sink=None, log_path=None, filter_threads=None, parent=None):
         super().__init__(parent)
         self.ffmpeg_path = ffmpeg_path
         self.ffprobe_path = ffprobe_path
@@ -461,9 +659,91 @@ class GIFProcessorThread(QThread):
         self.target_frame_count = target_frame_count
         self.original_gif_info = original_gif_info # 儲存從主執行緒傳入的原始 GIF 資訊
         self.show_ffmpeg_output = show_ffmpeg_output # 新增這行：儲存是否顯示 FFmpeg 輸出的狀態
-        self.ffmpeg_log = [] # 存放 FFmpeg 輸出訊息
+        self.two_pass = two_pass # 兩階段調色盤 (省記憶體，可重用調色盤快取)
+        self.memory_limit_mib = memory_limit_mib # 低記憶體模式的每工作記憶體上限，0 表示不限制
+        self.native_engine = native_engine # 減少幀數時優先使用原生抽幀 (不重新編碼)
+        self.preserve_timing = preserve_timing # FFmpeg 路徑保留原始每幀延遲 (不以固定 fps 重新取樣)
+        self.content_selection = content_selection # 依相鄰幀差異選幀，優先丟棄近似重複的幀
+        self.optimize_frames = optimize_frames # 編碼器只寫出差異矩形，小型輸出再以子矩形差異重新編碼
+        self.max_output_mib = max_output_mib # 目標檔案大小模式的大小上限，0 表示依目標幀數處理
+        self.chosen_frame_count = None # 目標檔案大小模式實際選定的幀數
+        self.report = report if report is not None else RunReport(None) # 各階段計時的結構化事件
+        self.ffmpeg_log = collections.deque(maxlen=FFMPEG_LOG_TAIL_LINES) # 最後幾行 FFmpeg 輸出訊息
+        self.log_sink = log_sink # LogBuffer：日誌行直接寫入，由主視窗定時批次顯示，不逐行送出訊號
+        self.log_path = log_path # 工作開始時開啟，逐行寫入完整日誌，而非附加到日誌視窗
+        self.log_line_count = 0 # 已寫入日誌檔的行數
+        self._log_file = None
+        self._log_lock = threading.Lock() # FFmpeg 輸出由共用的 I/O 執行緒寫入，其餘由本執行緒寫入
+        self.filter_threads = filter_threads # 每個工作的 FFmpeg 濾鏡執行緒數，None 表示使用 FFmpeg 預設
+        self._last_progress_emit = 0.0
+        self.cancel_token = CancelToken()
+
+    def cancel(self, wait=False):
+        """
+        取消處理：終止 FFmpeg 行程樹並刪除不完整的輸出檔，run() 會在有限時間內返回。
+        可從任何執行緒呼叫；預設不等待行程結束，避免阻塞 GUI。
+        """
+        self.cancel_token.cancel(wait=wait)
+
+    def is_cancelled(self):
+        return self.cancel_token.cancelled
+
+    def _emit_progress(self, message, percentage):
+        """
+        日誌行 (percentage < 0) 寫入 log_sink；進度更新最多每 LOG_FLUSH_INTERVAL_MS 送出一次 (100% 一律送出)。
+        """
+        if percentage < 0:
+            if self.log_sink is not None:
+                self.log_sink.append(f"[{os.path.basename(self.input_gif_path)}] {message}")
+                return
+        else:
+            now = time.monotonic()
+            if percentage < 100 and now - self._last_progress_emit < LOG_FLUSH_INTERVAL_MS / 1000:
+                return
+            self._last_progress_emit = now
+        self.progress_signal.emit(message, percentage)
+
+    def _open_log_file(self):
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+            self._log_file = open(self.log_path, 'w', encoding='utf-8')
+        except OSError as e:
+            self.log_path = None
+            self._emit_progress(f"無法寫入日誌檔: {e}", -1)
+
+    def _close_log_file(self):
+        with self._log_lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+    def _write_log_line(self, line):
+        """
+        把一行寫入工作日誌檔 (不保留在記憶體中)，可由任何執行緒呼叫。
+        """
+        with self._log_lock:
+            if self._log_file is None:
+                return
+            try:
+                self._log_file.write(line + "\n")
+                self.log_line_count += 1
+            except OSError:
+                pass
+
+    def _record_log(self, line):
+        # 寫入日誌檔並保留在最後幾行中
+        self.ffmpeg_log.append(line)
+        self._write_log_line(line)
 
     def run(self):
+        started = time.monotonic()
+        if self.log_path:
+            self._open_log_file()
+        self.report.emit(
+            "job_start", input=self.input_gif_path, output=self.output_gif_path, target_frames=self.target_frame_count,
+            native_engine=self.native_engine, two_pass=self.two_pass, preserve_timing=self.preserve_timing,
+            content_selection=self.content_selection, optimize_frames=self.optimize_frames, max_output_mib=self.max_output_mib
+        )
         try:
             success, message = self.process_gif_internal(
                 self.ffmpeg_path,
@@ -471,13 +751,18 @@ class GIFProcessorThread(QThread):
                 self.output_gif_path,
                 self.target_frame_count
             )
-            self.completion_signal.emit(success, message, self.ffmpeg_log)
         except Exception as e:
-            self.ffmpeg_log.append(f"線程內部錯誤: {str(e)}")
-            self.completion_signal.emit(False, f"處理過程中發生意外錯誤: {str(e)}", self.ffmpeg_log)
+            self._record_log(f"線程內部錯誤: {str(e)}")
+            success, message = False, f"處理過程中發生意外錯誤: {str(e)}"
+        self.report.emit(
+            "job_end", success=success, cancelled=self.is_cancelled(), message=message,
+            seconds=round(time.monotonic() - started, 4), stage_seconds=self.report.stage_seconds()
+        )
+        self._close_log_file()
+        self.completion_signal.emit(success, message, list(self.ffmpeg_log))
 
     def process_gif_internal(self, ffmpeg_path, input_gif_path, output_gif_path, target_frame_count):
-        self.ffmpeg_log = []
+        self.ffmpeg_log.clear()
         
         # 從儲存的 original_gif_info 中獲取資訊
         avg_fps = self.original_gif_info.get("avg_fps")
@@ -485,30 +770,293 @@ class GIFProcessorThread(QThread):
 
         # 新增檢查，以防資訊獲取失敗
         if avg_fps is None or original_total_frames is None or original_total_frames == 0:
-            self.completion_signal.emit(False, "無法獲取原始 GIF 資訊，處理失敗。", self.ffmpeg_log)
             return False, "無法獲取原始 GIF 資訊，處理失敗。"
 
         # 計算新的 FPS
-        if original_total_frames > 0:
-            target_fps = (target_frame_count / original_total_frames) * avg_fps
-        else:
-            target_fps = avg_fps # 如果原始幀數為0，則使用原始FPS (這情況應該很罕見)
+        with self.report.stage("fps_calc") as stage:
+            if original_total_frames > 0:
+                target_fps = (target_frame_count / original_total_frames) * avg_fps
+            else:
+                target_fps = avg_fps # 如果原始幀數為0，則使用原始FPS (這情況應該很罕見)
+            stage["target_fps"] = target_fps
         
+        frame_delays = self.original_gif_info.get("frame_delays")
+
+        # 目標檔案大小模式：目標幀數視為上限，搜尋不超過大小上限的最多幀數與最高品質
+        if self.max_output_mib > 0:
+            return self.process_gif_to_size(ffmpeg_path, input_gif_path, output_gif_path, target_frame_count, frame_delays)
+
+        # 依內容選幀：分析相鄰幀差異，優先丟棄近似重複的幀 (原生與 FFmpeg 路徑共用此規劃)
+        content_plan = None
+        if self.content_selection and frame_delays and target_frame_count < len(frame_delays):
+            try:
+                with self.report.stage("content_analysis") as stage:
+                    scores = frame_difference_scores(
+                        input_gif_path, cancel_token=self.cancel_token,
+                        progress_callback=lambda done, total: self._emit_progress(
+                            f"分析幀差異: {done}/{total} 幀", done * 100.0 / total
+                        )
+                    )
+                    if scores is None:
+                        stage["status"] = "cancelled"
+                        return False, CANCELLED_MESSAGE
+                    content_plan = plan_frames_by_difference(scores, frame_delays, target_frame_count)
+                    stage["kept_frames"] = len(content_plan[0])
+            except (DecimationUnsupported, GIFFormatError) as e:
+                self._emit_progress(f"無法分析幀差異 ({e})，改用平均選幀。", -1)
+
+        # 只減少幀數時先嘗試原生抽幀：直接複製保留幀的 LZW 資料，無法無損處理時改用 FFmpeg
+        if self.native_engine and target_frame_count < original_total_frames:
+            try:
+                with self.report.stage("native_decimate") as stage:
+                    stats = decimate_gif(
+                        input_gif_path, output_gif_path, target_frame_count,
+                        frame_plan=content_plan,
+                        cancel_token=self.cancel_token,
+                        progress_callback=lambda done, total: self._emit_progress(
+                            f"原生抽幀: {done}/{total} 幀", done * 100.0 / total
+                        )
+                    )
+                    if stats is None:
+                        stage["status"] = "cancelled"
+                        return False, CANCELLED_MESSAGE
+                    stage.update(frames=stats["frames"], copied=stats["copied"], recomposited=stats["recomposited"])
+                return True, (
+                    f"原生抽幀完成：保留 {stats['frames']} 幀 (直接複製 {stats['copied']} 幀，"
+                    f"重新合成 {stats['recomposited']} 幀)，未重新量化。"
+                )
+            except (DecimationUnsupported, GIFFormatError) as e:
+                self._emit_progress(f"原生抽幀無法處理此檔案 ({e})，改用 FFmpeg。", -1)
+            except OSError as e:
+                return False, f"寫入輸出檔案失敗：{e}"
+
+        # 保留原始延遲的時間模式：依每幀延遲選出保留幀，總時長精確到百分之一秒，不產生重複幀
+        frame_plan = content_plan
+        if frame_plan is None and self.preserve_timing and frame_delays and target_frame_count <= len(frame_delays):
+            frame_plan = plan_kept_frames(frame_delays, target_frame_count)
+        elif frame_plan is None and self.preserve_timing and target_frame_count > original_total_frames:
+            self._emit_progress("目標幀數多於原始幀數，改用固定 fps 重新取樣 (會產生重複幀)。", -1)
+
+        # 低記憶體模式：依探測到的尺寸估計峰值記憶體，必要時改用兩階段調色盤
+        two_pass = self.two_pass
+        memory_limit = self.memory_limit_mib * 1024 * 1024 if self.memory_limit_mib > 0 else None
+        if memory_limit:
+            two_pass, estimate, fits = plan_memory_strategy(
+                self.original_gif_info.get("width"), self.original_gif_info.get("height"),
+                target_frame_count, memory_limit, two_pass
+            )
+            if estimate is not None:
+                strategy = "兩階段調色盤" if two_pass else "單階段"
+                self._emit_progress(f"低記憶體模式：估計峰值 {estimate / (1024 * 1024):.0f} MiB，使用{strategy}。", -1)
+                if not fits:
+                    return False, f"估計記憶體用量 {estimate / (1024 * 1024):.0f} MiB 超過上限 {self.memory_limit_mib} MiB，已略過。"
+
         # 進行 FFmpeg 處理
         success, message, ffmpeg_log_output = process_gif_backend(
             ffmpeg_path,
             input_gif_path,
             output_gif_path,
             target_fps=target_fps,
-            progress_callback=lambda msg, pct: self.progress_signal.emit(msg, pct),
-            show_progress_messages=self.show_ffmpeg_output # 傳遞是否顯示 FFmpeg 輸出的狀態
+            progress_callback=self._emit_progress,
+            show_progress_messages=self.show_ffmpeg_output, # 傳遞是否顯示 FFmpeg 輸出的狀態
+            target_frame_count=target_frame_count,
+            cancel_token=self.cancel_token,
+            two_pass=two_pass,
+            memory_limit=memory_limit,
+            frame_plan=frame_plan,
+            report=self.report,
+            filter_threads=self.filter_threads,
+            log_callback=self._write_log_line,
+            optimize=self.optimize_frames
         )
-        self.ffmpeg_log.extend(ffmpeg_log_output)
+        self.ffmpeg_log.extend(ffmpeg_log_output) # 已由 log_callback 寫入日誌檔，這裡只保留最後幾行
+
+        # 小型輸出再以子矩形差異重新編碼 (以時間換取大小)，超過 OPTIMIZE_MAX_PIXELS 時只使用編碼器的差異矩形
+        if success and self.optimize_frames:
+            try:
+                with self.report.stage("optimize") as stage:
+                    stats = optimize_gif_frames(
+                        output_gif_path, cancel_token=self.cancel_token,
+                        progress_callback=lambda done, total: self._emit_progress(
+                            f"差異矩形最佳化: {done}/{total} 幀", done * 100.0 / total
+                        )
+                    )
+                    if stats is None:
+                        stage["status"] = "cancelled"
+                    else:
+                        stage.update(applied=stats["applied"], original_size=stats["original_size"], optimized_size=stats["optimized_size"])
+                if stats is None:
+                    remove_partial_output(output_gif_path)
+                    return False, CANCELLED_MESSAGE
+                if stats["applied"]:
+                    message += f" (差異矩形最佳化：{stats['original_size'] / 1024:.1f} KiB → {stats['optimized_size'] / 1024:.1f} KiB)"
+                else:
+                    self._emit_progress("差異矩形最佳化未能縮小檔案，保留 FFmpeg 輸出。", -1)
+            except (DecimationUnsupported, GIFFormatError) as e:
+                self._emit_progress(f"略過差異矩形最佳化 ({e})。", -1)
+            except OSError as e:
+                self._emit_progress(f"差異矩形最佳化失敗 ({e})，保留 FFmpeg 輸出。", -1)
         return success, message
 
+    def process_gif_to_size(self, ffmpeg_path, input_gif_path, output_gif_path, target_frame_count, frame_delays):
+        if not frame_delays:
+            return False, "無法讀取每幀延遲，目標檔案大小模式需要原生解析 GIF。"
+        max_bytes = int(self.max_output_mib * 1024 * 1024)
+        self._emit_progress(f"目標檔案大小模式：上限 {self.max_output_mib:.2f} MiB，最多 {target_frame_count} 幀。", -1)
+        attempts_done = []
+
+        def on_attempt(attempt):
+            attempts_done.append(attempt)
+            self.report.emit("size_attempt", **attempt)
+            line = format_size_attempt(attempt)
+            self._record_log(line)
+            self._emit_progress(line, min(95.0, len(attempts_done) * 100.0 / (SIZE_MAX_FULL_ENCODES + 2)))
+
+        with self.report.stage("size_search", max_bytes=max_bytes) as stage:
+            result = encode_to_size(
+                ffmpeg_path, input_gif_path, output_gif_path, max_bytes, frame_delays, target_frame_count,
+                optimize=self.optimize_frames, cancel_token=self.cancel_token, attempt_callback=on_attempt,
+                memory_limit=self.memory_limit_mib * 1024 * 1024 if self.memory_limit_mib > 0 else None
+            )
+            stage["status"] = "cancelled" if result is None else ("ok" if result["success"] else "failed")
+        if result is None:
+            return False, CANCELLED_MESSAGE
+        if not result["success"]:
+            return False, f"無法達到目標檔案大小：{result['message']}"
+        self.chosen_frame_count = result["frames"]
+        return True, (
+            f"目標檔案大小模式完成：{result['frames']} 幀，縮放 {result['scale'] * 100:.0f}%，{result['colors']} 色，"
+            f"{result['size'] / (1024 * 1024):.2f} MiB (共編碼 {len(result['attempts'])} 次)。"
+        )
+
+
+# --- 快速預覽 ---
+
+class GIFPreviewThread(QThread):
+    """
+    在背景編碼縮小、限時的預覽 GIF (選幀規劃與正式處理相同)。
+    """
+    completion_signal = pyqtSignal(bool, str, str) # 成功/失敗, 訊息, 預覽檔路徑
+
+    def __init__(self, ffmpeg_path, input_gif_path, frame_delays, target_frame_count, parent=None):
+        super().__init__(parent)
+        self.ffmpeg_path = ffmpeg_path
+        self.input_gif_path = input_gif_path
+        self.frame_delays = frame_delays
+        self.target_frame_count = target_frame_count
+        self.cancel_token = CancelToken()
+        handle, self.preview_path = tempfile.mkstemp(prefix='gif_preview_', suffix='.gif')
+        os.close(handle)
+
+    def cancel(self):
+        self.cancel_token.cancel(wait=False)
+
+    def run(self):
+        try:
+            success, message = render_preview(
+                self.ffmpeg_path, self.input_gif_path, self.preview_path, self.frame_delays, self.target_frame_count,
+                cancel_token=self.cancel_token
+            )
+        except Exception as e:
+            success, message = False, f"預覽時發生意外錯誤: {e}"
+        if not success:
+            remove_partial_output(self.preview_path)
+        self.completion_signal.emit(success, message, self.preview_path)
+
+
+class PreviewDialog(QDialog):
+    """
+    以 QMovie 播放預覽，使用者確認後才排入完整解析度的工作。
+    """
+
+    def __init__(self, preview_path, title, message, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"預覽 - {title}")
+        layout = QVBoxLayout(self)
+        self.movie_label = QLabel()
+        self.movie_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.movie = QMovie(preview_path)
+        self.movie_label.setMovie(self.movie)
+        layout.addWidget(self.movie_label)
+        info_label = QLabel(message)
+        info_label.setObjectName("infoLabel")
+        info_label.setWordWrap(True)
+        layout.addWidget(info_label)
+        buttons = QDialogButtonBox()
+        buttons.addButton("確認並開始處理", QDialogButtonBox.ButtonRole.AcceptRole)
+        buttons.addButton("關閉", QDialogButtonBox.ButtonRole.RejectRole)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+        self.movie.start()
+
+    def done(self, result):
+        self.movie.stop()
+        self.movie.setFileName("") # 釋放預覽檔，之後才能刪除
+        super().done(result)
+
+
+# --- GIF 資訊探測的背景工作 ---
+
+class GIFProbeSignals(QObject):
+    partial = pyqtSignal(int, dict) # 工作編號, 部分 GIF 資訊 (檔案大小、尺寸)
+    finished = pyqtSignal(int, dict) # 工作編號, GIF 資訊
+
+
+class GIFProbeTask(QRunnable):
+    """
+    在 QThreadPool 中探測 GIF 資訊，部分結果與最終結果皆以 signal 傳回主執行緒，
+    避免大型檔案或網路磁碟上的探測凍結介面。
+    """
+
+    def __init__(self, job_id, ffprobe_path, input_gif_path, report=None, stage_name="probe"):
+        super().__init__()
+        self.job_id = job_id
+        self.ffprobe_path = ffprobe_path
+        self.input_gif_path = input_gif_path
+        self.report = report if report is not None else RunReport(None)
+        self.stage_name = stage_name # 輸入探測為 probe，輸出檢驗為 verify_probe
+        self.signals = GIFProbeSignals()
+
+    def run(self):
+        with self.report.stage(self.stage_name, path=self.input_gif_path) as stage:
+            try:
+                info = get_gif_info_backend(
+                    self.ffprobe_path,
+                    self.input_gif_path,
+                    partial_callback=lambda partial: self.signals.partial.emit(self.job_id, partial)
+                )
+            except Exception as e:
+                info = {"error": f"獲取 GIF 資訊時發生未知錯誤：{e}"}
+            stage.update(status="failed" if info.get("error") else "ok", total_frames=info.get("total_frames"))
+        self.signals.finished.emit(self.job_id, info)
+
 
 # --- GUI 主應用程式 ---
 
+def collect_gif_paths(paths):
+    """
+    將拖放或選取的檔案與資料夾展開為 GIF 檔案清單 (資料夾會遞迴搜尋)。
+    """
+    gif_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                gif_paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith('.gif'))
+        elif path.lower().endswith('.gif') and os.path.isfile(path):
+            gif_paths.append(path)
+    return gif_paths
+
+# 佇列工作狀態
+JOB_PROBING = "探測中"
+JOB_READY = "待處理"
+JOB_QUEUED = "排隊中"
+JOB_RUNNING = "處理中"
+JOB_DONE = "完成"
+JOB_FAILED = "失敗"
+JOB_CANCELLED = "已取消"
+
 class ClickableFrame(QFrame):
     clicked = pyqtSignal()
 
@@ -525,12 +1073,21 @@ class GIFConverterApp(QWidget):
         self.ffprobe_path = None
         self.current_gif_path = None
         self.current_gif_info = {} # 新增這行：用於儲存原始 GIF 資訊
+        self.jobs = {} # 工作編號 → 佇列工作 (依加入順序)
+        self.next_job_id = 0
+        self.probe_pool = QThreadPool(self)
+        self.preview_thread = None # 目前的預覽編碼執行緒
         
         self.setAcceptDrops(True)
         
+        self.first_paint_seconds = None # 從模組載入到視窗第一次繪製的秒數
+
         self.init_ui()
         self.load_nord_theme()
-        self.start_installer_thread()
+        # 依賴項目檢查延到視窗第一次繪製之後 (見 paintEvent)，檢查完成前停用處理功能
+        self.process_button.setEnabled(False)
+        self.preview_button.setEnabled(False)
+        self.drag_drop_frame_enabled(False)
 
         # 設定視窗圖示
         # 從 Base64 字串載入圖示
@@ -549,7 +1106,7 @@ class GIFConverterApp(QWidget):
     def init_ui(self):
         self.setWindowTitle("GIF 幀數調整工具")
         # self.setGeometry(100, 100, 600, 700)
-        self.setFixedSize(500, 700) # 固定視窗大小
+        self.setFixedSize(560, 930) # 固定視窗大小
 
         main_layout = QVBoxLayout()
         main_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
@@ -571,7 +1128,7 @@ class GIFConverterApp(QWidget):
         
         self.drag_drop_frame.clicked.connect(self.open_file_dialog)
 
-        self.drag_drop_label = QLabel("將 GIF 檔案拖曳到此處，或點擊選擇檔案")
+        self.drag_drop_label = QLabel("將 GIF 檔案或資料夾拖曳到此處，或點擊選擇檔案")
         self.drag_drop_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.drag_drop_label.setWordWrap(True)
         self.drag_drop_label.setObjectName("dragDropLabel")
@@ -580,6 +1137,37 @@ class GIFConverterApp(QWidget):
         main_layout.addWidget(self.drag_drop_frame)
         main_layout.addSpacing(10)
 
+        # 工作佇列
+        self.queue_table = QTableWidget(0, 3)
+        self.queue_table.setObjectName("queueTable")
+        self.queue_table.setHorizontalHeaderLabels(["檔案", "幀數", "狀態"])
+        self.queue_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.queue_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
+        self.queue_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
+        self.queue_table.verticalHeader().setVisible(False)
+        self.queue_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.queue_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.queue_table.setFixedHeight(150)
+        self.queue_table.itemSelectionChanged.connect(self.on_queue_selection_changed)
+        main_layout.addWidget(self.queue_table)
+
+        queue_button_layout = QHBoxLayout()
+        self.cancel_job_button = QPushButton("取消選取工作")
+        self.cancel_job_button.setObjectName("secondaryButton")
+        self.cancel_job_button.clicked.connect(self.cancel_selected_jobs)
+        self.retry_job_button = QPushButton("重試選取工作")
+        self.retry_job_button.setObjectName("secondaryButton")
+        self.retry_job_button.clicked.connect(self.retry_selected_jobs)
+        self.retry_job_button.setEnabled(False) # 選取可重試的工作後才啟用
+        self.clear_finished_button = QPushButton("清除已結束工作")
+        self.clear_finished_button.setObjectName("secondaryButton")
+        self.clear_finished_button.clicked.connect(self.clear_finished_jobs)
+        queue_button_layout.addWidget(self.cancel_job_button)
+        queue_button_layout.addWidget(self.retry_job_button)
+        queue_button_layout.addWidget(self.clear_finished_button)
+        main_layout.addLayout(queue_button_layout)
+        main_layout.addSpacing(10)
+
         info_frame = QFrame()
         info_frame.setFrameShape(QFrame.Shape.StyledPanel)
         info_frame.setObjectName("infoFrame")
@@ -605,19 +1193,60 @@ class GIFConverterApp(QWidget):
         self.target_frames_input.setValidator(QIntValidator(1, 99999))
         target_layout.addWidget(self.target_frames_label)
         target_layout.addWidget(self.target_frames_input)
+        # 目標檔案大小模式：設定時目標幀數視為上限
+        self.max_size_label = QLabel("大小上限:")
+        self.max_size_label.setObjectName("label")
+        self.max_size_input = QDoubleSpinBox()
+        self.max_size_input.setRange(0, 4096)
+        self.max_size_input.setDecimals(2)
+        self.max_size_input.setSingleStep(1)
+        self.max_size_input.setSuffix(" MiB")
+        self.max_size_input.setSpecialValueText("不限制")
+        self.max_size_input.setValue(0)
+        self.max_size_input.setToolTip(
+            "目標檔案大小模式：先取樣估計每幀大小，再搜尋不超過上限的最多幀數 (不超過目標總幀數)，必要時降低調色盤色數與縮放。"
+        )
+        target_layout.addWidget(self.max_size_label)
+        target_layout.addWidget(self.max_size_input)
         main_layout.addLayout(target_layout)
         main_layout.addSpacing(10)
 
         output_name_layout = QHBoxLayout()
-        self.output_name_label = QLabel("輸出檔案名稱:")
+        self.output_name_label = QLabel("輸出檔名範本:")
         self.output_name_label.setObjectName("label")
-        self.output_name_input = QLineEdit("output_250.gif")
-        self.output_name_input.setPlaceholderText("例如: output.gif")
+        self.output_name_input = QLineEdit("{stem}_{frames}.gif")
+        self.output_name_input.setPlaceholderText("可用 {stem} {frames}，例如: {stem}_{frames}.gif")
         output_name_layout.addWidget(self.output_name_label)
         output_name_layout.addWidget(self.output_name_input)
         main_layout.addLayout(output_name_layout)
         main_layout.addSpacing(10)
 
+        concurrency_layout = QHBoxLayout()
+        self.concurrency_label = QLabel("同時處理數:")
+        self.concurrency_label.setObjectName("label")
+        self.concurrency_input = QSpinBox()
+        self.concurrency_input.setRange(1, physical_core_count()) # 與預設值同樣以實體核心數為準
+        self.concurrency_input.setValue(default_job_concurrency())
+        self.concurrency_input.valueChanged.connect(lambda _value: self.start_queued_jobs())
+        concurrency_layout.addWidget(self.concurrency_label)
+        concurrency_layout.addWidget(self.concurrency_input)
+        # 低記憶體模式：每個工作的記憶體上限，0 表示不限制
+        self.memory_limit_label = QLabel("記憶體上限:")
+        self.memory_limit_label.setObjectName("label")
+        self.memory_limit_input = QSpinBox()
+        self.memory_limit_input.setRange(0, 65536)
+        self.memory_limit_input.setSingleStep(256)
+        self.memory_limit_input.setSuffix(" MiB")
+        self.memory_limit_input.setSpecialValueText("不限制")
+        self.memory_limit_input.setValue(0)
+        self.memory_limit_input.setToolTip(
+            "低記憶體模式：依尺寸與幀數估計峰值記憶體，超過時自動改用兩階段調色盤，並在 FFmpeg 超過上限時終止該工作。"
+        )
+        concurrency_layout.addWidget(self.memory_limit_label)
+        concurrency_layout.addWidget(self.memory_limit_input)
+        main_layout.addLayout(concurrency_layout)
+        main_layout.addSpacing(10)
+
         button_layout = QHBoxLayout()
         self.process_button = QPushButton("開始處理 GIF")
         self.process_button.clicked.connect(self.start_gif_processing)
@@ -629,23 +1258,82 @@ class GIFConverterApp(QWidget):
         self.open_output_folder_button.setEnabled(False)
         self.open_output_folder_button.setObjectName("secondaryButton")
 
+        self.preview_button = QPushButton("預覽")
+        self.preview_button.clicked.connect(self.start_preview)
+        self.preview_button.setEnabled(False)
+        self.preview_button.setObjectName("secondaryButton")
+        self.preview_button.setToolTip("以縮小尺寸快速編碼選取工作的開頭幾秒，確認後才排入完整處理。")
+
         button_layout.addWidget(self.process_button)
+        button_layout.addWidget(self.preview_button)
         button_layout.addWidget(self.open_output_folder_button)
         main_layout.addLayout(button_layout)
         main_layout.addSpacing(10)
 
+        # 整體處理進度 (本次排入處理的所有工作平均)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setObjectName("progressBar")
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("0.0%")
+        main_layout.addWidget(self.progress_bar)
+        main_layout.addSpacing(10)
+
         # 新增勾選框
         self.show_ffmpeg_output_checkbox = QCheckBox("顯示詳細輸出日誌")
         self.show_ffmpeg_output_checkbox.setChecked(True) # 預設為勾選
         self.show_ffmpeg_output_checkbox.setObjectName("label")
-        main_layout.addWidget(self.show_ffmpeg_output_checkbox)
+        self.optimize_frames_checkbox = QCheckBox("差異矩形最佳化")
+        self.optimize_frames_checkbox.setChecked(False)
+        self.optimize_frames_checkbox.setObjectName("label")
+        self.optimize_frames_checkbox.setToolTip(
+            "每幀只寫出變化的矩形、未變化的像素設為透明，縮小大部分靜止的畫面 (例如介面錄影)。\n"
+            "小型輸出 (寬x高x幀數不超過 1M 像素) 另以純 Python 重新編碼，多花約 1 秒換取更小的檔案。"
+        )
+        log_options_layout = QHBoxLayout()
+        log_options_layout.addWidget(self.show_ffmpeg_output_checkbox)
+        log_options_layout.addWidget(self.optimize_frames_checkbox)
+        main_layout.addLayout(log_options_layout)
+        main_layout.addSpacing(5)
+
+        # 處理選項
+        options_layout = QHBoxLayout()
+        self.native_engine_checkbox = QCheckBox("原生抽幀")
+        self.native_engine_checkbox.setChecked(True)
+        self.native_engine_checkbox.setObjectName("label")
+        self.native_engine_checkbox.setToolTip("減少幀數時直接複製保留幀，不重新編碼；無法無損處理時改用 FFmpeg。")
+        self.preserve_timing_checkbox = QCheckBox("保留原始幀延遲")
+        self.preserve_timing_checkbox.setChecked(True)
+        self.preserve_timing_checkbox.setObjectName("label")
+        self.preserve_timing_checkbox.setToolTip("依每幀延遲選幀並寫回合併後的延遲，總時長精確且不產生重複幀。")
+        self.two_pass_checkbox = QCheckBox("兩階段調色盤")
+        self.two_pass_checkbox.setChecked(False)
+        self.two_pass_checkbox.setObjectName("label")
+        self.two_pass_checkbox.setToolTip("先產生調色盤再套用，降低記憶體用量，並重用調色盤快取。")
+        self.content_selection_checkbox = QCheckBox("依內容選幀")
+        self.content_selection_checkbox.setChecked(False)
+        self.content_selection_checkbox.setObjectName("label")
+        self.content_selection_checkbox.setToolTip("分析相鄰幀差異，優先合併重複或近似重複的幀，而非平均抽幀。")
+        options_layout.addWidget(self.native_engine_checkbox)
+        options_layout.addWidget(self.content_selection_checkbox)
+        options_layout.addWidget(self.preserve_timing_checkbox)
+        options_layout.addWidget(self.two_pass_checkbox)
+        main_layout.addLayout(options_layout)
         main_layout.addSpacing(5)
 
         self.log_output = QTextEdit()
         self.log_output.setReadOnly(True)
         self.log_output.setObjectName("logOutput")
+        self.log_output.document().setMaximumBlockCount(LOG_MAX_LINES) # 只保留最新的行
         main_layout.addWidget(self.log_output)
 
+        # 日誌先寫入緩衝，由計時器批次附加到日誌視窗，避免逐行更新造成介面卡頓
+        self.log_buffer = LogBuffer()
+        self.log_flush_timer = QTimer(self)
+        self.log_flush_timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self.log_flush_timer.timeout.connect(self.flush_log)
+        self.log_flush_timer.start()
+
         self.setLayout(main_layout)
 
     def load_nord_theme(self):
@@ -753,6 +1441,39 @@ class GIFConverterApp(QWidget):
             color: {nord5};
             font-size: 13px;
         }}
+        QTableWidget#queueTable {{
+            background-color: {nord1};
+            border: 1px solid {nord3};
+            border-radius: 5px;
+            gridline-color: {nord2};
+            color: {nord6};
+            selection-background-color: {nord10};
+        }}
+        QHeaderView::section {{
+            background-color: {nord2};
+            color: {nord5};
+            border: none;
+            padding: 4px;
+        }}
+        QSpinBox {{
+            background-color: {nord1};
+            border: 1px solid {nord3};
+            border-radius: 5px;
+            padding: 5px;
+            color: {nord6};
+        }}
+        QProgressBar#progressBar {{
+            background-color: {nord1};
+            border: 1px solid {nord3};
+            border-radius: 5px;
+            text-align: center;
+            color: {nord6};
+            min-height: 18px;
+        }}
+        QProgressBar#progressBar::chunk {{
+            background-color: {nord14};
+            border-radius: 4px;
+        }}
         QTextEdit#logOutput {{
             background-color: {nord1};
             border: 1px solid {nord3};
@@ -780,12 +1501,29 @@ class GIFConverterApp(QWidget):
         """
         self.setStyleSheet(qss)
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.first_paint_seconds is not None:
+            return
+        self.first_paint_seconds = time.perf_counter() - STARTUP_STARTED
+        if os.environ.get(STARTUP_PROBE_ENV_VAR):
+            # 效能基準模式：輸出啟動時間後直接結束，不檢查依賴項目
+            print(json.dumps({
+                "first_paint": self.first_paint_seconds, "painted_at": time.time(),
+                "deferred_modules_loaded": [name for name in STARTUP_DEFERRED_MODULES if name in sys.modules],
+            }), flush=True)
+            QTimer.singleShot(0, QApplication.instance().quit)
+            return
+        self.append_log(f"視窗已在 {self.first_paint_seconds:.2f} 秒內顯示，開始檢查依賴項目。")
+        QTimer.singleShot(0, self.start_installer_thread)
+
     def start_installer_thread(self):
         self.installer_thread = InstallerThread()
         self.installer_thread.progress_signal.connect(self.update_status_label)
         self.installer_thread.completion_signal.connect(self.on_installer_complete)
         self.installer_thread.start()
         self.process_button.setEnabled(False)
+        self.preview_button.setEnabled(False)
         self.drag_drop_frame_enabled(False)
 
     def on_installer_complete(self, success, message, ffmpeg_path, ffprobe_path):
@@ -794,14 +1532,16 @@ class GIFConverterApp(QWidget):
             self.ffmpeg_path = ffmpeg_path
             self.ffprobe_path = ffprobe_path
             self.process_button.setEnabled(True)
+            self.preview_button.setEnabled(True)
             self.drag_drop_frame_enabled(True)
-            self.drag_drop_label.setText("將 GIF 檔案拖曳到此處，或點擊選擇檔案")
-            self.log_output.append("FFmpeg 及 7-Zip 已準備就緒。請拖曳 GIF 檔案。")
+            self.drag_drop_label.setText("將 GIF 檔案或資料夾拖曳到此處，或點擊選擇檔案")
+            self.append_log("FFmpeg 及 7-Zip 已準備就緒。請拖曳 GIF 檔案或資料夾。")
         else:
             QMessageBox.critical(self, "安裝失敗", message)
-            self.log_output.append(f"安裝失敗：{message}")
+            self.append_log(f"安裝失敗：{message}")
             self.status_label.setText("FFmpeg/7-Zip 安裝失敗。請檢查日誌。")
             self.process_button.setEnabled(False)
+            self.preview_button.setEnabled(False)
             self.drag_drop_frame_enabled(False)
 
     def drag_drop_frame_enabled(self, enabled):
@@ -821,66 +1561,206 @@ class GIFConverterApp(QWidget):
 
         if event.mimeData().hasUrls():
             for url in event.mimeData().urls():
-                if url.isLocalFile() and url.toLocalFile().lower().endswith('.gif'):
-                    event.acceptProposedAction()
-                    self.drag_drop_label.setText("將 GIF 檔案拖曳到此處，或點擊選擇檔案")
-                    return
-        self.drag_drop_label.setText("僅支援 GIF 檔案")
+                if url.isLocalFile():
+                    local_path = url.toLocalFile()
+                    if os.path.isdir(local_path) or local_path.lower().endswith('.gif'):
+                        event.acceptProposedAction()
+                        self.drag_drop_label.setText("將 GIF 檔案或資料夾拖曳到此處，或點擊選擇檔案")
+                        return
+        self.drag_drop_label.setText("僅支援 GIF 檔案或資料夾")
         event.ignore()
 
     def dragLeaveEvent(self, event):
         if self.ffmpeg_path is not None and self.ffprobe_path is not None:
-            self.drag_drop_label.setText("將 GIF 檔案拖曳到此處，或點擊選擇檔案")
+            self.drag_drop_label.setText("將 GIF 檔案或資料夾拖曳到此處，或點擊選擇檔案")
         else:
             self.drag_drop_label.setText("FFmpeg/7-Zip 安裝中...")
         event.accept()
 
     def dropEvent(self, event: QDropEvent):
         if event.mimeData().hasUrls():
-            for url in event.mimeData().urls():
-                if url.isLocalFile() and url.toLocalFile().lower().endswith('.gif'):
-                    self.current_gif_path = url.toLocalFile()
-                    self.input_path_label.setText(f"原始檔案路徑: {os.path.basename(self.current_gif_path)}")
-                    self.log_output.clear()
-                    self.log_output.append(f"已載入檔案：{self.current_gif_path}")
-                    self.get_and_display_gif_info()
-                    event.acceptProposedAction()
-                    return
-        self.drag_drop_label.setText("僅支援 GIF 檔案")
+            local_paths = [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+            gif_paths = collect_gif_paths(local_paths)
+            if gif_paths:
+                self.add_jobs(gif_paths)
+                event.acceptProposedAction()
+                return
+        self.drag_drop_label.setText("僅支援 GIF 檔案或資料夾")
         event.ignore()
 
-    def get_and_display_gif_info(self):
-        if not self.current_gif_path or not os.path.exists(self.current_gif_path):
-            self.original_info_label.setText("原始 GIF 資訊:\n檔案無效。")
-            self.current_gif_info = {} # 清空資訊
+    # --- 工作佇列 ---
+
+    def add_jobs(self, gif_paths):
+        # 已在佇列中且尚未結束的檔案不重複加入
+        active_paths = {
+            os.path.normcase(os.path.abspath(job["path"]))
+            for job in self.jobs.values()
+            if job["status"] not in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+        }
+        added_ids = []
+        for path in gif_paths:
+            key = os.path.normcase(os.path.abspath(path))
+            if key in active_paths:
+                continue
+            active_paths.add(key)
+            job_id = self.next_job_id
+            self.next_job_id += 1
+            self.jobs[job_id] = {
+                "path": path,
+                "info": {},
+                "status": JOB_PROBING,
+                "auto_start": False, # 探測完成後是否直接排入處理
+                "in_run": False, # 是否計入本次整體進度
+                "progress": 0.0,
+                "target_frames": None,
+                "output_path": None,
+                "thread": None,
+                # 結構化事件寫入 RUN_REPORT_PATH (JSON Lines)，以工作編號與檔名區分
+                "report": RunReport(f"{job_id}:{os.path.basename(path)}", RUN_REPORT_PATH),
+            }
+            self._insert_job_row(job_id)
+            self._probe_job(job_id)
+            added_ids.append(job_id)
+
+        if not added_ids:
+            self.append_log("沒有新的檔案加入佇列 (檔案已在佇列中)。")
             return
+        self.append_log(f"已加入 {len(added_ids)} 個檔案到佇列。")
+        if not self.queue_table.selectedItems():
+            self.queue_table.selectRow(self._row_of(added_ids[0]))
+
+    def _probe_job(self, job_id):
+        job = self.jobs[job_id]
+        job["status"] = JOB_PROBING
+        self._update_job_row(job_id)
+        task = GIFProbeTask(job_id, self.ffprobe_path, job["path"], report=job["report"])
+        task.signals.partial.connect(self.on_probe_partial)
+        task.signals.finished.connect(self.on_probe_finished)
+        self.probe_pool.start(task)
+
+    def _insert_job_row(self, job_id):
+        job = self.jobs[job_id]
+        row = self.queue_table.rowCount()
+        self.queue_table.insertRow(row)
+        name_item = QTableWidgetItem(os.path.basename(job["path"]))
+        name_item.setToolTip(job["path"])
+        name_item.setData(Qt.ItemDataRole.UserRole, job_id)
+        self.queue_table.setItem(row, 0, name_item)
+        self.queue_table.setItem(row, 1, QTableWidgetItem("-"))
+        self.queue_table.setItem(row, 2, QTableWidgetItem(job["status"]))
+
+    def _row_of(self, job_id):
+        for row in range(self.queue_table.rowCount()):
+            item = self.queue_table.item(row, 0)
+            if item is not None and item.data(Qt.ItemDataRole.UserRole) == job_id:
+                return row
+        return -1
+
+    def _update_job_row(self, job_id, status_text=None):
+        row = self._row_of(job_id)
+        if row < 0:
+            return
+        job = self.jobs[job_id]
+        total_frames = job["info"].get("total_frames")
+        if total_frames and job["target_frames"]:
+            frames_text = f"{total_frames} → {job['target_frames']}"
+        else:
+            frames_text = str(total_frames) if total_frames else "-"
+        self.queue_table.item(row, 1).setText(frames_text)
+        self.queue_table.item(row, 2).setText(status_text or job["status"])
+        self._update_retry_button()
+
+    def _is_retryable(self, job):
+        # 上一個處理執行緒完全結束 (finished 訊號) 前不可重試，避免在 UI 執行緒等待
+        if job["status"] not in (JOB_FAILED, JOB_CANCELLED):
+            return False
+        return job["thread"] is None or not job["thread"].isRunning()
+
+    def _update_retry_button(self):
+        self.retry_job_button.setEnabled(any(self._is_retryable(self.jobs[job_id]) for job_id in self._selected_job_ids()))
+
+    def _selected_job_ids(self):
+        rows = sorted({index.row() for index in self.queue_table.selectedIndexes()})
+        return [self.queue_table.item(row, 0).data(Qt.ItemDataRole.UserRole) for row in rows]
+
+    def on_probe_partial(self, job_id, partial_info):
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] != JOB_PROBING:
+            return
+        job["info"].update(partial_info)
+        if job_id in self._selected_job_ids():
+            self.display_gif_info(job)
 
-        self.log_output.append("\n正在獲取 GIF 資訊...")
-        info = get_gif_info_backend(self.ffprobe_path, self.current_gif_path)
-        self.current_gif_info = info # 將獲取的資訊儲存到實例變數中
-        
-        if info["error"]:
-            self.original_info_label.setText(f"原始 GIF 資訊:\n錯誤: {info['error']}")
-            self.log_output.append(f"錯誤: {info['error']}")
+    def on_probe_finished(self, job_id, info):
+        job = self.jobs.get(job_id)
+        if job is None: # 工作已被清除
+            return
+        job["info"] = info
+        name = os.path.basename(job["path"])
+        if info.get("error") or not info.get("total_frames"):
+            job["status"] = JOB_FAILED
+            job["auto_start"] = False
+            self.append_log(f"錯誤: 無法獲取 {name} 的 GIF 資訊: {info.get('error') or '沒有有效的幀數'}")
+        elif job["auto_start"]:
+            job["auto_start"] = False
+            job["status"] = JOB_QUEUED
         else:
-            self.original_info_label.setText(
-                f"原始 GIF 資訊:\n"
-                f"  檔案大小: {info['file_size_mib']:.2f} MiB\n"
-                f"  平均幀率 (FPS): {info['avg_fps']:.2f}\n"
-                f"  總時長 (秒): {info['duration']:.2f}\n"
-                f"  推算原始總幀數: {info['total_frames']} 幀"
-            )
-            self.log_output.append("GIF 資訊載入成功。")
-            
-            if info['total_frames'] is not None and info['total_frames'] > 0:
-                if info['total_frames'] < 250 and info['total_frames'] > 0:
-                     self.target_frames_input.setText(str(info['total_frames']))
-                else:
-                    self.target_frames_input.setText("250")
-                
-                base_name = os.path.splitext(os.path.basename(self.current_gif_path))[0]
-                # 帶入檔案的預設名稱規則
-                self.output_name_input.setText(f"{base_name}_{self.target_frames_input.text()}.gif") # 新檔案名稱
+            job["status"] = JOB_READY
+        self._update_job_row(job_id)
+
+        # 佇列中只有一個檔案時，依原始幀數帶入預設目標幀數
+        if len(self.jobs) == 1 and job["status"] == JOB_READY:
+            if info['total_frames'] < 250:
+                self.target_frames_input.setText(str(info['total_frames']))
+            else:
+                self.target_frames_input.setText("250")
+
+        if job_id in self._selected_job_ids():
+            self.on_queue_selection_changed()
+        self.start_queued_jobs()
+
+    def on_queue_selection_changed(self):
+        self._update_retry_button()
+        selected = self._selected_job_ids()
+        if not selected:
+            return
+        job = self.jobs[selected[0]]
+        self.current_gif_path = job["path"]
+        self.current_gif_info = job["info"]
+        self.input_path_label.setText(f"原始檔案路徑: {os.path.basename(self.current_gif_path)}")
+        self.display_gif_info(job)
+
+    def display_gif_info(self, job):
+        info = job["info"]
+        if job["status"] == JOB_PROBING:
+            # 顯示已取得的部分資訊，其餘欄位標示為讀取中
+            lines = ["原始 GIF 資訊:"]
+            if info.get("file_size_mib") is not None:
+                lines.append(f"  檔案大小: {info['file_size_mib']:.2f} MiB")
+            if info.get("width") is not None:
+                lines.append(f"  尺寸: {info['width']} x {info['height']}")
+            lines.append("  總幀數: 讀取中...")
+            self.original_info_label.setText("\n".join(lines))
+            return
+        if info.get("error") or not info.get("total_frames"):
+            self.original_info_label.setText(f"原始 GIF 資訊:\n錯誤: {info.get('error') or '沒有有效的幀數'}")
+            return
+
+        # 原生解析可取得尺寸與精確幀數；退回 ffprobe 時幀數為推算值
+        if info['width'] is not None:
+            size_line = f"  尺寸: {info['width']} x {info['height']}\n"
+            frames_line = f"  原始總幀數: {info['total_frames']} 幀"
+        else:
+            size_line = ""
+            frames_line = f"  推算原始總幀數: {info['total_frames']} 幀"
+        self.original_info_label.setText(
+            f"原始 GIF 資訊:\n"
+            f"  檔案大小: {info['file_size_mib']:.2f} MiB\n"
+            f"{size_line}"
+            f"  平均幀率 (FPS): {info['avg_fps']:.2f}\n"
+            f"  總時長 (秒): {info['duration']:.2f}\n"
+            f"{frames_line}"
+        )
 
     def open_file_dialog(self):
         if self.ffmpeg_path is None or self.ffprobe_path is None:
@@ -890,129 +1770,358 @@ class GIFConverterApp(QWidget):
         file_dialog = QFileDialog(self)
         file_dialog.setWindowTitle("選擇 GIF 檔案")
         file_dialog.setNameFilter("GIF 檔案 (*.gif)")
-        file_dialog.setFileMode(QFileDialog.FileMode.ExistingFile)
+        file_dialog.setFileMode(QFileDialog.FileMode.ExistingFiles)
 
         if file_dialog.exec() == QFileDialog.DialogCode.Accepted:
             selected_files = file_dialog.selectedFiles()
             if selected_files:
-                self.current_gif_path = selected_files[0]
-                self.input_path_label.setText(f"原始檔案路徑: {os.path.basename(self.current_gif_path)}")
-                self.log_output.clear()
-                self.log_output.append(f"已載入檔案：{self.current_gif_path}")
-                self.get_and_display_gif_info()
-                self.drag_drop_label.setText("將 GIF 檔案拖曳到此處，或點擊選擇檔案")
+                self.add_jobs(selected_files)
+                self.drag_drop_label.setText("將 GIF 檔案或資料夾拖曳到此處，或點擊選擇檔案")
+
+    def _read_job_settings(self):
+        """
+        讀取目標幀數與輸出檔名範本，輸入無效時顯示警告並返回 None。
+        """
+        try:
+            target_frames = int(self.target_frames_input.text())
+            if target_frames <= 0:
+                raise ValueError("目標幀數必須是正整數。")
+        except ValueError:
+            QMessageBox.warning(self, "輸入錯誤", "請輸入有效的目標幀數 (正整數)。")
+            return None
+
+        output_template = self.output_name_input.text().strip()
+        try:
+            if not output_template or not output_template.format(stem="x", frames=target_frames).strip():
+                raise ValueError
+        except (KeyError, IndexError, ValueError):
+            QMessageBox.warning(self, "輸入錯誤", "請輸入有效的輸出檔名範本 (可用 {stem} 與 {frames})。")
+            return None
+        if not output_template.lower().endswith('.gif'):
+            output_template += '.gif'
+        return target_frames, output_template
+
+    def _prepare_job(self, job_id, target_frames, output_template):
+        job = self.jobs[job_id]
+        stem = os.path.splitext(os.path.basename(job["path"]))[0]
+        output_file_name = output_template.format(stem=stem, frames=target_frames)
+        job["target_frames"] = target_frames
+        job["output_path"] = os.path.join(os.path.dirname(job["path"]), output_file_name)
+        job["progress"] = 0.0
+        job["in_run"] = True
 
     def start_gif_processing(self):
         if not self.ffmpeg_path or not self.ffprobe_path:
             QMessageBox.warning(self, "錯誤", "FFmpeg/FFprobe 尚未準備好，請等待安裝完成。")
             return
-        if not self.current_gif_path:
-            QMessageBox.warning(self, "錯誤", "請先拖曳或選擇一個 GIF 檔案。")
+        if not self.jobs:
+            QMessageBox.warning(self, "錯誤", "請先拖曳或選擇 GIF 檔案。")
             return
-        # 確保在啟動處理前已經有原始 GIF 資訊
-        if not self.current_gif_info or self.current_gif_info.get("error"):
-            QMessageBox.warning(self, "錯誤", "無法獲取原始 GIF 資訊，請重新載入檔案。")
+
+        settings = self._read_job_settings()
+        if settings is None:
             return
+        target_frames, output_template = settings
 
-        try:
-            target_frames = int(self.target_frames_input.text())
-            if target_frames <= 0:
-                raise ValueError("目標幀數必須是正整數。")
-        except ValueError:
-            QMessageBox.warning(self, "輸入錯誤", "請輸入有效的目標幀數 (正整數)。")
+        queued_count = self._queue_jobs(list(self.jobs), target_frames, output_template)
+        if queued_count == 0:
+            QMessageBox.information(self, "提示", "佇列中沒有待處理的工作。")
             return
-        
-        output_file_name = self.output_name_input.text().strip()
-        if not output_file_name:
-            QMessageBox.warning(self, "輸入錯誤", "請輸入有效的輸出檔案名稱。")
+        self.append_log(f"\n已將 {queued_count} 個工作排入處理 (同時處理數: {self.concurrency_input.value()})。")
+        self._update_overall_progress()
+        self.start_queued_jobs()
+
+    def _queue_jobs(self, job_ids, target_frames, output_template):
+        """
+        將指定工作中待處理 (或探測完成後自動開始) 的工作排入佇列，返回排入的數量。
+        """
+        # 上一輪已全部結束時，重新計算整體進度
+        if not any(job["status"] in (JOB_QUEUED, JOB_RUNNING) or job["auto_start"] for job in self.jobs.values()):
+            for job in self.jobs.values():
+                job["in_run"] = False
+
+        queued_count = 0
+        for job_id in job_ids:
+            job = self.jobs[job_id]
+            if job["status"] == JOB_READY:
+                self._prepare_job(job_id, target_frames, output_template)
+                job["status"] = JOB_QUEUED
+            elif job["status"] == JOB_PROBING and not job["auto_start"]:
+                self._prepare_job(job_id, target_frames, output_template)
+                job["auto_start"] = True
+            else:
+                continue
+            queued_count += 1
+            self._update_job_row(job_id)
+        return queued_count
+
+    def start_preview(self):
+        if not self.ffmpeg_path:
+            QMessageBox.warning(self, "錯誤", "FFmpeg 尚未準備好，請等待安裝完成。")
+            return
+        if self.preview_thread is not None and self.preview_thread.isRunning():
+            QMessageBox.information(self, "提示", "預覽正在編碼中，請稍候。")
+            return
+        candidates = self._selected_job_ids() or list(self.jobs)
+        job_id = next((jid for jid in candidates if self.jobs[jid]["status"] == JOB_READY), None)
+        if job_id is None:
+            QMessageBox.warning(self, "錯誤", "請先選取一個待處理的工作。")
+            return
+        settings = self._read_job_settings()
+        if settings is None:
+            return
+        job = self.jobs[job_id]
+        frame_delays = job["info"].get("frame_delays")
+        if not frame_delays:
+            QMessageBox.warning(self, "錯誤", "無法讀取此檔案的每幀延遲，無法預覽。")
             return
-        if not output_file_name.lower().endswith('.gif'):
-            output_file_name += '.gif'
 
-        output_gif_path = os.path.join(os.path.dirname(self.current_gif_path), output_file_name)
+        self.preview_button.setEnabled(False)
+        self.status_label.setText(f"正在編碼預覽: {os.path.basename(job['path'])}...")
+        self.preview_thread = GIFPreviewThread(self.ffmpeg_path, job["path"], frame_delays, settings[0])
+        self.preview_thread.completion_signal.connect(
+            lambda success, message, preview_path, job_id=job_id, settings=settings:
+                self.on_preview_complete(job_id, settings, success, message, preview_path)
+        )
+        self.preview_thread.start()
 
-        self.log_output.clear()
-        self.log_output.append("開始處理 GIF...")
-        self.process_button.setEnabled(False)
+    def on_preview_complete(self, job_id, settings, success, message, preview_path):
+        self.preview_button.setEnabled(True)
+        self.status_label.setText(message)
+        self.append_log(f"預覽：{message}")
+        job = self.jobs.get(job_id)
+        if not success or job is None: # 失敗，或工作已被清除
+            if not success:
+                QMessageBox.warning(self, "預覽失敗", message)
+            remove_partial_output(preview_path)
+            return
 
-        show_ffmpeg_output = self.show_ffmpeg_output_checkbox.isChecked() # 獲取勾選框狀態
+        target_frames, output_template = settings
+        dialog = PreviewDialog(preview_path, os.path.basename(job["path"]), f"{message}\n目標總幀數: {target_frames} 幀", self)
+        accepted = dialog.exec() == QDialog.DialogCode.Accepted
+        remove_partial_output(preview_path)
+        if not accepted or job_id not in self.jobs:
+            return
+        if self._queue_jobs([job_id], target_frames, output_template):
+            self.append_log(f"\n已將 {os.path.basename(job['path'])} 排入處理。")
+            self._update_overall_progress()
+            self.start_queued_jobs()
+        else:
+            QMessageBox.information(self, "提示", "此工作已不是待處理狀態。")
 
-        # 建立 GIFProcessorThread 時傳遞原始 GIF 資訊
-        self.processor_thread = GIFProcessorThread(
+    def start_queued_jobs(self):
+        running_count = sum(1 for job in self.jobs.values() if job["status"] == JOB_RUNNING)
+        for job_id, job in self.jobs.items():
+            if running_count >= self.concurrency_input.value():
+                break
+            if job["status"] == JOB_QUEUED:
+                self._start_job(job_id)
+                running_count += 1
+
+    def _start_job(self, job_id):
+        job = self.jobs[job_id]
+        show_ffmpeg_output = self.show_ffmpeg_output_checkbox.isChecked() # 獲取勾選框狀態
+        thread = GIFProcessorThread(
             self.ffmpeg_path,
             self.ffprobe_path,
-            self.current_gif_path,
-            output_gif_path,
-            target_frames,
-            self.current_gif_info, # 傳遞儲存的原始 GIF 資訊
-            show_ffmpeg_output # 傳遞勾選框狀態
+            job["path"],
+            job["output_path"],
+            job["target_frames"],
+            job["info"], # 傳遞探測到的原始 GIF 資訊
+            show_ffmpeg_output, # 傳遞勾選框狀態
+            two_pass=self.two_pass_checkbox.isChecked(),
+            memory_limit_mib=self.memory_limit_input.value(),
+            native_engine=self.native_engine_checkbox.isChecked(),
+            preserve_timing=self.preserve_timing_checkbox.isChecked(),
+            content_selection=self.content_selection_checkbox.isChecked(),
+            optimize_frames=self.optimize_frames_checkbox.isChecked(),
+            max_output_mib=self.max_size_input.value(),
+            report=job["report"],
+            log_sink=self.log_buffer,
+            log_path=job_log_path(job_id, job["path"]),
+            filter_threads=max(1, physical_core_count() // self.concurrency_input.value())
+        )
+        thread.progress_signal.connect(lambda msg, pct, job_id=job_id: self.update_processing_progress(job_id, msg, pct))
+        thread.completion_signal.connect(
+            lambda success, message, ffmpeg_log, job_id=job_id: self.on_gif_processing_complete(job_id, success, message, ffmpeg_log)
         )
-        self.processor_thread.info_signal.connect(self.update_original_info_from_thread)
-        self.processor_thread.progress_signal.connect(self.update_processing_progress)
-        self.processor_thread.completion_signal.connect(self.on_gif_processing_complete)
-        self.processor_thread.start()
+        thread.finished.connect(self._update_retry_button)
+        job["thread"] = thread
+        job["status"] = JOB_RUNNING
+        self._update_job_row(job_id)
+        self.append_log(f"開始處理 {os.path.basename(job['path'])} → {os.path.basename(job['output_path'])}")
+        thread.start()
+
+    def cancel_selected_jobs(self):
+        for job_id in self._selected_job_ids():
+            job = self.jobs[job_id]
+            if job["status"] == JOB_QUEUED:
+                job["status"] = JOB_CANCELLED
+                self._update_job_row(job_id)
+                self.append_log(f"已取消 {os.path.basename(job['path'])}。")
+                self._update_overall_progress()
+            elif job["status"] == JOB_PROBING and job["auto_start"]:
+                # 探測仍會完成，但結束後不再自動排入處理
+                job["auto_start"] = False
+                self.append_log(f"已取消 {os.path.basename(job['path'])} 的自動處理。")
+            elif job["status"] == JOB_RUNNING:
+                # FFmpeg 在背景被終止，完成訊號會把狀態設為已取消
+                self.append_log(f"正在取消 {os.path.basename(job['path'])}...")
+                job["thread"].cancel()
+
+    def retry_selected_jobs(self):
+        selected = [job_id for job_id in self._selected_job_ids() if self._is_retryable(self.jobs[job_id])]
+        if not selected:
+            return
+        settings = self._read_job_settings()
+        if settings is None:
+            return
+        target_frames, output_template = settings
+        for job_id in selected:
+            job = self.jobs[job_id]
+            self._prepare_job(job_id, target_frames, output_template)
+            if job["info"].get("error") or not job["info"].get("total_frames"):
+                # 探測失敗的工作重新探測，成功後直接排入處理
+                job["auto_start"] = True
+                self._probe_job(job_id)
+            else:
+                job["status"] = JOB_QUEUED
+                self._update_job_row(job_id)
+        self.start_queued_jobs()
+
+    def clear_finished_jobs(self):
+        for job_id in [job_id for job_id, job in self.jobs.items() if job["status"] in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)]:
+            row = self._row_of(job_id)
+            if row >= 0:
+                self.queue_table.removeRow(row)
+            thread = self.jobs[job_id]["thread"]
+            if thread is not None:
+                thread.wait()
+            del self.jobs[job_id]
 
     def update_original_info_from_thread(self, info):
         # 此處可以選擇性地移除或修改其功能，它主要是在 info_signal 發出時被觸發
         # 目前保持，但不做任何處理，或僅用於進一步的日誌記錄
         pass
 
+    def append_log(self, message):
+        self.log_buffer.append(message)
+
+    def flush_log(self):
+        lines = self.log_buffer.drain()
+        if lines:
+            self.log_output.append("\n".join(lines))
+
     def update_status_label(self, message, is_verbose_update):
         # 總是更新狀態標籤 (上方進度)
         self.status_label.setText(message)
         
         # 只有當 is_verbose_update 為 False (即非實時、簡潔的訊息) 時才追加到日誌 (下方詳細)
         if not is_verbose_update:
-            self.log_output.append(message)
-
-    def update_processing_progress(self, log_message, percentage):
-        # 這裡的 log_message 只有在 "顯示 FFmpeg 詳細輸出日誌" 勾選時才會有內容
-        self.log_output.append(log_message)
-        # 如果需要進度條，可以在這裡更新 QProgressBar
+            self.append_log(message)
+
+    def update_processing_progress(self, job_id, log_message, percentage):
+        job = self.jobs.get(job_id)
+        name = os.path.basename(job["path"]) if job else "?"
+        if percentage >= 0:
+            # 進度更新：更新列狀態、狀態標籤與整體進度條，不寫入日誌
+            if job is None:
+                return
+            job["progress"] = percentage
+            self._update_job_row(job_id, f"{JOB_RUNNING} {percentage:.0f}%")
+            self.status_label.setText(f"{name} {log_message}")
+            self._update_overall_progress()
+            return
+        # 日誌行一般直接寫入 log_buffer，未提供 log_sink 時才會以訊號傳入
+        self.append_log(f"[{name}] {log_message}")
 
-    def on_gif_processing_complete(self, success, message, ffmpeg_log):
-        self.process_button.setEnabled(True)
+    def _update_overall_progress(self):
+        run_jobs = [job for job in self.jobs.values() if job["in_run"]]
+        if not run_jobs:
+            overall = 0.0
+        else:
+            overall = sum(
+                100.0 if job["status"] in (JOB_DONE, JOB_FAILED, JOB_CANCELLED) else job["progress"]
+                for job in run_jobs
+            ) / len(run_jobs)
+        self.progress_bar.setValue(int(overall * 10))
+        self.progress_bar.setFormat(f"{overall:.1f}%")
+
+    def on_gif_processing_complete(self, job_id, success, message, ffmpeg_log):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        if success:
+            job["status"] = JOB_DONE
+        elif job["thread"] is not None and job["thread"].is_cancelled():
+            job["status"] = JOB_CANCELLED
+        else:
+            job["status"] = JOB_FAILED
+        job["progress"] = 100.0
+        if success and job["thread"] is not None and job["thread"].chosen_frame_count is not None:
+            job["target_frames"] = job["thread"].chosen_frame_count # 目標檔案大小模式以實際選定的幀數檢驗
+        self._update_job_row(job_id)
+        self._update_overall_progress()
         self.open_output_folder_button.setEnabled(True)
+        output_gif_path = job["output_path"]
+        target_frames = job["target_frames"]
+        self.last_output_dir = os.path.dirname(output_gif_path)
         # --- 處理結果 (始終顯示) ---
-        self.log_output.append("\n--- 處理結果 ---")
+        self.append_log(f"\n--- 處理結果: {os.path.basename(job['path'])} ---")
         if success:
-            self.log_output.append(f"✅ {message}")
-            # QMessageBox.information(self, "處理完成", message) # 處理完成的彈出訊息
+            self.append_log(f"✅ {message}")
+        elif job["status"] == JOB_CANCELLED:
+            self.append_log(f"⏹ {message}")
         else:
-            self.log_output.append(f"❌ 處理失敗：{message}")
-            QMessageBox.critical(self, "處理失敗", message) # 處理失敗的彈出訊息
-        # --- 檢驗輸出 GIF (始終顯示) ---
-        self.log_output.append("\n--- 檢驗輸出 GIF ---")
-        output_gif_path = os.path.join(os.path.dirname(self.current_gif_path), self.output_name_input.text())
-        info = get_gif_info_backend(self.ffprobe_path, output_gif_path)
-        
-        if info["error"]:
-            self.log_output.append(f"錯誤: 無法檢驗輸出 GIF 資訊: {info['error']}")
+            self.append_log(f"❌ 處理失敗：{message}")
+            if len(self.jobs) == 1:
+                QMessageBox.critical(self, "處理失敗", message) # 處理失敗的彈出訊息
+        # FFmpeg 輸出逐行寫入工作日誌檔，不附加到日誌視窗
+        if job["thread"] is not None and job["thread"].log_path:
+            self.append_log(f"完整日誌 (共 {job['thread'].log_line_count} 行) 已寫入: {os.path.abspath(job['thread'].log_path)}")
+
+        # --- 檢驗輸出 GIF (在背景執行緒探測，完成後顯示) ---
+        if success:
+            task = GIFProbeTask(job_id, self.ffprobe_path, output_gif_path, report=job["report"], stage_name="verify_probe")
+            task.signals.finished.connect(self.on_output_verified)
+            self.probe_pool.start(task)
+
+        self.start_queued_jobs()
+        if not any(job["status"] in (JOB_QUEUED, JOB_RUNNING) for job in self.jobs.values()):
+            done_count = sum(1 for job in self.jobs.values() if job["status"] == JOB_DONE)
+            failed_count = sum(1 for job in self.jobs.values() if job["status"] == JOB_FAILED)
+            self.status_label.setText(f"佇列處理完畢：成功 {done_count} 個，失敗 {failed_count} 個")
+
+    def on_output_verified(self, job_id, info):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        output_gif_path = job["output_path"]
+        target_frames = job["target_frames"]
+        self.append_log(f"\n--- 檢驗輸出 GIF: {os.path.basename(output_gif_path)} ---")
+        if info.get("error"):
+            self.append_log(f"錯誤: 無法檢驗輸出 GIF 資訊: {info['error']}")
+            return
+        self.append_log(
+            f"  檔案名稱: {os.path.basename(output_gif_path)}\n"
+            f"  檔案大小: {info['file_size_mib']:.2f} MiB\n"
+            f"  實際幀率 (FPS): {info['avg_fps']:.2f}\n"
+            f"  實際總時長 (秒): {info['duration']:.2f}\n"
+            f"  實際總幀數: {info['total_frames']} 幀\n"
+            f"  目標總幀數: {target_frames} 幀"
+        )
+        if info['total_frames'] == target_frames:
+            self.append_log("👍 成功達到目標幀數！")
+        elif abs(info['total_frames'] - target_frames) <= 1:
+            self.append_log("👍 實際幀數非常接近目標幀數 (僅有微小誤差)。")
         else:
-            self.log_output.append(
-                f"  檔案名稱: {os.path.basename(output_gif_path)}\n"
-                f"  檔案大小: {info['file_size_mib']:.2f} MiB\n"
-                f"  實際幀率 (FPS): {info['avg_fps']:.2f}\n"
-                f"  實際總時長 (秒): {info['duration']:.2f}\n"
-                f"  實際總幀數: {info['total_frames']} 幀\n"
-                f"  目標總幀數: {self.target_frames_input.text()} 幀"
-            )
-            target_frames = int(self.target_frames_input.text())
-            if info['total_frames'] == target_frames:
-                self.log_output.append("👍 成功達到目標幀數！")
-            elif abs(info['total_frames'] - target_frames) <= 1:
-                    self.log_output.append("👍 實際幀數非常接近目標幀數 (僅有微小誤差)。")
-            else:
-                self.log_output.append("⚠️ 實際幀數與目標幀數存在較大差異。FFmpeg 可能已將 FPS 四捨五入。")
-
-        # 僅當勾選框被選中時，才顯示 FFmpeg 完整日誌
-        if self.show_ffmpeg_output_checkbox.isChecked():
-            self.log_output.append("\n--- FFmpeg 完整日誌 ---\n")
-            self.log_output.append("\n".join(ffmpeg_log))
+            self.append_log("⚠️ 實際幀數與目標幀數存在較大差異。FFmpeg 可能已將 FPS 四捨五入。")
 
     def open_output_folder(self):
-        if self.current_gif_path:
+        output_dir = getattr(self, 'last_output_dir', None)
+        if output_dir is None and self.current_gif_path:
             output_dir = os.path.dirname(self.current_gif_path)
+        if output_dir:
             QDesktopServices.openUrl(QUrl.fromLocalFile(output_dir))
         else:
             QMessageBox.warning(self, "警告", "請先處理一個 GIF 檔案以生成輸出資料夾。")
@@ -1020,18 +2129,29 @@ class GIFConverterApp(QWidget):
     def closeEvent(self, event):
         # 終止並等待 InstallerThread
         if hasattr(self, 'installer_thread') and self.installer_thread.isRunning():
-            self.log_output.append("正在等待安裝執行緒終止...")
+            self.append_log("正在等待安裝執行緒終止...")
             self.installer_thread.quit()
             self.installer_thread.wait()
-            self.log_output.append("安裝執行緒已終止。")
-
-        # 終止並等待 GIFProcessorThread
-        if hasattr(self, 'processor_thread') and self.processor_thread.isRunning():
-            self.log_output.append("正在等待 GIF 處理執行緒終止...")
-            self.processor_thread.quit()
-            self.processor_thread.wait()
-            self.log_output.append("GIF 處理執行緒已終止。")
-            
+            self.append_log("安裝執行緒已終止。")
+
+        # 取消排隊中的工作並等待所有 GIFProcessorThread
+        for job in self.jobs.values():
+            if job["status"] == JOB_QUEUED:
+                job["status"] = JOB_CANCELLED
+        running_threads = [job["thread"] for job in self.jobs.values() if job["thread"] is not None and job["thread"].isRunning()]
+        if running_threads:
+            self.append_log("正在取消 GIF 處理工作...")
+            for thread in running_threads:
+                thread.cancel()
+            for thread in running_threads:
+                thread.wait(int(PROCESS_TERMINATE_TIMEOUT * 2 * 1000))
+            self.append_log("GIF 處理執行緒已終止。")
+
+        if self.preview_thread is not None and self.preview_thread.isRunning():
+            self.preview_thread.cancel()
+            self.preview_thread.wait(int(PROCESS_TERMINATE_TIMEOUT * 2 * 1000))
+
+        self.probe_pool.waitForDone()
         event.accept() # 允許視窗關閉
 
 if __name__ == "__main__":
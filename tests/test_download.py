@@ -0,0 +1,178 @@
+import functools
+import hashlib
+import http.server
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GIF_Frame_Adjuster_Core as core
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+
+DATA = random.Random(1).randbytes(3 * 1024 * 1024 + 123)
+DATA_SHA256 = hashlib.sha256(DATA).hexdigest()
+SEGMENT_BYTES = 256 * 1024 # 測試檔只有 3 MiB，縮小每段下限才會分段並行
+CHUNK = 64 * 1024
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """
+    本機的下載伺服器替身：依 server.ranges 決定是否支援 Range，
+    server.ignore_first_range 為 True 時第一個 Range 請求以 200 回應整個檔案 (模擬中途失去 Range 支援)。
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send()
+
+    def _send(self, head=False):
+        server = self.server
+        requested = self.headers.get('Range')
+        start, end, code = 0, len(DATA) - 1, 200
+        if requested and server.ranges and not head:
+            with server.lock:
+                ignore = server.ignore_first_range
+                server.ignore_first_range = False
+                server.range_requests.append(requested)
+            if not ignore:
+                first, last = requested.split('=', 1)[1].split('-')
+                start, end, code = int(first), int(last) if last else end, 206
+        body = DATA[start:end + 1]
+        self.send_response(code)
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        if code == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if head:
+            return
+        try:
+            for offset in range(0, len(body), CHUNK):
+                self.wfile.write(body[offset:offset + CHUNK])
+                if code == 206:
+                    with server.lock:
+                        server.partial_bytes_sent += min(CHUNK, len(body) - offset)
+                if server.chunk_delay:
+                    time.sleep(server.chunk_delay)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ranges):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.ranges = ranges
+        self.ignore_first_range = False
+        self.chunk_delay = 0
+        self.range_requests = []
+        self.partial_bytes_sent = 0
+        self.lock = threading.Lock()
+
+
+@unittest.skipIf(requests is None, "需要 requests")
+class DownloadFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.target = os.path.join(self.temp_dir, 'ffmpeg.7z')
+        patcher = mock.patch.object(
+            core, 'plan_download_segments',
+            functools.partial(core.plan_download_segments, min_segment_bytes=SEGMENT_BYTES)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.temp_dir, True)
+
+    def start_server(self, ranges=True):
+        server = _Server(ranges)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f'http://127.0.0.1:{server.server_port}/ffmpeg.7z'
+
+    def assert_downloaded(self, result):
+        self.assertTrue(result[0], result[1])
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertFalse(os.path.exists(self.target + core.DOWNLOAD_PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.target + core.DOWNLOAD_STATE_SUFFIX))
+
+    def test_parallel_segments(self):
+        server, url = self.start_server()
+        result = core.download_file(url, self.target, expected_sha256=DATA_SHA256)
+        self.assert_downloaded(result)
+        self.assertEqual(len(server.range_requests), core.DOWNLOAD_SEGMENTS)
+        self.assertIn("段並行", result[1])
+
+    def test_resume_from_part_file(self):
+        server, url = self.start_server()
+        server.chunk_delay = 0.01
+        token = core.CancelToken()
+
+        def cancel_midway(downloaded, total):
+            if downloaded > len(DATA) // 3:
+                token.cancel()
+
+        success, message = core.download_file(url, self.target, progress_callback=cancel_midway, cancel_token=token)
+        self.assertFalse(success)
+        self.assertIn("下次會從中斷處繼續", message)
+        self.assertTrue(os.path.exists(self.target + core.DOWNLOAD_PART_SUFFIX))
+        self.assertTrue(os.path.exists(self.target + core.DOWNLOAD_STATE_SUFFIX))
+
+        server.chunk_delay = 0
+        server.partial_bytes_sent = 0
+        result = core.download_file(url, self.target, expected_sha256=DATA_SHA256)
+        self.assert_downloaded(result)
+        self.assertIn("續傳", result[1])
+        self.assertLess(server.partial_bytes_sent, len(DATA))
+
+    def test_fallback_without_range_support(self):
+        server, url = self.start_server(ranges=False)
+        result = core.download_file(url, self.target, expected_sha256=DATA_SHA256)
+        self.assert_downloaded(result)
+        self.assertEqual(server.range_requests, [])
+        self.assertNotIn("段並行", result[1])
+
+    def test_range_failure_stops_other_segments(self):
+        server, url = self.start_server()
+        server.ignore_first_range = True
+        server.chunk_delay = 0.02 # 其餘分段若下載到底約需 0.24 秒
+        result = core.download_file(url, self.target, expected_sha256=DATA_SHA256)
+        self.assert_downloaded(result)
+        # 第一個分段收到 200 後改以單一連線下載，其他分段應立即停止，而不是把自己的範圍下載完
+        self.assertLess(server.partial_bytes_sent, len(DATA) // 2)
+
+    def test_sha256_mismatch_is_rejected(self):
+        server, url = self.start_server()
+        success, message = core.download_file(url, self.target, expected_sha256='0' * 64)
+        self.assertFalse(success)
+        self.assertIn("SHA-256", message)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.target + core.DOWNLOAD_PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.target + core.DOWNLOAD_STATE_SUFFIX))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GIF_Frame_Adjuster_Bench as bench
+
+
+@unittest.skipIf(importlib.util.find_spec('PyQt6') is None, "需要 PyQt6")
+class StartupBudgetTest(unittest.TestCase):
+    """
+    以 GIF_ADJUSTER_STARTUP_PROBE 啟動 GUI (offscreen 平台)，確認第一次繪製在預算內，且下載用的模組沒有提前載入。
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='gif_startup_')
+        self.addCleanup(shutil.rmtree, self.work_dir, True)
+        patcher = mock.patch.dict(os.environ, {'QT_QPA_PLATFORM': 'offscreen'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_paint_within_budget(self):
+        result = bench.measure_startup(self.work_dir)
+        self.assertTrue(result["ok"], result["message"])
+        self.assertLessEqual(result["first_paint"], bench.STARTUP_BUDGET_SECONDS)
+        self.assertEqual(result["deferred_modules_loaded"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()